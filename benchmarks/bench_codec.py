@@ -0,0 +1,48 @@
+"""
+Benchmark the JSON codecs over the recorded bridge responses.
+
+Run from the repository root with `python -m benchmarks.bench_codec`. Only codecs that
+are installed are measured.
+"""
+import os
+import timeit
+
+from pylutron_caseta.codec import STDLIB_CODEC, available_codecs
+
+RESPONSES_DIR = os.path.join(os.path.dirname(__file__), "..", "tests", "responses")
+NUMBER = 2000
+
+
+def _messages():
+    messages = []
+    for filename in sorted(os.listdir(RESPONSES_DIR)):
+        with open(os.path.join(RESPONSES_DIR, filename), "rb") as ifh:
+            # compact the file so it looks like a message on the wire
+            messages.append(STDLIB_CODEC.dumps(STDLIB_CODEC.loads(ifh.read())))
+    return messages
+
+
+def _rate(codec, messages, decoded) -> float:
+    def _round_trip():
+        for message in messages:
+            codec.loads(message)
+        for obj in decoded:
+            codec.dumps(obj)
+
+    seconds = min(timeit.repeat(_round_trip, number=NUMBER, repeat=5))
+    return NUMBER * len(messages) / seconds
+
+
+def main():
+    """Print the round trip throughput of every available codec."""
+    messages = _messages()
+    decoded = [STDLIB_CODEC.loads(message) for message in messages]
+
+    baseline = _rate(STDLIB_CODEC, messages, decoded)
+    for codec in available_codecs():
+        rate = baseline if codec is STDLIB_CODEC else _rate(codec, messages, decoded)
+        print(f"{codec.name:>8}: {rate:10.0f} messages/s ({rate / baseline:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
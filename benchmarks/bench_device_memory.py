@@ -0,0 +1,62 @@
+"""
+Benchmark the memory used to hold devices.
+
+Run from the repository root with `python -m benchmarks.bench_device_memory`. This
+compares the dicts Smartbridge used to store with the slotted `Device` model for
+10,000 synthetic devices.
+"""
+import gc
+import tracemalloc
+from typing import Any, Callable, Dict
+
+from pylutron_caseta.models import Device
+
+DEVICES = 10000
+
+
+def _as_dict(index: int) -> Dict[str, Any]:
+    return {
+        "device_id": str(index),
+        "current_state": -1,
+        "fan_speed": None,
+        "zone": str(index),
+        "name": f"Room_Light {index}",
+        "type": "WallDimmer",
+        "model": "PD-6WCL-XX",
+        "serial": index,
+    }
+
+
+def _as_device(index: int) -> Device:
+    return Device(
+        device_id=str(index),
+        zone=str(index),
+        name=f"Room_Light {index}",
+        type="WallDimmer",
+        model="PD-6WCL-XX",
+        serial=index,
+    )
+
+
+def _measure(factory: Callable[[int], Any]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    devices = {str(index): factory(index) for index in range(DEVICES)}
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del devices
+    return allocated
+
+
+def main():
+    """Print the memory used by each representation."""
+    for name, factory in (("dict", _as_dict), ("Device", _as_device)):
+        allocated = _measure(factory)
+        print(
+            f"{name:>8}: {allocated / 1024:8.0f} KiB total, "
+            f"{allocated / DEVICES:6.0f} bytes/device"
+        )
+
+
+if __name__ == "__main__":
+    main()
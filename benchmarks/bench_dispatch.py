@@ -0,0 +1,82 @@
+"""
+Benchmark routing unsolicited messages to handlers.
+
+Run from the repository root with `python -m benchmarks.bench_dispatch`. This
+compares calling every handler and letting each check the message, as
+`LeapProtocol` used to, with `MessageRouter`, for a growing number of handlers that
+each want the status of a single zone.
+"""
+import timeit
+from typing import Callable, List
+
+from pylutron_caseta.leap import MessageRouter
+from pylutron_caseta.messages import Response, ResponseHeader
+
+MESSAGES = [
+    Response(
+        CommuniqueType="ReadResponse",
+        Header=ResponseHeader(MessageBodyType="OneZoneStatus", Url=f"/zone/{i}/status"),
+    )
+    for i in range(1, 101)
+]
+ROUNDS = 100
+
+
+def _zone_handler(url: str) -> Callable[[Response], None]:
+    def _handler(response: Response):
+        if (
+            response.CommuniqueType == "ReadResponse"
+            and response.Header.MessageBodyType == "OneZoneStatus"
+            and response.Header.Url == url
+        ):
+            pass
+
+    return _handler
+
+
+def _broadcast(handler_count: int) -> Callable[[], None]:
+    handlers: List[Callable[[Response], None]] = [
+        _zone_handler(f"/zone/{i}/status") for i in range(1, handler_count + 1)
+    ]
+
+    def _dispatch():
+        for message in MESSAGES:
+            for handler in handlers:
+                handler(message)
+
+    return _dispatch
+
+
+def _routed(handler_count: int) -> Callable[[], None]:
+    router = MessageRouter()
+    for i in range(1, handler_count + 1):
+        router.add(
+            lambda response: None,
+            communique_type="ReadResponse",
+            body_type="OneZoneStatus",
+            url=f"/zone/{i}/status",
+        )
+
+    def _dispatch():
+        for message in MESSAGES:
+            router.dispatch(message)
+
+    return _dispatch
+
+
+def main():
+    """Print the time per message for each way of dispatching."""
+    count = len(MESSAGES) * ROUNDS
+    for handler_count in (1, 10, 100):
+        for name, factory in (("broadcast", _broadcast), ("routed", _routed)):
+            elapsed = min(
+                timeit.repeat(factory(handler_count), number=ROUNDS, repeat=5)
+            )
+            print(
+                f"{name:>10} {handler_count:>4} handlers: "
+                f"{elapsed * 1e9 / count:7.0f} ns/message"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark splitting the LEAP stream into messages.
+
+Run from the repository root with `python -m benchmarks.bench_framing`. This compares
+the previous `readline` based loop with the chunked reader used by `LeapProtocol.run`.
+The two run at about the same rate; the chunked reader is used because it is not
+bound by the stream's buffer limit, not because it is faster.
+"""
+import asyncio
+import json
+import os
+import time
+
+from pylutron_caseta.leap import _DEFAULT_LIMIT, _LineReader
+
+RESPONSES_DIR = os.path.join(os.path.dirname(__file__), "..", "tests", "responses")
+REPEAT = 2000
+
+
+def _stream() -> bytes:
+    messages = []
+    for filename in sorted(os.listdir(RESPONSES_DIR)):
+        with open(os.path.join(RESPONSES_DIR, filename), "r") as ifh:
+            messages.append(json.dumps(json.load(ifh)).encode("UTF-8") + b"\r\n")
+    return b"".join(messages) * REPEAT
+
+
+def _reader(data: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader(limit=_DEFAULT_LIMIT)
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+async def _readline_loop(data: bytes) -> int:
+    reader = _reader(data)
+    count = 0
+    while not reader.at_eof():
+        received = await reader.readline()
+        if received == b"":
+            break
+        json.loads(received.decode("UTF-8"))
+        count += 1
+    return count
+
+
+async def _line_reader_loop(data: bytes) -> int:
+    lines = _LineReader(_reader(data))
+    count = 0
+    while True:
+        received = await lines.readline()
+        if received == b"":
+            break
+        json.loads(received)
+        count += 1
+    return count
+
+
+def _bench(name: str, loop, data: bytes):
+    start = time.perf_counter()
+    count = asyncio.run(loop(data))
+    elapsed = time.perf_counter() - start
+    print(f"{name:>12}: {count / elapsed:10.0f} messages/s")
+
+
+def main():
+    """Print the message throughput of each framing strategy."""
+    data = _stream()
+    _bench("readline", _readline_loop, data)
+    _bench("_LineReader", _line_reader_loop, data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Benchmark extracting ids from hrefs.
+
+Run from the repository root with `python -m benchmarks.bench_href`. This compares
+the regular expression `id_from_href` used to run with the split based
+`parse_href`, with and without its cache, on the hrefs in a burst of zone and
+occupancy status messages.
+"""
+import re
+import timeit
+
+from pylutron_caseta.leap import parse_href
+
+_HREFRE = re.compile(r"/(?:\D+)/(\d+)(?:\/\D+)?")
+HREFS = [f"/zone/{i}" for i in range(1, 201)] + [
+    f"/occupancygroup/{i}/status" for i in range(1, 21)
+]
+ROUNDS = 200
+
+
+def _regex(href: str) -> str:
+    match = _HREFRE.match(href)
+    if match is None:
+        raise ValueError(href)
+    return match.group(1)
+
+
+def _split(href: str) -> str:
+    return parse_href.__wrapped__(href).id  # type: ignore
+
+
+def _cached(href: str) -> str:
+    return parse_href(href).id
+
+
+def main():
+    """Print the time per href for each parser."""
+    count = len(HREFS) * ROUNDS
+    for name, parse in (("regex", _regex), ("split", _split), ("cached", _cached)):
+        elapsed = min(
+            timeit.repeat(
+                lambda parse=parse: [parse(href) for href in HREFS],
+                number=ROUNDS,
+                repeat=5,
+            )
+        )
+        print(f"{name:>8}: {elapsed * 1e9 / count:6.0f} ns/href")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark allocations made when decoding responses.
+
+Run from the repository root with `python -m benchmarks.bench_messages`. This
+compares building every part of a response up front, as the NamedTuple version of
+`Response` did, with the lazy `Response.from_json` for a handler that only reads the
+body.
+"""
+import gc
+import tracemalloc
+from typing import Callable, List
+
+from pylutron_caseta.messages import Response, ResponseHeader
+
+MESSAGES = 10000
+
+
+def _message(index: int) -> dict:
+    return {
+        "CommuniqueType": "ReadResponse",
+        "Header": {
+            "MessageBodyType": "OneZoneStatus",
+            "StatusCode": "200 OK",
+            "Url": f"/zone/{index}/status",
+        },
+        "Body": {"ZoneStatus": {"Level": 50, "Zone": {"href": f"/zone/{index}"}}},
+    }
+
+
+def _eager(data: dict) -> Response:
+    return Response(
+        Header=ResponseHeader.from_json(data.get("Header", {})),
+        CommuniqueType=data.get("CommuniqueType", None),
+        Body=data.get("Body", None),
+    )
+
+
+def _measure(decode: Callable[[dict], Response]) -> float:
+    """Get the bytes allocated per message that are still alive after decoding."""
+    data = [_message(index) for index in range(MESSAGES)]
+    responses: List[Response] = []
+
+    gc.collect()
+    tracemalloc.start()
+    for item in data:
+        response = decode(item)
+        assert response.Body is not None
+        responses.append(response)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return allocated / MESSAGES
+
+
+def main():
+    """Print the allocations per message for eager and lazy decoding."""
+    print(f"   eager: {_measure(_eager):6.0f} bytes/message")
+    print(f"    lazy: {_measure(Response.from_json):6.0f} bytes/message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Benchmark Smartbridge by replaying a LEAP session.
+
+Run from the repository root with `python -m benchmarks.bench_replay`. By default
+this replays a synthetic session of zone status events for 100 dimmers; pass
+`--session` to replay one recorded with `benchmarks.capture_session` instead. The
+session is served over a local TCP socket by `benchmarks.session.ReplayBridge`,
+and the Smartbridge logs in and handles every event as it would with a real bridge.
+
+This reports the messages handled per second, the latency from writing a zone
+status event to the device subscriber being called, and the peak memory allocated
+while replaying. Memory is measured in a second pass, since tracing allocations
+slows everything down. At full speed, events arrive faster than they are handled,
+so the latency includes the time spent waiting behind earlier events; use
+`--speed 1` to see the latency at the recorded pace.
+"""
+import argparse
+import asyncio
+from collections import defaultdict, deque
+from functools import partial
+import time
+import tracemalloc
+from typing import Any, Deque, Dict, List, NamedTuple, Optional
+
+from pylutron_caseta.leap import id_from_href, open_connection
+from pylutron_caseta.smartbridge import Smartbridge
+
+from .session import ReplayBridge, SessionEvent, load_session, synthetic_session
+
+# give up on a replay that makes no progress for this many seconds
+STALL_TIMEOUT = 30.0
+
+
+class ReplayResult(NamedTuple):
+    """The measurements from one replay."""
+
+    messages: int
+    elapsed: float
+    latencies: List[float]
+    peak_memory: Optional[int]
+
+
+def _zone_of(message: Dict[str, Any]) -> Optional[str]:
+    status = (message.get("Body") or {}).get("ZoneStatus")
+    if status is None:
+        return None
+    return id_from_href(status["Zone"]["href"])
+
+
+async def replay(
+    events: List[SessionEvent], speed: Optional[float], memory: bool = False
+) -> ReplayResult:
+    """Replay a session against a Smartbridge and measure how it keeps up."""
+    server = ReplayBridge(events, speed)
+    host, port = await server.start()
+    if memory:
+        tracemalloc.start()
+
+    bridge = Smartbridge(partial(open_connection, host, port))
+    try:
+        await asyncio.wait_for(bridge.connect(), STALL_TIMEOUT)
+
+        # the send time of each event that is waiting for its device's callback
+        pending: Dict[str, Deque[float]] = defaultdict(deque)
+        latencies: List[float] = []
+        zones = set()
+        expected = 0
+        last_callback = time.perf_counter()
+
+        def on_event(message: Dict[str, Any]):
+            nonlocal expected
+            zone = _zone_of(message)
+            if zone is not None and zone in zones:
+                pending[zone].append(time.perf_counter())
+                expected += 1
+
+        def on_callback(zone: str):
+            nonlocal last_callback
+            queue = pending[zone]
+            if queue:
+                last_callback = time.perf_counter()
+                latencies.append(last_callback - queue.popleft())
+
+        for device in bridge.get_devices().values():
+            if device.zone is not None:
+                zones.add(device.zone)
+                bridge.add_subscriber(
+                    device.device_id, partial(on_callback, device.zone)
+                )
+        server.on_event = on_event
+
+        started = time.perf_counter()
+        server.start_stream()
+        messages = await asyncio.wait_for(
+            server.finished,
+            STALL_TIMEOUT + server.stream_length * _pace(events, speed),
+        )
+        while len(latencies) < expected:
+            if time.perf_counter() - last_callback > STALL_TIMEOUT:
+                raise RuntimeError("the replay stalled")
+            await asyncio.sleep(0.001)
+        elapsed = max(last_callback, time.perf_counter()) - started
+
+        peak_memory = None
+        if memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+        return ReplayResult(messages, elapsed, latencies, peak_memory)
+    finally:
+        if memory:
+            tracemalloc.stop()
+        await bridge.close()
+        await server.close()
+
+
+def _pace(events: List[SessionEvent], speed: Optional[float]) -> float:
+    """Get the longest gap between events at the replay speed."""
+    if speed is None or len(events) < 2:
+        return 0.0
+    return max(later.t - earlier.t for earlier, later in zip(events, events[1:])) / (
+        speed
+    )
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    """Replay a session and print the throughput, latency and memory."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--session", help="a session recorded as JSON lines")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=None,
+        help="replay at this multiple of the recorded pace instead of at full speed",
+    )
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--events", type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.session is not None:
+        with open(args.session, "r") as ifh:
+            events = load_session(ifh)
+        name = args.session
+    else:
+        events = synthetic_session(devices=args.devices, events=args.events)
+        name = f"synthetic, {args.devices} devices"
+
+    result = asyncio.run(replay(events, args.speed))
+    memory = asyncio.run(replay(events, args.speed, memory=True))
+
+    pace = "full speed" if args.speed is None else f"{args.speed}x recorded pace"
+    print(f"session: {name}, {pace}")
+    print(
+        f"{result.messages} messages in {result.elapsed:.2f} s: "
+        f"{result.messages / result.elapsed:8.0f} messages/s"
+    )
+    if result.latencies:
+        print(
+            "callback latency: "
+            + ", ".join(
+                f"p{int(fraction * 100)} "
+                f"{_percentile(result.latencies, fraction) * 1000:.2f} ms"
+                for fraction in (0.5, 0.95, 0.99)
+            )
+            + f", max {max(result.latencies) * 1000:.2f} ms"
+        )
+    print(f"peak memory while replaying: {memory.peak_memory / 1024:.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark request round trips with different ClientTag schemes.
+
+Run from the repository root with `python -m benchmarks.bench_tags`. This compares
+the random UUID tags LeapProtocol used to send with its per-connection counter, using
+an in-memory bridge that answers every request immediately.
+"""
+import asyncio
+import json
+import time
+import uuid
+from typing import Callable
+
+from pylutron_caseta.leap import LeapProtocol
+
+REQUESTS = 20000
+
+
+class _Transport:
+    def get_write_buffer_size(self) -> int:  # pylint: disable=no-self-use
+        return 0
+
+
+class _EchoWriter:
+    """A writer that answers each request by feeding a response to a reader."""
+
+    def __init__(self, reader: asyncio.StreamReader):
+        self.transport = _Transport()
+        self._reader = reader
+
+    def write(self, data: bytes):
+        request = json.loads(data)
+        response = {
+            "CommuniqueType": "ReadResponse",
+            "Header": {
+                "ClientTag": request["Header"]["ClientTag"],
+                "StatusCode": "200 OK",
+                "Url": request["Header"]["Url"],
+            },
+        }
+        self._reader.feed_data(json.dumps(response).encode("UTF-8") + b"\r\n")
+
+    def close(self):
+        self._reader.feed_eof()
+
+
+async def _round_trips(make_tag: Callable[[LeapProtocol], str]) -> float:
+    reader = asyncio.StreamReader()
+    leap = LeapProtocol(reader, _EchoWriter(reader))  # type: ignore
+    leap._make_tag = lambda: make_tag(leap)  # type: ignore
+    run = asyncio.get_running_loop().create_task(leap.run())
+
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        await leap.request("ReadRequest", "/server/1/status/ping")
+    elapsed = time.perf_counter() - start
+
+    leap.close()
+    await run
+    return elapsed
+
+
+def _uuid_tag(_: LeapProtocol) -> str:
+    return str(uuid.uuid4())
+
+
+def _counter_tag(leap: LeapProtocol) -> str:
+    return LeapProtocol._make_tag(leap)  # pylint: disable=protected-access
+
+
+def main():
+    """Print the request throughput and tag length of each scheme."""
+    for name, make_tag in (("uuid4", _uuid_tag), ("counter", _counter_tag)):
+        elapsed = asyncio.run(_round_trips(make_tag))
+        print(f"{name:>8}: {REQUESTS / elapsed:10.0f} requests/s")
+
+    print(f"tag generation for {REQUESTS} tags:")
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        str(uuid.uuid4())
+    print(f"   uuid4: {(time.perf_counter() - start) * 1e9 / REQUESTS:8.0f} ns/tag")
+
+    leap = LeapProtocol(None, None)  # type: ignore
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        leap._make_tag()  # pylint: disable=protected-access
+    print(f" counter: {(time.perf_counter() - start) * 1e9 / REQUESTS:8.0f} ns/tag")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark dispatching zone status messages to devices.
+
+Run from the repository root with `python -m benchmarks.bench_zone_lookup`. The time
+per event should stay roughly flat as the number of devices grows.
+"""
+import asyncio
+import timeit
+from typing import Any, Dict
+
+from pylutron_caseta.messages import Response, ResponseHeader, ResponseStatus
+from pylutron_caseta.smartbridge import Smartbridge
+
+DEVICE_COUNTS = (10, 100, 1000, 5000)
+EVENTS = 20000
+
+
+def _device_list(count: int) -> Dict[str, Any]:
+    devices = [
+        {
+            "href": f"/device/{i}",
+            "FullyQualifiedName": ["Room", f"Light {i}"],
+            "DeviceType": "WallDimmer",
+            "ModelNumber": "PD-6WCL-XX",
+            "SerialNumber": i,
+            "LocalZones": [{"href": f"/zone/{i}"}],
+        }
+        for i in range(1, count + 1)
+    ]
+    return {"Devices": devices}
+
+
+def _zone_status(zone: int) -> Response:
+    return Response(
+        Header=ResponseHeader(
+            StatusCode=ResponseStatus(200, "OK"),
+            Url=f"/zone/{zone}/status",
+            MessageBodyType="OneZoneStatus",
+        ),
+        CommuniqueType="ReadResponse",
+        Body={"ZoneStatus": {"Level": 50, "Zone": {"href": f"/zone/{zone}"}}},
+    )
+
+
+async def _bench(count: int) -> float:
+    def _connect():
+        raise NotImplementedError()
+
+    bridge = Smartbridge(_connect)
+    bridge._apply_devices(_device_list(count))  # pylint: disable=protected-access
+
+    # the last zone is the worst case for a linear scan
+    event = _zone_status(count)
+    handle = bridge._handle_one_zone_status  # pylint: disable=protected-access
+    seconds = min(timeit.repeat(lambda: handle(event), number=EVENTS, repeat=5))
+    return seconds / EVENTS
+
+
+def main():
+    """Print the cost of dispatching one zone status for each device count."""
+    for count in DEVICE_COUNTS:
+        per_event = asyncio.run(_bench(count))
+        print(f"{count:>6} devices: {per_event * 1e6:8.2f} us/event")
+
+
+if __name__ == "__main__":
+    main()
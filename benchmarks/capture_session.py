@@ -0,0 +1,68 @@
+"""
+Record a LEAP session with a real bridge, for replaying with `benchmarks.bench_replay`.
+
+Run from the repository root with `python -m benchmarks.capture_session`, passing
+the bridge address and the files from `get_lutron_cert.py`. This connects and
+logs in as usual, then writes every message sent and received until it is stopped
+or `--seconds` have passed. Press the buttons and move the sliders in the app while
+it runs to capture a realistic stream of events.
+"""
+import argparse
+import asyncio
+import socket
+import ssl
+
+from pylutron_caseta.smartbridge import LEAP_PORT, Smartbridge
+
+from .session import SessionRecorder
+
+
+async def capture(args: argparse.Namespace):
+    """Connect to the bridge and record the session to the output file."""
+    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+    ssl_context.load_verify_locations(args.ca_certs)
+    ssl_context.load_cert_chain(args.certfile, args.keyfile)
+    ssl_context.verify_mode = ssl.CERT_REQUIRED
+
+    with open(args.output, "w") as ofh:
+        recorder = SessionRecorder(ofh)
+
+        async def _connect():
+            return await recorder.record_connection(
+                asyncio.open_connection,
+                args.host,
+                args.port,
+                server_hostname="",
+                ssl=ssl_context,
+                family=socket.AF_INET,
+            )
+
+        bridge = Smartbridge(_connect)
+        try:
+            await bridge.connect()
+            print(f"connected, recording to {args.output}")
+            await asyncio.sleep(args.seconds)
+        finally:
+            await bridge.close()
+
+
+def main():
+    """Record a session until interrupted or for the given number of seconds."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("host", help="the address of the bridge")
+    parser.add_argument("--keyfile", default="caseta.key")
+    parser.add_argument("--certfile", default="caseta.crt")
+    parser.add_argument("--ca-certs", default="caseta-bridge.crt")
+    parser.add_argument("--port", type=int, default=LEAP_PORT)
+    parser.add_argument("--output", default="session.jsonl")
+    parser.add_argument("--seconds", type=float, default=float("inf"))
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(capture(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+"""
+Record LEAP sessions and replay them against pylutron_caseta.
+
+A session is stored as JSON lines. Each line is one message with the seconds since
+the session started as "t", the direction as "dir" ("tx" for messages sent to the
+bridge, "rx" for messages received from it) and the message itself as "msg":
+
+{"t":0.0132,"dir":"rx","msg":{"CommuniqueType":"ReadResponse",...}}
+
+Use `benchmarks.capture_session` to record a session with a real bridge, or
+`synthetic_session` to make one, and `ReplayBridge` to serve one to a client. This
+module is shared by the replay benchmarks and is not a benchmark itself.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+)
+
+from pylutron_caseta.leap import LeapProtocol
+
+TX = "tx"
+RX = "rx"
+
+
+class SessionEvent(NamedTuple):
+    """A message sent or received during a session."""
+
+    t: float
+    direction: str
+    message: Dict[str, Any]
+
+
+def load_session(file: TextIO) -> List[SessionEvent]:
+    """Read a session written by `SessionRecorder` or `save_session`."""
+    events = []
+    for line in file:
+        if line.strip():
+            record = json.loads(line)
+            events.append(SessionEvent(record["t"], record["dir"], record["msg"]))
+    return events
+
+
+def save_session(events: Iterable[SessionEvent], file: TextIO):
+    """Write a session as JSON lines."""
+    for event in events:
+        file.write(_encode_event(event.t, event.direction, event.message))
+
+
+def _encode_event(t: float, direction: str, message: Dict[str, Any]) -> str:
+    record = {"t": round(t, 6), "dir": direction, "msg": message}
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+class SessionRecorder:
+    """
+    Record the messages of a LEAP connection as they are sent and received.
+
+    Wrap the reader and writer of a connection with `wrap` before passing them to
+    `LeapProtocol`, or use `record_connection`.
+    """
+
+    def __init__(self, file: TextIO, clock: Callable[[], float] = time.perf_counter):
+        """
+        Create a recorder.
+
+        :param file: a text file to write the session to
+        :param clock: the source of message times
+        """
+        self._file = file
+        self._clock = clock
+        self._start = clock()
+
+    def wrap(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Get a reader and writer that record everything passing through them."""
+        return (
+            _RecordingStream(reader, self, RX),  # type: ignore
+            _RecordingStream(writer, self, TX),  # type: ignore
+        )
+
+    async def record_connection(
+        self, connect: Callable[..., Any], *args: Any, **kwargs: Any
+    ) -> LeapProtocol:
+        """
+        Open a connection with asyncio.open_connection and wrap it with LEAP.
+
+        Arguments are passed to `connect`, which is usually asyncio.open_connection.
+        """
+        reader, writer = await connect(*args, **kwargs)
+        reader, writer = self.wrap(reader, writer)
+        return LeapProtocol(reader, writer)
+
+    def record(self, direction: str, line: bytes):
+        """Record one message."""
+        self._file.write(
+            _encode_event(self._clock() - self._start, direction, json.loads(line))
+        )
+
+
+class _RecordingStream:
+    """Pass reads and writes through to a stream, recording each complete line."""
+
+    def __init__(self, stream: Any, recorder: SessionRecorder, direction: str):
+        self._stream = stream
+        self._recorder = recorder
+        self._direction = direction
+        self._buffer = b""
+
+    async def read(self, n: int = -1) -> bytes:
+        data = await self._stream.read(n)
+        self._add(data)
+        return data
+
+    def write(self, data: bytes):
+        self._stream.write(data)
+        self._add(data)
+
+    def _add(self, data: bytes):
+        self._buffer += data
+        while True:
+            end = self._buffer.find(b"\n")
+            if end == -1:
+                break
+            line, self._buffer = self._buffer[:end].strip(), self._buffer[end + 1 :]
+            if line:
+                self._recorder.record(self._direction, line)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+def synthetic_session(
+    devices: int = 100, events: int = 5000, interval: float = 0.001, seed: int = 0
+) -> List[SessionEvent]:
+    """
+    Make a session like one with a bridge that has many dimmers.
+
+    The session logs in, subscribes to zone and occupancy status, and then receives
+    zone status events for random zones, one every interval seconds.
+    """
+    session: List[SessionEvent] = []
+    tags = itertools.count()
+    rng = random.Random(seed)
+
+    def exchange(
+        communique_type: str, url: str, body_type: str, body: Dict[str, Any]
+    ) -> str:
+        tag = f"s-{next(tags)}"
+        session.append(
+            SessionEvent(
+                0.0,
+                TX,
+                {
+                    "CommuniqueType": communique_type,
+                    "Header": {"ClientTag": tag, "Url": url},
+                },
+            )
+        )
+        response_type = communique_type.replace("Request", "Response")
+        session.append(
+            SessionEvent(
+                0.0,
+                RX,
+                {
+                    "CommuniqueType": response_type,
+                    "Header": {
+                        "ClientTag": tag,
+                        "MessageBodyType": body_type,
+                        "StatusCode": "200 OK",
+                        "Url": url,
+                    },
+                    "Body": body,
+                },
+            )
+        )
+        return tag
+
+    def zone_status(zone: int) -> Dict[str, Any]:
+        return {
+            "href": f"/zone/{zone}/status",
+            "Level": rng.randint(0, 100),
+            "Zone": {"href": f"/zone/{zone}"},
+            "StatusAccuracy": "Good",
+        }
+
+    timestamp = {"Year": 2020, "Month": 4, "Day": 12, "Hour": 18, "Minute": 40}
+    exchange(
+        "ReadRequest",
+        "/project",
+        "OneProjectDefinition",
+        {"Project": {"href": "/project", "ProjectModifiedTimestamp": timestamp}},
+    )
+    exchange(
+        "ReadRequest",
+        "/device",
+        "MultipleDeviceDefinition",
+        {
+            "Devices": [
+                {
+                    "href": "/device/1",
+                    "FullyQualifiedName": ["Smart Bridge"],
+                    "DeviceType": "SmartBridge",
+                    "ModelNumber": "L-BDG2-WH",
+                    "SerialNumber": 1,
+                }
+            ]
+            + [
+                {
+                    "href": f"/device/{zone + 1}",
+                    "FullyQualifiedName": [f"Room {zone}", "Lights"],
+                    "DeviceType": "WallDimmer",
+                    "ModelNumber": "PD-6WCL-XX",
+                    "SerialNumber": zone + 1,
+                    "LocalZones": [{"href": f"/zone/{zone}"}],
+                }
+                for zone in range(1, devices + 1)
+            ]
+        },
+    )
+    exchange(
+        "ReadRequest",
+        "/virtualbutton",
+        "MultipleVirtualButtonDefinition",
+        {
+            "VirtualButtons": [
+                {
+                    "href": f"/virtualbutton/{i}",
+                    "Name": f"Scene {i}",
+                    "IsProgrammed": True,
+                }
+                for i in range(1, 11)
+            ]
+        },
+    )
+    exchange(
+        "ReadRequest",
+        "/area",
+        "MultipleAreaDefinition",
+        {"Areas": [{"href": "/area/1", "Name": "Home"}]},
+    )
+    exchange(
+        "ReadRequest",
+        "/occupancygroup",
+        "MultipleOccupancyGroupDefinition",
+        {"OccupancyGroups": []},
+    )
+    exchange(
+        "SubscribeRequest",
+        "/occupancygroup/status",
+        "MultipleOccupancyGroupStatus",
+        {"OccupancyGroupStatuses": []},
+    )
+    zone_tag = exchange(
+        "SubscribeRequest",
+        "/zone/status",
+        "MultipleZoneStatus",
+        {"ZoneStatuses": [zone_status(zone) for zone in range(1, devices + 1)]},
+    )
+
+    for index in range(1, events + 1):
+        session.append(
+            SessionEvent(
+                index * interval,
+                RX,
+                {
+                    "CommuniqueType": "ReadResponse",
+                    "Header": {
+                        "ClientTag": zone_tag,
+                        "MessageBodyType": "OneZoneStatus",
+                        "StatusCode": "200 OK",
+                        "Url": "/zone/status",
+                    },
+                    "Body": {"ZoneStatus": zone_status(rng.randint(1, devices))},
+                },
+            )
+        )
+
+    return session
+
+
+def _with_tag(message: Dict[str, Any], tag: str) -> Dict[str, Any]:
+    return {**message, "Header": {**message.get("Header", {}), "ClientTag": tag}}
+
+
+def _not_found(request: Dict[str, Any]) -> Dict[str, Any]:
+    header = request.get("Header", {})
+    return {
+        "CommuniqueType": "ExceptionResponse",
+        "Header": {
+            "ClientTag": header.get("ClientTag"),
+            "StatusCode": "404 Not Found",
+            "Url": header.get("Url"),
+        },
+    }
+
+
+class ReplayBridge:
+    """
+    Serve a recorded session to a client over TCP, as if it were the bridge.
+
+    Requests are answered with the response recorded for the same communique type
+    and URL, with the tag of the new request. Requests that were not recorded are
+    answered with 404 Not Found. Once the client has made every subscription that
+    the recorded events belong to and `start_stream` has been called, the rest of
+    the received messages are sent, either as fast as possible or spaced out as
+    they were recorded.
+    """
+
+    def __init__(self, events: Iterable[SessionEvent], speed: Optional[float] = None):
+        """
+        Prepare to replay a session. This must be called with an event loop running.
+
+        :param events: the recorded session
+        :param speed: None to send events as fast as possible, 1.0 to send them at
+        the recorded pace, 2.0 for twice as fast, and so on
+        """
+        self.speed = speed
+        # called with each streamed message just before it is written
+        self.on_event: Callable[[Dict[str, Any]], None] = lambda message: None
+        self._responses: Dict[Tuple[Any, Any], List[Tuple[str, Dict[str, Any]]]] = {}
+        self._stream: List[SessionEvent] = []
+        self._stream_tags: Set[str] = set()
+        self._split(events)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._go = asyncio.Event()
+        self.finished: "asyncio.Future[int]" = (
+            asyncio.get_running_loop().create_future()
+        )
+
+    @property
+    def stream_length(self) -> int:
+        """Get the number of messages that are sent after logging in."""
+        return len(self._stream)
+
+    def _split(self, events: Iterable[SessionEvent]):
+        """Separate the answers to requests from the messages that follow them."""
+        requests: Dict[str, Tuple[Any, Any]] = {}
+        answered: Set[str] = set()
+        for event in events:
+            header = event.message.get("Header", {})
+            tag = header.get("ClientTag")
+            if event.direction == TX:
+                if tag is not None:
+                    requests[tag] = (
+                        event.message.get("CommuniqueType"),
+                        header.get("Url"),
+                    )
+                continue
+
+            if tag is not None and tag in requests and tag not in answered:
+                answered.add(tag)
+                self._responses.setdefault(requests[tag], []).append(
+                    (tag, event.message)
+                )
+                continue
+
+            self._stream.append(event)
+            if tag is not None:
+                self._stream_tags.add(tag)
+
+    async def start(self) -> Tuple[str, int]:
+        """Start listening, and return the host and port to connect to."""
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return host, port
+
+    def start_stream(self):
+        """Allow the recorded events to be sent once the client has subscribed."""
+        self._go.set()
+
+    async def close(self):
+        """Stop listening."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        tag_map: Dict[str, str] = {}
+        cursors: Dict[Tuple[Any, Any], int] = {}
+        stream_task: Optional[asyncio.Task] = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = json.loads(line)
+                header = request.get("Header", {})
+                key = (request.get("CommuniqueType"), header.get("Url"))
+                recorded = self._responses.get(key)
+                if not recorded:
+                    response = _not_found(request)
+                else:
+                    # answer repeated requests in order, then repeat the last answer
+                    index = cursors.get(key, 0)
+                    cursors[key] = index + 1
+                    recorded_tag, response = recorded[min(index, len(recorded) - 1)]
+                    response = _with_tag(response, header.get("ClientTag"))
+                    if recorded_tag in self._stream_tags:
+                        tag_map[recorded_tag] = header.get("ClientTag")
+
+                writer.write(json.dumps(response).encode("UTF-8") + b"\r\n")
+                await writer.drain()
+
+                if stream_task is None and self._stream_tags <= tag_map.keys():
+                    stream_task = asyncio.get_running_loop().create_task(
+                        self._play(writer, tag_map)
+                    )
+        except (asyncio.CancelledError, ConnectionError):
+            # the client went away, or the replay is shutting down
+            pass
+        finally:
+            if stream_task is not None:
+                stream_task.cancel()
+            writer.close()
+
+    async def _play(self, writer: asyncio.StreamWriter, tag_map: Dict[str, str]):
+        await self._go.wait()
+
+        # encode everything up front so the replay itself is as cheap as possible
+        stream = []
+        for event in self._stream:
+            message = event.message
+            tag = message.get("Header", {}).get("ClientTag")
+            if tag is not None:
+                message = _with_tag(message, tag_map[tag])
+            stream.append(
+                (event.t, message, json.dumps(message).encode("UTF-8") + b"\r\n")
+            )
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        first = stream[0][0] if stream else 0.0
+        for t, message, data in stream:
+            if self.speed is not None:
+                delay = (t - first) / self.speed - (loop.time() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.on_event(message)
+            writer.write(data)
+            await writer.drain()
+
+        if not self.finished.done():
+            self.finished.set_result(len(stream))
@@ -29,12 +29,21 @@ _LEAP_DEVICE_TYPES = {
     ],
 }
 
+# The domain of each LEAP device type, e.g. WallDimmer -> light
+_LEAP_DEVICE_DOMAINS = {
+    type_: domain for domain, types in _LEAP_DEVICE_TYPES.items() for type_ in types
+}
+
 FAN_OFF = "Off"
 FAN_LOW = "Low"
 FAN_MEDIUM = "Medium"
 FAN_MEDIUM_HIGH = "MediumHigh"
 FAN_HIGH = "High"
 
+COVER_RAISE = "Raise"
+COVER_LOWER = "Lower"
+COVER_STOP = "Stop"
+
 OCCUPANCY_GROUP_OCCUPIED = "Occupied"
 OCCUPANCY_GROUP_UNOCCUPIED = "Unoccupied"
 OCCUPANCY_GROUP_UNKNOWN = "Unknown"
@@ -44,6 +53,10 @@ class BridgeDisconnectedError(Exception):
     """Raised when the connection is lost while waiting for a response."""
 
 
+class MessageTooLargeError(ValueError):
+    """Raised when the bridge sends a message longer than the configured limit."""
+
+
 class BridgeResponseError(Exception):
     """Raised when the bridge sends an error response."""
 
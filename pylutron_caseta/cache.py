@@ -0,0 +1,110 @@
+"""A file cache of the topology read from a bridge."""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Dict, NamedTuple, Optional
+
+_LOG = logging.getLogger(__name__)
+
+# bump when the layout of the cached topology changes
+_CACHE_VERSION = 1
+
+# a lock for each cache file, so that bridges sharing a file take turns to update it
+_FILE_LOCKS: Dict[str, threading.Lock] = {}
+_FILE_LOCKS_GUARD = threading.Lock()
+
+
+def _file_lock(path: str) -> threading.Lock:
+    key = os.path.realpath(path)
+    with _FILE_LOCKS_GUARD:
+        return _FILE_LOCKS.setdefault(key, threading.Lock())
+
+
+class CachedTopology(NamedTuple):
+    """The topology of a bridge as it was last read."""
+
+    fingerprint: Any
+    bodies: Dict[str, Any]
+
+
+class TopologyCache:
+    """
+    Keep the devices, scenes, areas and occupancy groups of a bridge in a file.
+
+    The response bodies are stored as JSON, keyed by bridge id, so several bridges
+    can share one file. Updates to a file are serialized within the process, but not
+    between processes. Reading and writing happens in the default executor.
+    """
+
+    def __init__(self, path: str, bridge_id: str):
+        """
+        Create a cache for one bridge.
+
+        :param path: the file to store the topology in
+        :param bridge_id: a value that identifies the bridge, e.g. its serial number
+        or host name
+        """
+        self.path = path
+        self.bridge_id = bridge_id
+        self._lock = _file_lock(path)
+
+    async def load(self) -> Optional[CachedTopology]:
+        """
+        Read the cached topology for the bridge.
+
+        :returns the topology, or None if nothing usable has been cached
+        """
+        loop = asyncio.get_running_loop()
+        entries = await loop.run_in_executor(None, self._read)
+        entry = entries.get(self.bridge_id)
+        if not isinstance(entry, dict) or entry.get("version") != _CACHE_VERSION:
+            return None
+        return CachedTopology(
+            fingerprint=entry.get("fingerprint"), bodies=entry.get("bodies", {})
+        )
+
+    async def save(self, topology: CachedTopology):
+        """Replace the cached topology for the bridge."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write, topology)
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as ifh:
+                entries = json.load(ifh)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as ex:
+            _LOG.warning("Could not read topology cache %s: %s", self.path, ex)
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def _write(self, topology: CachedTopology):
+        with self._lock:
+            self._update(topology)
+
+    def _update(self, topology: CachedTopology):
+        entries = self._read()
+        entries[self.bridge_id] = {
+            "version": _CACHE_VERSION,
+            "fingerprint": topology.fingerprint,
+            "bodies": topology.bodies,
+        }
+
+        # write to a temporary file first so a crash cannot leave a partial cache
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as ofh:
+                    json.dump(entries, ofh)
+                os.replace(temp_path, self.path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError as ex:
+            _LOG.warning("Could not write topology cache %s: %s", self.path, ex)
@@ -0,0 +1,66 @@
+"""JSON codecs for encoding and decoding LEAP messages."""
+
+import json
+from typing import Any, Callable, List, NamedTuple, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+try:
+    import ujson  # type: ignore
+except ImportError:
+    ujson = None  # type: ignore
+
+
+class JsonCodec(NamedTuple):
+    """Functions converting LEAP messages to and from UTF-8 encoded JSON."""
+
+    name: str
+    dumps: Callable[[Any], bytes]
+    loads: Callable[[bytes], Any]
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj).encode("UTF-8")
+
+
+STDLIB_CODEC = JsonCodec(name="json", dumps=_json_dumps, loads=json.loads)
+
+
+def _orjson_codec() -> Optional[JsonCodec]:
+    if orjson is None:
+        return None
+    # orjson is a compiled extension, which pylint cannot inspect
+    return JsonCodec(
+        name="orjson",
+        dumps=orjson.dumps,  # pylint: disable=no-member
+        loads=orjson.loads,  # pylint: disable=no-member
+    )
+
+
+def _ujson_codec() -> Optional[JsonCodec]:
+    if ujson is None:
+        return None
+
+    def _ujson_dumps(obj: Any) -> bytes:
+        return ujson.dumps(obj, ensure_ascii=False).encode("UTF-8")
+
+    return JsonCodec(name="ujson", dumps=_ujson_dumps, loads=ujson.loads)
+
+
+ORJSON_CODEC = _orjson_codec()
+UJSON_CODEC = _ujson_codec()
+
+
+def available_codecs() -> List[JsonCodec]:
+    """Get the codecs that can be used, fastest first."""
+    return [
+        codec
+        for codec in (ORJSON_CODEC, UJSON_CODEC, STDLIB_CODEC)
+        if codec is not None
+    ]
+
+
+DEFAULT_CODEC = available_codecs()[0]
@@ -0,0 +1,170 @@
+"""Helpers for the subscriptions and requests that Smartbridge makes."""
+
+import asyncio
+from collections import deque
+import logging
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    TypeVar,
+    Union,
+)
+
+from .messages import Response
+
+_LOG = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _LeapSubscription:
+    """A LEAP subscription that is made again on every connection."""
+
+    __slots__ = ("url", "callback", "body", "tag", "snapshot")
+
+    def __init__(
+        self,
+        url: str,
+        callback: Callable[[Response], None],
+        body: Optional[dict] = None,
+    ):
+        self.url = url
+        self.callback = callback
+        self.body = body
+        # the tag of the subscription on the most recent connection
+        self.tag: Optional[str] = None
+        # the body of the last initial response, while no events have changed it
+        self.snapshot: Optional[Any] = None
+
+    def handle_snapshot(self, response: Response):
+        """Deliver the response to the subscription, unless nothing has changed."""
+        body = response.Body
+        if body is not None and body == self.snapshot:
+            _LOG.debug("%s has not changed since the last connection", self.url)
+            return
+        self.snapshot = body
+        if not self._deliver(response):
+            # deliver it again after the next reconnect
+            self.snapshot = None
+
+    def handle_event(self, response: Response):
+        """Deliver an event sent for the subscription."""
+        self.snapshot = None
+        self._deliver(response)
+
+    def _deliver(self, response: Response) -> bool:
+        """Call the callback, logging any exception it raises."""
+        try:
+            self.callback(response)
+        except Exception:  # pylint: disable=broad-except
+            _LOG.exception("Got exception from subscriber to %s", self.url)
+            return False
+        return True
+
+
+async def _gather_limited(
+    limit: int, factories: Sequence[Callable[[], Awaitable[T]]]
+) -> List[Union[T, BaseException]]:
+    """
+    Run coroutines concurrently, with at most limit of them running at a time.
+
+    :param factories: functions that each create one of the coroutines to run
+    :returns the result of each coroutine, or the exception it raised
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _limited(factory: Callable[[], Awaitable[T]]) -> T:
+        async with semaphore:
+            return await factory()
+
+    return await asyncio.gather(
+        *(_limited(factory) for factory in factories), return_exceptions=True
+    )
+
+
+class _QueuedCommand(NamedTuple):
+    """A request waiting in a _Coalescer."""
+
+    send: Callable[[], Awaitable[Response]]
+    future: "asyncio.Future[Response]"
+    replaceable: bool
+
+
+class _Coalescer:
+    """
+    Run one request per key at a time, in order, skipping superseded requests.
+
+    While a request for a key is in flight, later requests for the same key wait and
+    are sent in the order they were made. A replaceable request replaces the last
+    waiting request if that one is replaceable too, and everyone waiting for it gets
+    the result of the request that is eventually sent. Other requests are never
+    replaced, and no request is sent ahead of one that was made before it.
+    """
+
+    def __init__(self):
+        """Create a new _Coalescer."""
+        self._busy: Set[str] = set()
+        self._waiting: Dict[str, Deque[_QueuedCommand]] = {}
+
+    async def run(
+        self,
+        key: str,
+        send: Callable[[], Awaitable[Response]],
+        replaceable: bool = True,
+    ) -> Response:
+        """
+        Send a request now, or after the requests already made for the same key.
+
+        :param replaceable: whether a newer replaceable request may be sent instead of
+        this one, if this one is still waiting when the newer one is made
+        """
+        if key not in self._busy:
+            self._busy.add(key)
+            try:
+                return await send()
+            finally:
+                self._send_next(key)
+
+        queue = self._waiting.setdefault(key, deque())
+        if replaceable and queue and queue[-1].replaceable:
+            _LOG.debug("Replacing queued command for %s", key)
+            future = queue[-1].future
+            queue[-1] = _QueuedCommand(send, future, True)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            queue.append(_QueuedCommand(send, future, replaceable))
+
+        # other callers may be waiting for the same result
+        return await asyncio.shield(future)
+
+    def _send_next(self, key: str):
+        queue = self._waiting.get(key)
+        if not queue:
+            self._waiting.pop(key, None)
+            self._busy.discard(key)
+            return
+
+        send, future, _ = queue.popleft()
+        task = asyncio.ensure_future(send())
+
+        def _done(task: "asyncio.Future[Response]"):
+            if not future.done():
+                if task.cancelled():
+                    future.cancel()
+                else:
+                    exception = task.exception()
+                    if exception is not None:
+                        future.set_exception(exception)
+                    else:
+                        future.set_result(task.result())
+            self._send_next(key)
+
+        task.add_done_callback(_done)
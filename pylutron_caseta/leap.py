@@ -1,21 +1,186 @@
 """LEAP protocol layer."""
+# pylint: disable=too-many-lines
 
 import asyncio
-import json
+from collections import deque
+from functools import lru_cache
+import heapq
+import itertools
 import logging
-import re
-import uuid
-from typing import Callable, Dict, List, Optional, Tuple
+import time
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
 
-from . import BridgeDisconnectedError
+from . import BridgeDisconnectedError, BridgeResponseError, MessageTooLargeError
+from .codec import DEFAULT_CODEC, JsonCodec
 from .messages import Response
+from .metrics import MetricsSink
+from .tracing import Tracer
 
 _LOG = logging.getLogger(__name__)
 _DEFAULT_LIMIT = 2 ** 16
+_DEFAULT_WRITE_HIGH_WATER = 2 ** 16
+_DEFAULT_BULK_QUEUE_SIZE = 256
+_DEFAULT_MAX_MESSAGE_SIZE = 2 ** 24
+_HREF_CACHE_SIZE = 1024
+_ROUTE_CACHE_SIZE = 1024
 
+# Requests are written in order of priority, lowest value first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PING = 1
+PRIORITY_BULK = 2
 
-def _make_tag() -> str:
-    return str(uuid.uuid4())
+
+# each connection gets a distinct prefix for its tags
+_CONNECTION_IDS = itertools.count()
+
+
+class _LineReader:
+    """
+    Split a stream into newline-delimited messages.
+
+    Unlike `asyncio.StreamReader.readline`, a message may be longer than the stream's
+    buffer limit, up to max_size bytes. Data is read in large chunks, and complete
+    lines are sliced directly out of the chunk that contains them, so each message is
+    copied only once.
+    """
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        read_size: int = _DEFAULT_LIMIT,
+        max_size: int = _DEFAULT_MAX_MESSAGE_SIZE,
+    ):
+        """
+        Read messages from a stream, reading up to read_size bytes at a time.
+
+        :raises ValueError: if max_size is less than 1
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self._reader = reader
+        self._read_size = read_size
+        self._max_size = max_size
+        self._partial = bytearray()
+        self._lines: Deque[bytes] = deque()
+
+    async def readline(self) -> bytes:
+        """
+        Read the next message, without its line terminator.
+
+        If the stream ends with an incomplete message, that message is returned. At the
+        end of the stream, an empty bytes object is returned.
+
+        :raises MessageTooLargeError: if a message is longer than max_size bytes
+        """
+        while not self._lines:
+            chunk = await self._reader.read(self._read_size)
+            if not chunk:
+                line = bytes(self._partial)
+                self._partial.clear()
+                return line
+            self._split(chunk)
+        return self._lines.popleft()
+
+    def _split(self, chunk: bytes):
+        end = chunk.find(b"\n")
+        if end == -1:
+            self._partial += chunk
+            self._check_size(len(self._partial))
+            return
+
+        if self._partial:
+            # finish the message started by a previous chunk
+            self._partial += chunk[:end]
+            line = bytes(self._partial)
+            self._partial.clear()
+            self._add(line, 0, len(line))
+        else:
+            self._add(chunk, 0, end)
+
+        start = end + 1
+        end = chunk.find(b"\n", start)
+        while end != -1:
+            self._add(chunk, start, end)
+            start = end + 1
+            end = chunk.find(b"\n", start)
+
+        self._partial += chunk[start:]
+        self._check_size(len(self._partial))
+
+    def _add(self, data: bytes, start: int, end: int):
+        # the bridge terminates lines with \r\n, but accept a bare \n as well
+        if end > start and data[end - 1] == 0x0D:
+            end -= 1
+        self._check_size(end - start)
+        if end > start:
+            self._lines.append(data[start:end])
+
+    def _check_size(self, size: int):
+        if size > self._max_size:
+            self._partial.clear()
+            self._lines.clear()
+            raise MessageTooLargeError(
+                f"A message is longer than the limit of {self._max_size} bytes"
+            )
+
+
+class _PrioritySemaphore:
+    """
+    A semaphore that wakes the waiter with the lowest priority value first.
+
+    Waiters with the same priority are woken in the order they started waiting.
+    """
+
+    def __init__(self, value: int):
+        """Create a semaphore that can be acquired value times at once."""
+        self._value = value
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    async def acquire(self, priority: int):
+        """Wait until the semaphore can be acquired by a waiter of this priority."""
+        if self._value > 0:
+            self._value -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the semaphore was handed over just as the waiter was cancelled
+                self.release()
+            raise
+
+    def release(self):
+        """Hand the semaphore to the most urgent waiter, if there is one."""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._value += 1
+
+
+class WriteWait(NamedTuple):
+    """How long the requests of one priority waited to be written."""
+
+    writes: int = 0
+    total: float = 0.0
+    longest: float = 0.0
+
+
+class _QueuedWrite(NamedTuple):
+    priority: int
+    sequence: int
+    data: bytes
+    enqueued: float
+    future: "asyncio.Future[Response]"
+    tag: str
+    communique_type: str
+    url: str
 
 
 class LeapProtocol:
@@ -25,13 +190,117 @@ class LeapProtocol:
         self,
         reader: asyncio.StreamReader,
         writer: asyncio.StreamWriter,
+        codec: JsonCodec = DEFAULT_CODEC,
+        *,
+        max_in_flight: Optional[int] = None,
+        write_high_water: int = _DEFAULT_WRITE_HIGH_WATER,
+        bulk_queue_size: int = _DEFAULT_BULK_QUEUE_SIZE,
+        max_message_size: int = _DEFAULT_MAX_MESSAGE_SIZE,
+        metrics: Optional[MetricsSink] = None,
+        tracer: Optional[Tracer] = None,
     ):
-        """Wrap a reader and writer with a LEAP request and response protocol."""
+        """
+        Wrap a reader and writer with a LEAP request and response protocol.
+
+        Requests are written by a single task, in order of priority. While the
+        transport is above write_high_water, requests wait in a queue so that a more
+        urgent request can still be sent ahead of earlier, less urgent ones.
+
+        :param codec: the JSON codec for messages. By default, this is the fastest
+        codec that is installed.
+        :param max_in_flight: the most requests that may be waiting for a response at
+        once. Additional requests wait for an earlier one to finish before they are
+        sent, and the most urgent of them goes first, so interactive requests and
+        pings are not held up by a backlog of bulk requests. By default, there is no
+        limit.
+        :param write_high_water: once more than this many bytes are buffered for
+        writing, the writer waits for the buffer to drain before writing more.
+        :param bulk_queue_size: the most PRIORITY_BULK requests that may wait to be
+        written. Additional bulk requests wait for room in the queue. Requests with
+        other priorities are never held back by a full queue.
+        :param max_message_size: the longest message, in bytes, that may be received.
+        If the bridge sends a longer one, run raises MessageTooLargeError.
+        :param metrics: if given, request latencies, the number of requests in flight
+        and the messages sent and received are reported to it
+        :param tracer: if given, it is told about every message sent, received and
+        handled
+        """
+        if max_in_flight is not None and max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        if max_message_size < 1:
+            raise ValueError("max_message_size must be at least 1")
+
         self._reader = reader
         self._writer = writer
+        self._codec = codec
+        self._metrics = metrics
+        self._tracer = tracer
+        self._write_high_water = write_high_water
+        self._max_message_size = max_message_size
+        self._in_flight_limit: Optional[_PrioritySemaphore] = (
+            _PrioritySemaphore(max_in_flight) if max_in_flight is not None else None
+        )
+        self._queued = 0
+        self._write_queue: "asyncio.PriorityQueue[_QueuedWrite]" = (
+            asyncio.PriorityQueue()
+        )
+        self._write_sequence = itertools.count()
+        self._bulk_slots = asyncio.Semaphore(bulk_queue_size)
+        self._write_waits: Dict[int, WriteWait] = {}
+        self._write_task: Optional[asyncio.Task] = None
+        self._write_error: Optional[BaseException] = None
+        self._tag_prefix = f"{next(_CONNECTION_IDS):x}-"
+        self._tag_sequence = itertools.count()
         self._in_flight_requests: Dict[str, "asyncio.Future[Response]"] = {}
         self._tagged_subscriptions: Dict[str, Callable[[Response], None]] = {}
-        self._unsolicited_subs: List[Callable[[Response], None]] = []
+        self._subscription_urls: Dict[str, str] = {}
+        # closed subscriptions whose URL is still subscribed by another tag
+        self._detached_subscriptions: Dict[str, str] = {}
+        self._unsolicited = MessageRouter()
+        self._last_received = 0.0
+
+    def _make_tag(self) -> str:
+        """
+        Get a new ClientTag.
+
+        Tags are a per-connection prefix and a counter, so they are short and never
+        repeat within the process, even across reconnects.
+        """
+        return f"{self._tag_prefix}{next(self._tag_sequence):x}"
+
+    @property
+    def last_received(self) -> float:
+        """
+        Get the event loop time when the last message was received.
+
+        Before any message arrives, this is the time `run` was started.
+        """
+        return self._last_received
+
+    @property
+    def queued_requests(self) -> int:
+        """Get the number of requests waiting to be sent because of max_in_flight."""
+        return self._queued
+
+    @property
+    def in_flight_requests(self) -> int:
+        """Get the number of requests that have been sent and await a response."""
+        return len(self._in_flight_requests)
+
+    @property
+    def write_buffer_size(self) -> int:
+        """Get the number of bytes waiting to be written to the bridge."""
+        return self._writer.transport.get_write_buffer_size()
+
+    @property
+    def write_queue_depth(self) -> int:
+        """Get the number of requests waiting for the writer."""
+        return self._write_queue.qsize()
+
+    @property
+    def write_waits(self) -> Dict[int, WriteWait]:
+        """Get how long requests waited to be written, by priority."""
+        return dict(self._write_waits)
 
     async def request(
         self,
@@ -39,12 +308,41 @@ class LeapProtocol:
         url: str,
         body: Optional[dict] = None,
         tag: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Response:
+        """
+        Make a request to the bridge and return the response.
+
+        :param priority: PRIORITY_INTERACTIVE, PRIORITY_PING or PRIORITY_BULK. Queued
+        requests are written lowest priority value first.
+        """
+        if self._in_flight_limit is None:
+            return await self._request(communique_type, url, body, tag, priority)
+
+        self._queued += 1
+        try:
+            await self._in_flight_limit.acquire(priority)
+        finally:
+            self._queued -= 1
+
+        try:
+            return await self._request(communique_type, url, body, tag, priority)
+        finally:
+            self._in_flight_limit.release()
+
+    async def _request(
+        self,
+        communique_type: str,
+        url: str,
+        body: Optional[dict],
+        tag: Optional[str],
+        priority: int,
     ) -> Response:
-        """Make a request to the bridge and return the response."""
         if tag is None:
-            tag = _make_tag()
+            tag = self._make_tag()
 
-        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future = loop.create_future()
 
         cmd = {
             "CommuniqueType": communique_type,
@@ -54,7 +352,13 @@ class LeapProtocol:
         if body is not None:
             cmd["Body"] = body
 
+        if self._write_error is not None:
+            raise BridgeDisconnectedError(self._write_error)
+
         self._in_flight_requests[tag] = future
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.in_flight_changed(len(self._in_flight_requests))
 
         # remove cancelled tasks
         def clean_up(future):
@@ -64,54 +368,221 @@ class LeapProtocol:
         future.add_done_callback(clean_up)
 
         try:
-            text = json.dumps(cmd).encode("UTF-8")
-            _LOG.debug("sending %s", text)
-            self._writer.write(text + b"\r\n")
-
-            return await future
+            text = self._codec.dumps(cmd)
+
+            if priority >= PRIORITY_BULK:
+                await self._bulk_slots.acquire()
+                if future.done():
+                    # the connection was closed while waiting for room in the queue
+                    self._bulk_slots.release()
+                    return await future
+            enqueued = loop.time()
+            self._write_queue.put_nowait(
+                _QueuedWrite(
+                    priority,
+                    next(self._write_sequence),
+                    text + b"\r\n",
+                    enqueued,
+                    future,
+                    tag,
+                    communique_type,
+                    url,
+                )
+            )
+
+            response = await future
+            if metrics is not None:
+                metrics.request_completed(
+                    communique_type, url_template(url), loop.time() - enqueued
+                )
+            return response
         finally:
             self._in_flight_requests.pop(tag, None)
+            if metrics is not None:
+                metrics.in_flight_changed(len(self._in_flight_requests))
+
+    async def _write_loop(self):
+        """
+        Write queued requests, most urgent first.
+
+        If a write fails, every request waiting for the writer or for a response
+        fails with BridgeDisconnectedError, and so does the writer.
+        """
+        try:
+            await self._write_queued()
+        # CancelledError is an Exception before Python 3.8
+        except asyncio.CancelledError:  # pylint: disable=try-except-raise
+            raise
+        except Exception as ex:
+            _LOG.debug("Failed to write to the bridge", exc_info=True)
+            self._write_error = ex
+            self._fail_requests(ex)
+            self._clear_write_queue()
+            raise BridgeDisconnectedError(ex) from ex
+
+    async def _write_queued(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            write = await self._write_queue.get()
+            if write.priority >= PRIORITY_BULK:
+                self._bulk_slots.release()
+
+            # the request was cancelled while it was queued
+            if write.future.done():
+                continue
+
+            waited = loop.time() - write.enqueued
+            writes, total, longest = self._write_waits.get(write.priority, WriteWait())
+            self._write_waits[write.priority] = WriteWait(
+                writes + 1, total + waited, max(longest, waited)
+            )
+
+            if _LOG.isEnabledFor(logging.DEBUG):
+                _LOG.debug("sending %s", write.data)
+            self._writer.write(write.data)
+            if self._metrics is not None:
+                self._metrics.message_sent(len(write.data))
+            if self._tracer is not None:
+                self._tracer.on_send(
+                    write.tag, write.communique_type, write.url, len(write.data)
+                )
+            if self.write_buffer_size > self._write_high_water:
+                await self._writer.drain()
+
+    def _fail_requests(self, cause: Optional[BaseException] = None):
+        """Fail every request that is waiting to be written or for a response."""
+        requests = list(self._in_flight_requests.values())
+        self._in_flight_requests.clear()
+        for request in requests:
+            if not request.done():
+                if cause is None:
+                    request.set_exception(BridgeDisconnectedError())
+                else:
+                    request.set_exception(BridgeDisconnectedError(cause))
+
+    def _clear_write_queue(self):
+        while not self._write_queue.empty():
+            if self._write_queue.get_nowait().priority >= PRIORITY_BULK:
+                self._bulk_slots.release()
 
     async def run(self):
-        """Event monitoring loop."""
-        while not self._reader.at_eof():
-            received = await self._reader.readline()
+        """
+        Event monitoring loop.
+
+        Requests are only written to the bridge while this is running. This returns
+        when the bridge closes the connection, and raises BridgeDisconnectedError if
+        writing to the bridge fails.
+        """
+        loop = asyncio.get_running_loop()
+        self._last_received = loop.time()
+        write_task = loop.create_task(self._write_loop())
+        self._write_task = write_task
+        read_task = loop.create_task(self._read_loop())
+        try:
+            await asyncio.wait(
+                (read_task, write_task), return_when=asyncio.FIRST_COMPLETED
+            )
+            # the writer only stops by itself when a write fails. If it was
+            # cancelled by close, the reader finishes once the connection closes.
+            if write_task.done() and not write_task.cancelled():
+                write_task.result()
+            await read_task
+        finally:
+            read_task.cancel()
+            write_task.cancel()
+            if self._write_task is write_task:
+                self._write_task = None
+
+    async def _read_loop(self):
+        lines = _LineReader(self._reader, max_size=self._max_message_size)
+        loop = asyncio.get_running_loop()
+        metrics = self._metrics
+        tracer = self._tracer
+        parse_time = 0.0
+        while True:
+            received = await lines.readline()
 
             if received == b"":
                 break
 
-            resp_json = json.loads(received.decode("UTF-8"))
+            self._last_received = loop.time()
+
+            if metrics is None and tracer is None:
+                resp_json = self._codec.loads(received)
+            else:
+                started = time.perf_counter()
+                resp_json = self._codec.loads(received)
+                parse_time = time.perf_counter() - started
+                if metrics is not None:
+                    metrics.message_received(len(received), parse_time)
 
             if isinstance(resp_json, dict):
-                tag = resp_json.get("Header", {}).pop("ClientTag", None)
+                header = resp_json.get("Header", {})
+                tag = header.pop("ClientTag", None)
+                if tracer is not None:
+                    tracer.on_receive(
+                        tag,
+                        resp_json.get("CommuniqueType", None),
+                        header.get("Url", None),
+                        len(received),
+                        parse_time,
+                    )
                 if tag is not None:
-                    in_flight = self._in_flight_requests.pop(tag, None)
-                    if in_flight is not None and not in_flight.done():
-                        _LOG.debug("received: %s", resp_json)
-                        in_flight.set_result(Response.from_json(resp_json))
-                    else:
-                        subscription = self._tagged_subscriptions.get(tag, None)
-                        if subscription is not None:
-                            _LOG.debug(
-                                "received for subscription %s: %s", tag, resp_json
-                            )
-                            subscription(Response.from_json(resp_json))
-                        else:
-                            _LOG.error(
-                                "Was not expecting message with tag %s: %s",
-                                tag,
-                                resp_json,
-                            )
+                    self._dispatch_tagged(tag, resp_json, header)
                 else:
-                    _LOG.debug("Received message with no tag: %s", resp_json)
-                    obj = Response.from_json(resp_json)
-                    for handler in self._unsolicited_subs:
-                        try:
-                            handler(obj)
-                        except Exception:  # pylint: disable=broad-except
-                            _LOG.exception(
-                                "Got exception from unsolicited message handler"
-                            )
+                    self._dispatch_unsolicited(resp_json, header)
+
+    def _dispatch_tagged(self, tag: str, resp_json: dict, header: dict):
+        tracer = self._tracer
+        in_flight = self._in_flight_requests.pop(tag, None)
+        if in_flight is not None and not in_flight.done():
+            if _LOG.isEnabledFor(logging.DEBUG):
+                _LOG.debug("received: %s", resp_json)
+            if tracer is not None:
+                tracer.on_dispatch(tag, header.get("Url", None), "response", 1)
+            in_flight.set_result(Response.from_json(resp_json))
+            return
+
+        subscription = self._tagged_subscriptions.get(tag, None)
+        if subscription is None:
+            _LOG.error("Was not expecting message with tag %s: %s", tag, resp_json)
+            if tracer is not None:
+                tracer.on_dispatch(tag, header.get("Url", None), "unexpected", 0)
+            return
+
+        if _LOG.isEnabledFor(logging.DEBUG):
+            _LOG.debug("received for subscription %s: %s", tag, resp_json)
+        if tracer is None:
+            subscription(Response.from_json(resp_json))
+        else:
+            tracer.on_dispatch(tag, header.get("Url", None), "subscription", 1)
+            tracer.call(
+                tag, "subscription", subscription, Response.from_json(resp_json)
+            )
+
+    def _dispatch_unsolicited(self, resp_json: dict, header: dict):
+        if _LOG.isEnabledFor(logging.DEBUG):
+            _LOG.debug("Received message with no tag: %s", resp_json)
+        url = header.get("Url", None)
+        handlers = self._unsolicited.handlers(
+            resp_json.get("CommuniqueType", None),
+            header.get("MessageBodyType", None),
+            url,
+        )
+        tracer = self._tracer
+        if tracer is not None:
+            tracer.on_dispatch(None, url, "unsolicited", len(handlers))
+        if not handlers:
+            return
+        obj = Response.from_json(resp_json)
+        for handler in handlers:
+            try:
+                if tracer is None:
+                    handler(obj)
+                else:
+                    tracer.call(None, "unsolicited", handler, obj)
+            except Exception:  # pylint: disable=broad-except
+                _LOG.exception("Got exception from unsolicited message handler")
 
     async def subscribe(
         self,
@@ -120,6 +591,7 @@ class LeapProtocol:
         body: Optional[dict] = None,
         communique_type: str = "SubscribeRequest",
         tag: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
     ) -> Tuple[Response, str]:
         """
         Subscribe to events from the bridge.
@@ -129,57 +601,403 @@ class LeapProtocol:
         responses will be handled by the provided callback.
 
         This returns both the response message and a string that will be required for
-        unsubscribing (not implemented).
+        unsubscribing with `unsubscribe`.
         """
         if not callable(callback):
             raise TypeError("callback must be callable")
 
         if tag is None:
-            tag = _make_tag()
+            tag = self._make_tag()
 
-        response = await self.request(communique_type, url, body, tag=tag)
+        response = await self.request(
+            communique_type, url, body, tag=tag, priority=priority
+        )
 
         status = response.Header.StatusCode
         if status is not None and status.is_successful():
             self._tagged_subscriptions[tag] = callback
+            self._subscription_urls[tag] = url
             _LOG.debug("Subscribed to %s as %s", url, tag)
 
         return (response, tag)
 
-    def subscribe_unsolicited(self, callback: Callable[[Response], None]):
+    async def unsubscribe(self, tag: str) -> Optional[Response]:
+        """
+        Stop a subscription made with `subscribe`.
+
+        The bridge is asked to stop sending events. The callback is still called for
+        events that arrive before the bridge answers, and if the bridge rejects the
+        request, the subscription stays open.
+
+        LEAP unsubscribes by URL rather than by tag, so nothing is sent while other
+        subscriptions on this connection use the same URL. The subscription is closed
+        here instead and its events are dropped, until the last subscription to the
+        URL is stopped.
+
+        :param tag: the tag returned by `subscribe`
+        :returns the response to the UnsubscribeRequest, or None if other
+        subscriptions to the URL are still open and nothing was sent
+        :raises KeyError: if there is no subscription with the tag
+        :raises BridgeResponseError: if the bridge rejects the request
+        """
+        url = self._subscription_urls[tag]
+        if any(
+            other_url == url and other != tag
+            for other, other_url in self._subscription_urls.items()
+        ):
+            del self._subscription_urls[tag]
+            self._tagged_subscriptions[tag] = _ignore_response
+            self._detached_subscriptions[tag] = url
+            _LOG.debug("Detached from %s as %s", url, tag)
+            return None
+
+        response = await self.request("UnsubscribeRequest", url)
+        status = response.Header.StatusCode
+        if status is None or not status.is_successful():
+            raise BridgeResponseError(response)
+
+        self._subscription_urls.pop(tag, None)
+        self._tagged_subscriptions.pop(tag, None)
+        for other, other_url in list(self._detached_subscriptions.items()):
+            if other_url == url:
+                del self._detached_subscriptions[other]
+                self._tagged_subscriptions.pop(other, None)
+        _LOG.debug("Unsubscribed from %s as %s", url, tag)
+        return response
+
+    def is_subscribed(self, tag: str) -> bool:
+        """Check if there is an open subscription with the tag."""
+        return tag in self._subscription_urls
+
+    def subscription(
+        self,
+        url: str,
+        callback: Callable[[Response], None],
+        body: Optional[dict] = None,
+        communique_type: str = "SubscribeRequest",
+    ) -> "Subscription":
+        """
+        Get a handle for a subscription that can be used as an async context manager.
+
+        Nothing is sent until the subscription is entered or its `subscribe` method
+        is called.
+        """
+        return Subscription(self, url, callback, body, communique_type)
+
+    def subscribe_unsolicited(
+        self,
+        callback: Callable[[Response], None],
+        *,
+        communique_type: Optional[str] = None,
+        body_type: Optional[str] = None,
+        url: Optional[str] = None,
+    ):
         """
         Subscribe to notifications of unsolicited events.
 
         The provided callback will be executed when the bridge sends an untagged
-        response message.
+        response message that matches the communique type, message body type and URL.
+        Any of these that are None match every message. See `MessageRouter` for the
+        URL patterns that are supported.
         """
-        if not callable(callback):
-            raise TypeError("callback must be callable")
-        self._unsolicited_subs.append(callback)
+        self._unsolicited.add(
+            callback, communique_type=communique_type, body_type=body_type, url=url
+        )
 
     def unsubscribe_unsolicited(self, callback: Callable[[Response], None]):
         """Unsubscribe from notifications of unsolicited events."""
-        self._unsolicited_subs.remove(callback)
+        self._unsolicited.remove(callback)
 
     def close(self):
         """Disconnect."""
         self._writer.close()
 
-        for request in self._in_flight_requests.values():
-            request.set_exception(BridgeDisconnectedError())
-        self._in_flight_requests.clear()
+        if self._write_task is not None:
+            self._write_task.cancel()
+            self._write_task = None
+        self._clear_write_queue()
+
+        self._fail_requests()
         self._tagged_subscriptions.clear()
+        self._subscription_urls.clear()
+        self._detached_subscriptions.clear()
+
+
+def _ignore_response(_: Response):
+    pass
+
+
+class Subscription:
+    """
+    A tagged subscription to a resource on the bridge.
+
+    Entering the subscription with `async with` subscribes, and leaving it
+    unsubscribes. The response to the SubscribeRequest is available as `response`.
+    """
+
+    def __init__(
+        self,
+        leap: LeapProtocol,
+        url: str,
+        callback: Callable[[Response], None],
+        body: Optional[dict] = None,
+        communique_type: str = "SubscribeRequest",
+    ):
+        """Create a subscription to url. Use `LeapProtocol.subscription` instead."""
+        self.url = url
+        self.response: Optional[Response] = None
+        self.tag: Optional[str] = None
+        self._leap = leap
+        self._callback = callback
+        self._body = body
+        self._communique_type = communique_type
+
+    @property
+    def active(self) -> bool:
+        """Check if the bridge accepted the subscription and it is still open."""
+        return self.tag is not None and self._leap.is_subscribed(self.tag)
+
+    async def subscribe(self) -> Response:
+        """Subscribe, and return the response from the bridge."""
+        if self.active:
+            raise RuntimeError(f"already subscribed to {self.url}")
+        self.response, self.tag = await self._leap.subscribe(
+            self.url,
+            self._callback,
+            body=self._body,
+            communique_type=self._communique_type,
+        )
+        return self.response
+
+    async def unsubscribe(self) -> Optional[Response]:
+        """
+        Unsubscribe, if the subscription is active.
+
+        :returns the response to the UnsubscribeRequest, or None if the subscription
+        was not active or nothing was sent. See `LeapProtocol.unsubscribe`.
+        """
+        if not self.active:
+            return None
+        assert self.tag is not None
+        return await self._leap.unsubscribe(self.tag)
+
+    async def __aenter__(self) -> "Subscription":
+        """Subscribe."""
+        await self.subscribe()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Unsubscribe, unless the connection has already been closed."""
+        await self.unsubscribe()
+
+
+_RouteKey = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+class MessageRouter:
+    """
+    Route messages to handlers by communique type, message body type and URL.
+
+    Each handler is added with a pattern, and any part of the pattern that is None
+    matches every message. A URL pattern is either an exact URL, or a URL with * in
+    place of the id, such as /zone/*/status. The handlers for each distinct
+    combination of communique type, body type and URL are only looked up once, so
+    routing a message takes the same time no matter how many handlers there are.
+    Handlers are called in the order they were added.
+    """
+
+    def __init__(self):
+        """Create a router without any handlers."""
+        self._routes: Dict[_RouteKey, List[Tuple[int, Callable[[Response], None]]]] = {}
+        self._sequence = itertools.count()
+        self._resolved: Dict[_RouteKey, Tuple[Callable[[Response], None], ...]] = {}
+
+    def add(
+        self,
+        callback: Callable[[Response], None],
+        *,
+        communique_type: Optional[str] = None,
+        body_type: Optional[str] = None,
+        url: Optional[str] = None,
+    ):
+        """
+        Route matching messages to a handler.
+
+        :param callback: the handler to call with each matching message
+        :param communique_type: the CommuniqueType to match, e.g. ReadResponse
+        :param body_type: the MessageBodyType to match, e.g. OneZoneStatus
+        :param url: the URL or URL pattern to match, e.g. /zone/*/status
+        """
+        if not callable(callback):
+            raise TypeError("callback must be callable")
+        key = (communique_type, body_type, url)
+        self._routes.setdefault(key, []).append((next(self._sequence), callback))
+        self._resolved.clear()
+
+    def remove(self, callback: Callable[[Response], None]):
+        """
+        Stop routing messages to a handler.
+
+        :raises ValueError: if the handler was never added
+        """
+        found = False
+        for key, entries in list(self._routes.items()):
+            kept = [entry for entry in entries if entry[1] != callback]
+            if len(kept) == len(entries):
+                continue
+            found = True
+            if kept:
+                self._routes[key] = kept
+            else:
+                del self._routes[key]
+        if not found:
+            raise ValueError("callback is not subscribed")
+        self._resolved.clear()
+
+    def handlers(
+        self,
+        communique_type: Optional[str],
+        body_type: Optional[str],
+        url: Optional[str],
+    ) -> Tuple[Callable[[Response], None], ...]:
+        """Get the handlers for a message, in the order they were added."""
+        key = (communique_type, body_type, url)
+        handlers = self._resolved.get(key, None)
+        if handlers is None:
+            handlers = self._resolve(communique_type, body_type, url)
+            # the bridge only uses a few hundred urls, but don't let a misbehaving
+            # one grow the cache forever
+            if len(self._resolved) >= _ROUTE_CACHE_SIZE:
+                self._resolved.clear()
+            self._resolved[key] = handlers
+        return handlers
+
+    def dispatch(self, response: Response):
+        """Call the handlers for a message."""
+        header = response.Header
+        for handler in self.handlers(
+            response.CommuniqueType, header.MessageBodyType, header.Url
+        ):
+            handler(response)
+
+    def _resolve(
+        self,
+        communique_type: Optional[str],
+        body_type: Optional[str],
+        url: Optional[str],
+    ) -> Tuple[Callable[[Response], None], ...]:
+        communique_types = (
+            (None,) if communique_type is None else (communique_type, None)
+        )
+        body_types = (None,) if body_type is None else (body_type, None)
+        urls: List[Optional[str]] = [None]
+        if url is not None:
+            urls.append(url)
+            template = url_template(url)
+            if template != url:
+                urls.append(template)
+
+        matches: List[Tuple[int, Callable[[Response], None]]] = []
+        for communique_type_pattern in communique_types:
+            for body_type_pattern in body_types:
+                for url_pattern in urls:
+                    matches.extend(
+                        self._routes.get(
+                            (communique_type_pattern, body_type_pattern, url_pattern),
+                            (),
+                        )
+                    )
+        matches.sort(key=lambda entry: entry[0])
+        return tuple(callback for _, callback in matches)
+
+
+def url_template(url: str) -> str:
+    """
+    Replace the id in a URL with *, e.g. /zone/*/status for /zone/12/status.
+
+    URLs without an id are returned unchanged.
+    """
+    try:
+        href = parse_href(url)
+    except ValueError:
+        return url
+    if href.subresource is None:
+        return f"/{href.resource}/*"
+    return f"/{href.resource}/*/{href.subresource}"
 
 
 async def open_connection(
-    host: str, port: int, *, limit: int = _DEFAULT_LIMIT, **kwds
+    host: str,
+    port: int,
+    *,
+    limit: int = _DEFAULT_LIMIT,
+    codec: JsonCodec = DEFAULT_CODEC,
+    max_in_flight: Optional[int] = None,
+    write_high_water: int = _DEFAULT_WRITE_HIGH_WATER,
+    bulk_queue_size: int = _DEFAULT_BULK_QUEUE_SIZE,
+    max_message_size: int = _DEFAULT_MAX_MESSAGE_SIZE,
+    metrics: Optional[MetricsSink] = None,
+    tracer: Optional[Tracer] = None,
+    **kwds,
 ) -> LeapProtocol:
-    """Open a stream and wrap it with LEAP."""
+    """
+    Open a stream and wrap it with LEAP.
+
+    codec, max_in_flight, write_high_water, bulk_queue_size, max_message_size, metrics
+    and tracer are passed to LeapProtocol. Other keyword arguments are passed to
+    asyncio.open_connection.
+    """
     reader, writer = await asyncio.open_connection(host, port, limit=limit, **kwds)
-    return LeapProtocol(reader, writer)
+    return LeapProtocol(
+        reader,
+        writer,
+        codec=codec,
+        max_in_flight=max_in_flight,
+        write_high_water=write_high_water,
+        bulk_queue_size=bulk_queue_size,
+        max_message_size=max_message_size,
+        metrics=metrics,
+        tracer=tracer,
+    )
 
 
-_HREFRE = re.compile(r"/(?:\D+)/(\d+)(?:\/\D+)?")
+class Href(NamedTuple):
+    """The parts of a LEAP href such as /occupancygroup/3/status."""
+
+    resource: str
+    id: str
+    subresource: Optional[str] = None
+
+
+@lru_cache(maxsize=_HREF_CACHE_SIZE)
+def parse_href(href: str) -> Href:
+    """
+    Split an href into its resource, id and subresource.
+
+    For example, /zone/12/status is resource "zone", id "12" and subresource
+    "status". The id is the first path segment made only of digits. Results are
+    cached, since the bridge refers to the same few hundred hrefs over and over.
+
+    :raises ValueError: if the href does not contain an id
+    """
+    # the common case is /resource/id or /resource/id/subresource
+    parts = href.split("/", 3)
+    if len(parts) > 2 and parts[0] == "" and parts[1] and not parts[1].isdecimal():
+        if parts[2].isdecimal():
+            subresource = parts[3] if len(parts) > 3 else None
+            return Href(parts[1], parts[2], subresource or None)
+
+        # nested resources, e.g. /a/b/3
+        segments = href.split("/")
+        for index in range(3, len(segments)):
+            if segments[index].isdecimal():
+                return Href(
+                    "/".join(segments[1:index]),
+                    segments[index],
+                    "/".join(segments[index + 1 :]) or None,
+                )
+
+    raise ValueError(f"Cannot find ID from href {href!r}")
 
 
 def id_from_href(href: str) -> str:
@@ -187,9 +1005,4 @@ def id_from_href(href: str) -> str:
 
     Raises ValueError if id cannot be determined from the format
     """
-    match = _HREFRE.match(href)
-
-    if match is None:
-        raise ValueError(f"Cannot find ID from href {href!r}")
-
-    return match.group(1)
+    return parse_href(href).id
@@ -1,35 +1,51 @@
 """Models for messages exchanged with the bridge."""
 
-from typing import NamedTuple, Optional
+from functools import lru_cache
+from typing import Any, Dict, Iterator, NamedTuple, Optional
+
+# The number of distinct status strings to remember. The bridge only uses a few.
+_STATUS_CACHE_SIZE = 32
 
 
 class ResponseStatus:
-    """A response status split into its code and message parts."""
+    """
+    A response status split into its code and message parts.
+
+    Instances are immutable, and parsed statuses are shared: the bridge only ever sends
+    a handful of distinct statuses, so `from_str` returns cached instances.
+    """
+
+    __slots__ = ("code", "message")
+
+    code: Optional[int]
+    message: str
 
     def __init__(self, code: Optional[int], message: str):
         """Create a new ResponseStatus."""
-        self.code = code
-        self.message = message
+        object.__setattr__(self, "code", code)
+        object.__setattr__(self, "message", message)
 
     @classmethod
     def from_str(cls, data: str) -> "ResponseStatus":
         """Convert a str to a ResponseStatus."""
-        space = data.find(" ")
-        if space == -1:
-            code = None
-        else:
-            try:
-                code = int(data[:space])
-                data = data[space + 1 :]
-            except ValueError:
-                code = None
-
-        return ResponseStatus(code, data)
+        return _parse_status(data)
 
     def is_successful(self) -> bool:
         """Check if the status code is in the range [200, 300)."""
         return self.code is not None and self.code >= 200 and self.code < 300
 
+    def __setattr__(self, name, value):
+        """Prevent modification of the ResponseStatus."""
+        raise AttributeError(f"cannot assign to field {name!r}")
+
+    def __delattr__(self, name):
+        """Prevent modification of the ResponseStatus."""
+        raise AttributeError(f"cannot delete field {name!r}")
+
+    def __reduce__(self):
+        """Support pickling despite being immutable."""
+        return (ResponseStatus, (self.code, self.message))
+
     def __repr__(self):
         """Get a string representation of the ResponseStatus."""
         return f"ResponseStatus({self.code!r}, {self.message!r})"
@@ -46,6 +62,25 @@ class ResponseStatus:
             and self.message == other.message
         )
 
+    def __hash__(self):
+        """Hash the ResponseStatus."""
+        return hash((self.code, self.message))
+
+
+@lru_cache(maxsize=_STATUS_CACHE_SIZE)
+def _parse_status(data: str) -> ResponseStatus:
+    space = data.find(" ")
+    if space == -1:
+        code = None
+    else:
+        try:
+            code = int(data[:space])
+            data = data[space + 1 :]
+        except ValueError:
+            code = None
+
+    return ResponseStatus(code, data)
+
 
 class ResponseHeader(NamedTuple):
     """A LEAP response header."""
@@ -69,20 +104,98 @@ class ResponseHeader(NamedTuple):
         )
 
 
-class Response(NamedTuple):
-    """A LEAP response."""
+class Response:
+    """
+    A LEAP response.
+
+    This has the same interface as a NamedTuple with the fields Header, CommuniqueType
+    and Body. Responses decoded from the bridge with `from_json` keep the raw header
+    and only parse it into a ResponseHeader the first time it is accessed, since most
+    messages are only ever inspected for their body.
+    """
 
     # pylint: disable=invalid-name
 
-    Header: ResponseHeader
-    CommuniqueType: Optional[str] = None
-    Body: Optional[dict] = {}
+    __slots__ = ("_header", "_raw_header", "_communique_type", "_body")
+
+    _fields = ("Header", "CommuniqueType", "Body")
+
+    def __init__(
+        self,
+        Header: ResponseHeader,
+        CommuniqueType: Optional[str] = None,
+        Body: Optional[dict] = {},  # pylint: disable=dangerous-default-value
+    ):
+        """Create a new Response."""
+        self._header: Optional[ResponseHeader] = Header
+        self._raw_header: Optional[dict] = None
+        self._communique_type = CommuniqueType
+        self._body = Body
 
     @classmethod
     def from_json(cls, data: dict) -> "Response":
         """Convert a JSON dictionary to a Response."""
-        return Response(
-            Header=ResponseHeader.from_json(data.get("Header", {})),
-            CommuniqueType=data.get("CommuniqueType", None),
-            Body=data.get("Body", None),
+        # pylint: disable=protected-access
+        response = cls.__new__(cls)
+        response._header = None
+        response._raw_header = data.get("Header", {})
+        response._communique_type = data.get("CommuniqueType", None)
+        response._body = data.get("Body", None)
+        return response
+
+    @property
+    def Header(self) -> ResponseHeader:
+        """Get the response header."""
+        header = self._header
+        if header is None:
+            header = ResponseHeader.from_json(self._raw_header or {})
+            self._header = header
+            self._raw_header = None
+        return header
+
+    @property
+    def CommuniqueType(self) -> Optional[str]:
+        """Get the type of the response, e.g. ReadResponse."""
+        return self._communique_type
+
+    @property
+    def Body(self) -> Optional[dict]:
+        """Get the response body."""
+        return self._body
+
+    def _asdict(self) -> Dict[str, Any]:
+        """Get the fields of the response as a dictionary."""
+        return dict(zip(self._fields, self))
+
+    def _replace(self, **kwargs) -> "Response":
+        """Get a new Response with some fields replaced."""
+        return Response(**{**self._asdict(), **kwargs})
+
+    def __iter__(self) -> Iterator[Any]:
+        """Iterate over the fields of the response."""
+        return iter((self.Header, self._communique_type, self._body))
+
+    def __len__(self) -> int:
+        """Get the number of fields in the response."""
+        return len(self._fields)
+
+    def __getitem__(self, index):
+        """Get a field of the response by index."""
+        return tuple(self)[index]
+
+    def __eq__(self, other):
+        """Check if this Response is equal to another Response or tuple."""
+        if isinstance(other, (Response, tuple)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        """Hash the fields of the response."""
+        return hash(tuple(self))
+
+    def __repr__(self):
+        """Get a string representation of the Response."""
+        return (
+            f"Response(Header={self.Header!r}, "
+            f"CommuniqueType={self._communique_type!r}, Body={self._body!r})"
         )
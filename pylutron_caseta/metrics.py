@@ -0,0 +1,176 @@
+"""Instrumentation of the requests and messages exchanged with the bridge."""
+
+from bisect import bisect_left
+from typing import Dict, NamedTuple, Sequence, Tuple
+
+# upper bounds, in seconds, of the buckets for request latencies
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# upper bounds, in seconds, of the buckets for the time to decode a message
+PARSE_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2)
+
+# a communique type and URL template, e.g. ("ReadRequest", "/zone/*/status")
+RequestKey = Tuple[str, str]
+
+
+class MetricsSink:
+    """
+    Receive measurements from `LeapProtocol` and `Smartbridge`.
+
+    Every method does nothing, so subclasses only override the measurements they
+    want. URLs are reported as templates with * in place of the id, such as
+    /zone/*/status, so that they can be used as labels without creating a series for
+    every device.
+
+    Instrumentation is off unless a sink is passed in, so there is no cost to the
+    default.
+    """
+
+    def request_completed(self, communique_type: str, url: str, duration: float):
+        """
+        Record a request that was answered by the bridge.
+
+        :param duration: seconds from queueing the request to receiving the response
+        """
+
+    def request_timed_out(self, communique_type: str, url: str):
+        """Record a request that was abandoned before the bridge answered it."""
+
+    def in_flight_changed(self, in_flight: int):
+        """Record the number of requests waiting for a response."""
+
+    def message_sent(self, size: int):
+        """Record a message written to the bridge, and its size in bytes."""
+
+    def message_received(self, size: int, parse_time: float):
+        """Record a message read from the bridge, its size and the time to decode it."""
+
+
+class HistogramSnapshot(NamedTuple):
+    """The values recorded by a `Histogram`."""
+
+    samples: int
+    sum: float
+    # the upper bound of each bucket and the number of values at or below it. The
+    # last bucket is unbounded.
+    buckets: Tuple[Tuple[float, int], ...]
+
+
+class Histogram:
+    """Count values in cumulative buckets, like a Prometheus histogram."""
+
+    __slots__ = ("_bounds", "_counts", "_sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        """
+        Create an empty histogram.
+
+        :param bounds: the upper bound of each bucket, in increasing order
+        """
+        self._bounds = tuple(bounds)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float):
+        """Add a value."""
+        self._counts[bisect_left(self._bounds, value)] += 1
+        self._sum += value
+
+    def snapshot(self) -> HistogramSnapshot:
+        """Get the values recorded so far."""
+        buckets = []
+        total = 0
+        for bound, count in zip(self._bounds + (float("inf"),), self._counts):
+            total += count
+            buckets.append((bound, total))
+        return HistogramSnapshot(total, self._sum, tuple(buckets))
+
+
+class MetricsSnapshot(NamedTuple):
+    """A copy of the measurements recorded by `HistogramMetrics`."""
+
+    latency: Dict[RequestKey, HistogramSnapshot]
+    timeouts: Dict[RequestKey, int]
+    in_flight: int
+    max_in_flight: int
+    messages_sent: int
+    bytes_sent: int
+    messages_received: int
+    bytes_received: int
+    parse_time: HistogramSnapshot
+
+
+class HistogramMetrics(MetricsSink):
+    """
+    Keep measurements in memory so they can be exported.
+
+    Request latencies are kept in a histogram for each communique type and URL
+    template. Call `snapshot` to read them.
+    """
+
+    def __init__(
+        self,
+        latency_buckets: Sequence[float] = LATENCY_BUCKETS,
+        parse_buckets: Sequence[float] = PARSE_BUCKETS,
+    ):
+        """
+        Create a sink without any measurements.
+
+        :param latency_buckets: the upper bounds of the request latency buckets
+        :param parse_buckets: the upper bounds of the message decoding time buckets
+        """
+        self._latency_buckets = tuple(latency_buckets)
+        self._latency: Dict[RequestKey, Histogram] = {}
+        self._timeouts: Dict[RequestKey, int] = {}
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self._messages_sent = 0
+        self._bytes_sent = 0
+        self._messages_received = 0
+        self._bytes_received = 0
+        self._parse_time = Histogram(parse_buckets)
+
+    def request_completed(self, communique_type: str, url: str, duration: float):
+        """Add the latency of a request to its histogram."""
+        key = (communique_type, url)
+        histogram = self._latency.get(key, None)
+        if histogram is None:
+            histogram = Histogram(self._latency_buckets)
+            self._latency[key] = histogram
+        histogram.observe(duration)
+
+    def request_timed_out(self, communique_type: str, url: str):
+        """Count a request that timed out."""
+        key = (communique_type, url)
+        self._timeouts[key] = self._timeouts.get(key, 0) + 1
+
+    def in_flight_changed(self, in_flight: int):
+        """Update the in-flight gauge and its peak."""
+        self._in_flight = in_flight
+        self._max_in_flight = max(self._max_in_flight, in_flight)
+
+    def message_sent(self, size: int):
+        """Count a message written to the bridge."""
+        self._messages_sent += 1
+        self._bytes_sent += size
+
+    def message_received(self, size: int, parse_time: float):
+        """Count a message read from the bridge, and record its decoding time."""
+        self._messages_received += 1
+        self._bytes_received += size
+        self._parse_time.observe(parse_time)
+
+    def snapshot(self) -> MetricsSnapshot:
+        """Get a copy of the measurements recorded so far."""
+        return MetricsSnapshot(
+            latency={
+                key: histogram.snapshot() for key, histogram in self._latency.items()
+            },
+            timeouts=dict(self._timeouts),
+            in_flight=self._in_flight,
+            max_in_flight=self._max_in_flight,
+            messages_sent=self._messages_sent,
+            bytes_sent=self._bytes_sent,
+            messages_received=self._messages_received,
+            bytes_received=self._bytes_received,
+            parse_time=self._parse_time.snapshot(),
+        )
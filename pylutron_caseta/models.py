@@ -0,0 +1,139 @@
+"""Models for the devices, scenes, areas and occupancy groups known to the bridge."""
+
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+
+class _Record(MutableMapping):
+    """
+    A fixed set of named fields that can also be used like a dict.
+
+    Subclasses list their fields in __slots__. Reading or writing a field that does not
+    exist raises KeyError (or AttributeError for attribute access) instead of silently
+    adding a new key. Records are not dicts, so JSON encoders reject them; use as_dict
+    to get a plain dict.
+    """
+
+    __slots__: Tuple[str, ...] = ()
+
+    def __getitem__(self, key: str) -> Any:
+        """Get the value of a field."""
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any):
+        """Set the value of a field."""
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key: str):
+        """Fields cannot be removed."""
+        raise TypeError(f"cannot delete field {key!r} of {type(self).__name__}")
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the field names."""
+        return iter(self.__slots__)
+
+    def __len__(self) -> int:
+        """Get the number of fields."""
+        return len(self.__slots__)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Get a copy of the fields as a plain dict, e.g. for JSON encoding."""
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __repr__(self) -> str:
+        """Get a string representation of the record."""
+        fields = ", ".join(f"{key}={getattr(self, key)!r}" for key in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Device(_Record):
+    """A device connected to the bridge."""
+
+    # pylint: disable=redefined-builtin
+
+    __slots__ = (
+        "device_id",
+        "current_state",
+        "fan_speed",
+        "zone",
+        "name",
+        "type",
+        "model",
+        "serial",
+    )
+
+    device_id: str
+    current_state: int
+    fan_speed: Optional[str]
+    zone: Optional[str]
+    name: str
+    type: str
+    model: str
+    serial: Optional[int]
+
+    def __init__(
+        self,
+        device_id: str,
+        current_state: int = -1,
+        fan_speed: Optional[str] = None,
+        zone: Optional[str] = None,
+        name: str = "",
+        type: str = "",
+        model: str = "",
+        serial: Optional[int] = None,
+    ):
+        """Create a new Device."""
+        self.device_id = device_id
+        self.current_state = current_state
+        self.fan_speed = fan_speed
+        self.zone = zone
+        self.name = name
+        self.type = type
+        self.model = model
+        self.serial = serial
+
+
+class Scene(_Record):
+    """A scene programmed on the bridge."""
+
+    __slots__ = ("scene_id", "name")
+
+    scene_id: str
+    name: str
+
+    def __init__(self, scene_id: str, name: str):
+        """Create a new Scene."""
+        self.scene_id = scene_id
+        self.name = name
+
+
+class Area(_Record):
+    """An area (room) defined on the bridge."""
+
+    __slots__ = ("name",)
+
+    name: str
+
+    def __init__(self, name: str):
+        """Create a new Area."""
+        self.name = name
+
+
+class OccupancyGroup(_Record):
+    """A group of occupancy sensors covering an area."""
+
+    __slots__ = ("occupancy_group_id", "name", "status")
+
+    occupancy_group_id: str
+    name: str
+    status: str
+
+    def __init__(self, occupancy_group_id: str, status: str, name: str = ""):
+        """Create a new OccupancyGroup."""
+        self.occupancy_group_id = occupancy_group_id
+        self.status = status
+        self.name = name
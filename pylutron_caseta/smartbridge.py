@@ -1,12 +1,32 @@
 """Provides an API to interact with the Lutron Caseta Smart Bridge."""
+# pylint: disable=too-many-lines
 
 import asyncio
+from collections import deque
 from datetime import timedelta
+from enum import Enum
 import logging
+from functools import partial
 import math
+import random
 import socket
 import ssl
-from typing import Callable, Dict, List, Optional, Tuple
+import time
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 try:
     from asyncio import get_running_loop as get_loop
@@ -15,22 +35,126 @@ except ImportError:
     from asyncio import get_event_loop as get_loop
 
 from . import (
-    _LEAP_DEVICE_TYPES,
+    _LEAP_DEVICE_DOMAINS,
+    COVER_LOWER,
+    COVER_RAISE,
+    COVER_STOP,
     FAN_OFF,
     OCCUPANCY_GROUP_UNKNOWN,
     BridgeDisconnectedError,
     BridgeResponseError,
 )
-from .leap import open_connection, id_from_href, LeapProtocol
+from .cache import CachedTopology, TopologyCache
+from .helpers import _Coalescer, _gather_limited, _LeapSubscription
+from .leap import (
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_PING,
+    LeapProtocol,
+    id_from_href,
+    open_connection,
+    url_template,
+)
 from .messages import Response
+from .metrics import MetricsSink
+from .tracing import Tracer
+from .models import Area, Device, OccupancyGroup, Scene
 
 _LOG = logging.getLogger(__name__)
 
 LEAP_PORT = 8081
+OCCUPANCY_GROUP_STATUS_URL = "/occupancygroup/status"
+ZONE_STATUS_URL = "/zone/status"
+DEVICE_URL = "/device"
+SCENE_URL = "/virtualbutton"
+AREA_URL = "/area"
+OCCUPANCY_GROUP_URL = "/occupancygroup"
 PING_INTERVAL = 60.0
+PING_TIMEOUT = 5.0
 CONNECT_TIMEOUT = 5.0
 REQUEST_TIMEOUT = 5.0
 RECONNECT_DELAY = 2.0
+MAX_RECONNECT_DELAY = 60.0
+MAX_CONCURRENT_REQUESTS = 10
+# the number of connection state changes kept in Smartbridge.connection_history
+_CONNECTION_HISTORY_SIZE = 100
+
+
+class BatchCommand(NamedTuple):
+    """A command for one device sent as part of Smartbridge.execute_batch."""
+
+    device_id: str
+    value: Union[int, str]
+    fade_time: Optional[timedelta] = None
+
+
+class TopologyChanges(NamedTuple):
+    """The devices and scenes that changed when the topology was reloaded."""
+
+    devices_added: FrozenSet[str] = frozenset()
+    devices_removed: FrozenSet[str] = frozenset()
+    devices_changed: FrozenSet[str] = frozenset()
+    scenes_added: FrozenSet[str] = frozenset()
+    scenes_removed: FrozenSet[str] = frozenset()
+    scenes_changed: FrozenSet[str] = frozenset()
+
+
+class ReconnectPolicy(NamedTuple):
+    """
+    How long to wait before reconnecting after the connection to the bridge fails.
+
+    The first retry is immediate, unless immediate_first_retry is False. After that,
+    the delay starts at initial_delay and is multiplied by multiplier after every
+    failure, up to max_delay. Each delay is then shortened by a random fraction of up
+    to jitter, so that many clients of a bridge that restarts don't all retry at
+    once. The count of failures is reset once logging in succeeds.
+    """
+
+    initial_delay: float = RECONNECT_DELAY
+    max_delay: float = MAX_RECONNECT_DELAY
+    multiplier: float = 2.0
+    jitter: float = 0.5
+    immediate_first_retry: bool = True
+
+    def delay(self, attempt: int, rand: Callable[[], float] = random.random) -> float:
+        """
+        Get the delay before a reconnect.
+
+        :param attempt: how many times in a row connecting has failed before, e.g. 0
+        for the first failure
+        :param rand: a function returning a random number in [0, 1)
+        """
+        if self.immediate_first_retry:
+            if attempt == 0:
+                return 0.0
+            attempt -= 1
+        # avoid overflowing for a bridge that has been gone for a long time
+        delay = self.max_delay
+        if attempt < 64:
+            delay = min(delay, self.initial_delay * self.multiplier**attempt)
+        return delay * (1.0 - self.jitter * rand())
+
+
+class ConnectionState(Enum):
+    """The state of the connection to the bridge."""
+
+    DISCONNECTED = "disconnected"
+    CONNECTING = "connecting"
+    LOGGING_IN = "logging_in"
+    READY = "ready"
+    BACKING_OFF = "backing_off"
+
+
+class ConnectionStateChange(NamedTuple):
+    """A change in the state of the connection to the bridge."""
+
+    state: ConnectionState
+    # time.time() when the state was entered
+    timestamp: float
+    # how many times in a row connecting has failed
+    attempt: int
+    # for BACKING_OFF, how long until the next attempt
+    delay: Optional[float] = None
 
 
 class Smartbridge:
@@ -40,15 +164,87 @@ class Smartbridge:
     It uses an SSL interface known as the LEAP server.
     """
 
-    def __init__(self, connect: Callable[[], LeapProtocol]):
-        """Initialize the Smart Bridge."""
-        self.devices: Dict[str, dict] = {}
-        self.scenes: Dict[str, dict] = {}
-        self.occupancy_groups: Dict[str, dict] = {}
-        self.areas: Dict[str, dict] = {}
+    def __init__(
+        self,
+        connect: Callable[[], LeapProtocol],
+        *,
+        max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS,
+        coalesce_commands: bool = False,
+        topology_cache: Optional[TopologyCache] = None,
+        ping_interval: float = PING_INTERVAL,
+        ping_timeout: float = PING_TIMEOUT,
+        reconnect_policy: ReconnectPolicy = ReconnectPolicy(),
+        metrics: Optional[MetricsSink] = None,
+        tracer: Optional[Tracer] = None,
+    ):
+        """
+        Initialize the Smart Bridge.
+
+        :param connect: coroutine function that opens a LEAP connection
+        :param max_concurrent_requests: how many requests may be in flight at once
+        when reading state in bulk, such as zone statuses during login
+        :param coalesce_commands: if True, commands for a zone are sent one at a time,
+        in order. While a command for a zone is in flight, a new level or fan speed
+        command replaces a level or fan speed command that is still waiting to be
+        sent. Callers whose command was skipped get the result of the command that
+        replaced it. Cover commands are never replaced.
+        :param topology_cache: if given, the topology is saved here after it is read
+        from the bridge. On the first connect, a cached topology is loaded and
+        `connect` returns without waiting for the bridge, which is then read in the
+        background. Topology subscribers are told what changed.
+        :param ping_interval: how long the connection may be idle before the bridge is
+        pinged to check that it is still there. Pings are not sent while messages are
+        arriving from the bridge.
+        :param ping_timeout: how long to wait for a ping to be answered before the
+        connection is considered dead and is reopened
+        :param reconnect_policy: how long to wait between attempts to reconnect
+        :param metrics: if given, requests that time out are reported to it. Pass the
+        same sink to the LEAP connection to record the rest of the measurements;
+        `create_tls` does this.
+        :param tracer: if given, calls to device and occupancy subscribers are
+        reported to it. As with metrics, pass it to the LEAP connection as well to
+        trace every message; `create_tls` does this.
+        """
+        if max_concurrent_requests < 1:
+            raise ValueError("max_concurrent_requests must be at least 1")
+        if ping_interval <= 0 or ping_timeout <= 0:
+            raise ValueError("ping_interval and ping_timeout must be positive")
+
+        self.devices: Dict[str, Device] = {}
+        self.scenes: Dict[str, Scene] = {}
+        self.occupancy_groups: Dict[str, OccupancyGroup] = {}
+        self.areas: Dict[str, Area] = {}
+        self._device_by_zone: Dict[str, Device] = {}
+        self._devices_by_type: Dict[str, Tuple[Device, ...]] = {}
+        self._devices_by_domain: Dict[str, Tuple[Device, ...]] = {}
+        self._devices_by_types: Dict[FrozenSet[str], Tuple[Device, ...]] = {}
         self._connect = connect
+        self._topology_fingerprint: Optional[Any] = None
+        self._topology_cache = topology_cache
+        self._topology_subscribers: List[Callable[[TopologyChanges], None]] = []
+        self._max_concurrent_requests = max_concurrent_requests
+        self._command_coalescer: Optional[_Coalescer] = (
+            _Coalescer() if coalesce_commands else None
+        )
         self._subscribers: Dict[str, Callable[[], None]] = {}
+        # the subscriptions Smartbridge needs itself, kept apart from the ones added
+        # with add_leap_subscription so that they cannot be removed
+        self._internal_subscriptions: Dict[str, _LeapSubscription] = {
+            url: _LeapSubscription(url, callback)
+            for url, callback in (
+                (OCCUPANCY_GROUP_STATUS_URL, self._handle_occupancy_group_status),
+                (ZONE_STATUS_URL, self._handle_multi_zone_status),
+            )
+        }
+        self._leap_subscriptions: Dict[str, _LeapSubscription] = {}
+        # whether every subscription has been made on the current connection
+        self._subscriptions_replayed = False
         self._occupancy_subscribers: Dict[str, Callable[[], None]] = {}
+        self._unsolicited_subscribers: List[_UnsolicitedSubscriber] = [
+            _UnsolicitedSubscriber(
+                self._handle_unsolicited_zone_status, "ReadResponse", "OneZoneStatus"
+            )
+        ]
         self._login_task: Optional[asyncio.Task] = None
         # Use future so we can wait before the login starts and
         # don't need to wait for "login" on reconnect.
@@ -58,6 +254,21 @@ class Smartbridge:
         self._leap: Optional[LeapProtocol] = None
         self._monitor_task: Optional[asyncio.Task] = None
         self._ping_task: Optional[asyncio.Task] = None
+        self._ping_interval = ping_interval
+        self._ping_timeout = ping_timeout
+        # set when a request times out, to check the connection without waiting
+        self._ping_now = asyncio.Event()
+        self._reconnect_policy = reconnect_policy
+        self._metrics = metrics
+        self._tracer = tracer
+        self._reconnect_attempt = 0
+        self._connection_state = ConnectionState.DISCONNECTED
+        self._connection_history: Deque[ConnectionStateChange] = deque(
+            maxlen=_CONNECTION_HISTORY_SIZE
+        )
+        self._connection_state_subscribers: List[
+            Callable[[ConnectionStateChange], None]
+        ] = []
 
     @property
     def logged_in(self):
@@ -75,6 +286,7 @@ class Smartbridge:
     async def connect(self):
         """Connect to the bridge."""
         # reset any existing connection state
+        self._reconnect_attempt = 0
         if self._login_task is not None:
             self._login_task.cancel()
             self._login_task = None
@@ -95,18 +307,69 @@ class Smartbridge:
             self._login_completed.cancel()
             self._login_completed = asyncio.get_running_loop().create_future()
 
+        # the monitor compares the cached fingerprint to the bridge's, so the cache
+        # must be loaded before it starts
+        cached = await self._load_cached_topology()
+
         self._monitor_task = get_loop().create_task(self._monitor())
 
+        if cached:
+            _LOG.debug("Using cached topology, logging in in the background")
+            return
+
         await self._login_completed
 
+    @property
+    def connection_state(self) -> ConnectionState:
+        """Get the current state of the connection to the bridge."""
+        return self._connection_state
+
+    @property
+    def connection_history(self) -> Sequence[ConnectionStateChange]:
+        """Get the most recent changes in the connection state, oldest first."""
+        return tuple(self._connection_history)
+
+    def add_connection_state_subscriber(
+        self, callback_: Callable[[ConnectionStateChange], None]
+    ):
+        """
+        Add a listener to be notified when the connection state changes.
+
+        :param callback_: callback to invoke with each change
+        """
+        self._connection_state_subscribers.append(callback_)
+
+    def _set_connection_state(
+        self, state: ConnectionState, delay: Optional[float] = None
+    ):
+        change = ConnectionStateChange(
+            state, time.time(), self._reconnect_attempt, delay
+        )
+        self._connection_state = state
+        self._connection_history.append(change)
+        for callback in self._connection_state_subscribers:
+            try:
+                callback(change)
+            except Exception:  # pylint: disable=broad-except
+                _LOG.exception("Got exception from connection state subscriber")
+
     @classmethod
-    def create_tls(cls, hostname, keyfile, certfile, ca_certs, port=LEAP_PORT):
-        """Initialize the Smart Bridge using TLS over IPv4."""
+    def create_tls(
+        cls, hostname, keyfile, certfile, ca_certs, port=LEAP_PORT, **kwargs
+    ):
+        """
+        Initialize the Smart Bridge using TLS over IPv4.
+
+        Additional keyword arguments are passed to the Smartbridge constructor.
+        """
         ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
         ssl_context.load_verify_locations(ca_certs)
         ssl_context.load_cert_chain(certfile, keyfile)
         ssl_context.verify_mode = ssl.CERT_REQUIRED
 
+        metrics = kwargs.get("metrics", None)
+        tracer = kwargs.get("tracer", None)
+
         async def _connect():
             res = await open_connection(
                 hostname,
@@ -114,10 +377,12 @@ class Smartbridge:
                 server_hostname="",
                 ssl=ssl_context,
                 family=socket.AF_INET,
+                metrics=metrics,
+                tracer=tracer,
             )
             return res
 
-        return cls(_connect)
+        return cls(_connect, **kwargs)
 
     def add_subscriber(self, device_id: str, callback_: Callable[[], None]):
         """
@@ -139,34 +404,138 @@ class Smartbridge:
         """
         self._occupancy_subscribers[occupancy_group_id] = callback_
 
-    def get_devices(self) -> Dict[str, dict]:
+    async def add_leap_subscription(
+        self,
+        url: str,
+        callback_: Callable[[Response], None],
+        body: Optional[dict] = None,
+    ) -> Optional[Response]:
+        """
+        Subscribe to a LEAP resource, and again every time the bridge reconnects.
+
+        The callback is called with the response to each subscription and with every
+        event the bridge sends for it. When a reconnect gives the same response as
+        the previous connection and no events arrived in between, the callback is
+        not called again.
+
+        :param url: the resource to subscribe to, e.g. /zone/1/status
+        :param callback_: callback to invoke with each response
+        :param body: body of the SubscribeRequest, if any
+        :returns the response to the subscription, or None if the bridge is not
+        connected yet. In that case, the subscription is made when it connects.
+        :raises ValueError: if there is already a subscription to url
+        """
+        if url in self._leap_subscriptions or url in self._internal_subscriptions:
+            raise ValueError(f"already subscribed to {url}")
+
+        subscription = _LeapSubscription(url, callback_, body)
+        self._leap_subscriptions[url] = subscription
+        if not self._subscriptions_replayed:
+            # the login replays every subscription, including this one
+            return None
+
+        try:
+            return await self._open_subscription(subscription, PRIORITY_INTERACTIVE)
+        except BridgeResponseError:
+            del self._leap_subscriptions[url]
+            raise
+
+    async def remove_leap_subscription(self, url: str):
+        """
+        Stop a subscription made with `add_leap_subscription`.
+
+        If the bridge rejects the request or does not answer, the subscription is
+        kept and the error is raised.
+
+        :param url: the resource that was subscribed to
+        :raises KeyError: if url was not subscribed to with `add_leap_subscription`
+        """
+        subscription = self._leap_subscriptions[url]
+        leap = self._leap
+        tag = subscription.tag
+        if leap is not None and tag is not None and leap.is_subscribed(tag):
+            await asyncio.wait_for(leap.unsubscribe(tag), timeout=REQUEST_TIMEOUT)
+        if self._leap_subscriptions.get(url, None) is subscription:
+            del self._leap_subscriptions[url]
+
+    def add_unsolicited_subscriber(
+        self,
+        callback_: Callable[[Response], None],
+        *,
+        communique_type: Optional[str] = None,
+        body_type: Optional[str] = None,
+        url: Optional[str] = None,
+    ):
+        """
+        Add a listener for messages the bridge sends without being asked.
+
+        The listener is kept across reconnects. Any of communique_type, body_type and
+        url that are None match every message.
+
+        :param callback_: callback to invoke with each matching message
+        :param communique_type: the CommuniqueType to match, e.g. ReadResponse
+        :param body_type: the MessageBodyType to match, e.g. OneZoneStatus
+        :param url: the URL to match. A * in place of the id matches any id, e.g.
+        /zone/*/status
+        """
+        if not callable(callback_):
+            raise TypeError("callback must be callable")
+        subscriber = _UnsolicitedSubscriber(callback_, communique_type, body_type, url)
+        self._unsolicited_subscribers.append(subscriber)
+        if self._leap is not None:
+            _subscribe_unsolicited(self._leap, subscriber)
+
+    def remove_unsolicited_subscriber(self, callback_: Callable[[Response], None]):
+        """
+        Remove a listener added with `add_unsolicited_subscriber`.
+
+        :raises ValueError: if the callback was never added
+        """
+        subscribers = [
+            subscriber
+            for subscriber in self._unsolicited_subscribers
+            if subscriber.callback != callback_
+        ]
+        if len(subscribers) == len(self._unsolicited_subscribers):
+            raise ValueError("callback is not subscribed")
+        self._unsolicited_subscribers = subscribers
+        if self._leap is not None:
+            self._leap.unsubscribe_unsolicited(callback_)
+
+    def add_topology_subscriber(self, callback_: Callable[[TopologyChanges], None]):
+        """
+        Add a listener to be notified of changes to the devices or scenes.
+
+        The callback is invoked when reloading the topology from the bridge adds,
+        removes or changes a device or scene, such as after starting from a cache.
+
+        :param callback_: callback to invoke with the changes
+        """
+        self._topology_subscribers.append(callback_)
+
+    def get_devices(self) -> Dict[str, Device]:
         """Will return all known devices connected to the Smart Bridge."""
         return self.devices
 
-    def get_devices_by_domain(self, domain: str) -> List[dict]:
+    def get_devices_by_domain(self, domain: str) -> Sequence[Device]:
         """
-        Return a list of devices for the given domain.
+        Return the devices for the given domain.
 
         :param domain: one of 'light', 'switch', 'cover', 'fan' or 'sensor'
-        :returns list of zero or more of the devices
+        :returns read-only sequence of zero or more of the devices
         """
-        types = _LEAP_DEVICE_TYPES.get(domain, None)
+        return self._devices_by_domain.get(domain, ())
 
-        # return immediately if not a supported domain
-        if types is None:
-            return []
-
-        return self.get_devices_by_types(types)
-
-    def get_devices_by_type(self, type_: str) -> List[dict]:
+    def get_devices_by_type(self, type_: str) -> Sequence[Device]:
         """
         Will return all devices of a given device type.
 
         :param type_: LEAP device type, e.g. WallSwitch
+        :returns read-only sequence of zero or more of the devices
         """
-        return [device for device in self.devices.values() if device["type"] == type_]
+        return self._devices_by_type.get(type_, ())
 
-    def get_device_by_zone_id(self, zone_id: str) -> dict:
+    def get_device_by_zone_id(self, zone_id: str) -> Device:
         """
         Return the first device associated with a given zone.
 
@@ -175,20 +544,28 @@ class Smartbridge:
         :param zone_id: the zone id to search for
         :raises KeyError: if the zone id is not present
         """
-        for device in self.devices.values():
-            if zone_id == device.get("zone"):
-                return device
-        raise KeyError(f"No device associated with zone {zone_id}")
+        device = self._device_by_zone.get(zone_id)
+        if device is None:
+            raise KeyError(f"No device associated with zone {zone_id}")
+        return device
 
-    def get_devices_by_types(self, types: List[str]) -> List[dict]:
+    def get_devices_by_types(self, types: Iterable[str]) -> Sequence[Device]:
         """
         Will return all devices for a list of given device types.
 
         :param types: list of LEAP device types such as WallSwitch, WallDimmer
+        :returns read-only sequence of zero or more of the devices
         """
-        return [device for device in self.devices.values() if device["type"] in types]
+        key = frozenset(types)
+        devices = self._devices_by_types.get(key)
+        if devices is None:
+            devices = tuple(
+                device for device in self.devices.values() if device.type in key
+            )
+            self._devices_by_types[key] = devices
+        return devices
 
-    def get_device_by_id(self, device_id: str) -> dict:
+    def get_device_by_id(self, device_id: str) -> Device:
         """
         Will return a device with the given ID.
 
@@ -196,11 +573,11 @@ class Smartbridge:
         """
         return self.devices[device_id]
 
-    def get_scenes(self) -> Dict[str, dict]:
+    def get_scenes(self) -> Dict[str, Scene]:
         """Will return all known scenes from the Smart Bridge."""
         return self.scenes
 
-    def get_scene_by_id(self, scene_id: str) -> dict:
+    def get_scene_by_id(self, scene_id: str) -> Scene:
         """
         Will return a scene with the given scene ID.
 
@@ -219,21 +596,31 @@ class Smartbridge:
         :param device_id: device id, e.g. 5
         :returns True if level is greater than 0 level, False otherwise
         """
-        return (
-            self.devices[device_id]["current_state"] > 0
-            or (self.devices[device_id]["fan_speed"] or FAN_OFF) != FAN_OFF
-        )
+        device = self.devices[device_id]
+        return device.current_state > 0 or (device.fan_speed or FAN_OFF) != FAN_OFF
 
     async def _request(
-        self, communique_type: str, url: str, body: Optional[dict] = None
+        self,
+        communique_type: str,
+        url: str,
+        body: Optional[dict] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        timeout: float = REQUEST_TIMEOUT,
     ) -> Response:
         if self._leap is None:
             raise BridgeDisconnectedError()
 
-        response = await asyncio.wait_for(
-            self._leap.request(communique_type, url, body),
-            timeout=REQUEST_TIMEOUT,
-        )
+        try:
+            response = await asyncio.wait_for(
+                self._leap.request(communique_type, url, body, priority=priority),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            if self._metrics is not None:
+                self._metrics.request_timed_out(communique_type, url_template(url))
+            # the connection may be dead, so check now rather than at the next ping
+            self._ping_now.set()
+            raise
 
         status = response.Header.StatusCode
         if status is None or not status.is_successful():
@@ -247,16 +634,26 @@ class Smartbridge:
         callback: Callable[[Response], None],
         communique_type: str = "SubscribeRequest",
         body: Optional[dict] = None,
+        priority: int = PRIORITY_INTERACTIVE,
     ) -> Tuple[Response, str]:
         if self._leap is None:
             raise BridgeDisconnectedError()
 
-        response, tag = await asyncio.wait_for(
-            self._leap.subscribe(
-                url, callback, communique_type=communique_type, body=body
-            ),
-            timeout=REQUEST_TIMEOUT,
-        )
+        try:
+            response, tag = await asyncio.wait_for(
+                self._leap.subscribe(
+                    url,
+                    callback,
+                    communique_type=communique_type,
+                    body=body,
+                    priority=priority,
+                ),
+                timeout=REQUEST_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            if self._metrics is not None:
+                self._metrics.request_timed_out(communique_type, url_template(url))
+            raise
 
         status = response.Header.StatusCode
         if status is None or not status.is_successful():
@@ -277,66 +674,77 @@ class Smartbridge:
         """
         device = self.devices[device_id]
 
-        zone_id = device.get("zone")
+        zone_id = device.zone
         if not zone_id:
             return
 
-        if device.get("type") in _LEAP_DEVICE_TYPES["light"] and fade_time is not None:
-            await self._request(
-                "CreateRequest",
-                f"/zone/{zone_id}/commandprocessor",
-                {
-                    "Command": {
-                        "CommandType": "GoToDimmedLevel",
-                        "DimmedLevelParameters": {
-                            "Level": value,
-                            "FadeTime": _format_duration(fade_time),
-                        },
-                    }
+        command: Dict[str, Any]
+        if _LEAP_DEVICE_DOMAINS.get(device.type) == "light" and fade_time is not None:
+            command = {
+                "CommandType": "GoToDimmedLevel",
+                "DimmedLevelParameters": {
+                    "Level": value,
+                    "FadeTime": _format_duration(fade_time),
                 },
-            )
+            }
         else:
-            await self._request(
+            command = {
+                "CommandType": "GoToLevel",
+                "Parameter": [{"Type": "Level", "Value": value}],
+            }
+
+        await self._send_zone_command(zone_id, command, coalesce=True)
+
+    async def _send_zone_command(
+        self, zone_id: str, command: dict, coalesce: bool = False
+    ) -> Response:
+        """
+        Send a command to a zone.
+
+        When command coalescing is enabled, every command for a zone waits for the
+        commands made before it for that zone.
+
+        :param coalesce: whether the command may be replaced by a newer command for
+        the same zone when command coalescing is enabled
+        """
+
+        async def _send() -> Response:
+            return await self._request(
                 "CreateRequest",
                 f"/zone/{zone_id}/commandprocessor",
-                {
-                    "Command": {
-                        "CommandType": "GoToLevel",
-                        "Parameter": [{"Type": "Level", "Value": value}],
-                    }
-                },
+                {"Command": command},
             )
 
+        if self._command_coalescer is not None:
+            return await self._command_coalescer.run(zone_id, _send, coalesce)
+        return await _send()
+
     async def _send_zone_create_request(self, device_id: str, command: str):
         zone_id = self._get_zone_id(device_id)
         if not zone_id:
             return
 
-        await self._request(
-            "CreateRequest",
-            f"/zone/{zone_id}/commandprocessor",
-            {"Command": {"CommandType": command}},
-        )
+        await self._send_zone_command(zone_id, {"CommandType": command})
 
     async def stop_cover(self, device_id: str):
         """Will stop a cover."""
-        await self._send_zone_create_request(device_id, "Stop")
+        await self._send_zone_create_request(device_id, COVER_STOP)
 
     async def raise_cover(self, device_id: str):
         """Will raise a cover."""
-        await self._send_zone_create_request(device_id, "Raise")
+        await self._send_zone_create_request(device_id, COVER_RAISE)
         # If set_value is called, we get an optimistic callback right
         # away with the value, if we use Raise we have to set it
         # as one won't come unless Stop is called or something goes wrong.
-        self.devices[device_id]["current_state"] = 100
+        self.devices[device_id].current_state = 100
 
     async def lower_cover(self, device_id: str):
         """Will lower a cover."""
-        await self._send_zone_create_request(device_id, "Lower")
+        await self._send_zone_create_request(device_id, COVER_LOWER)
         # If set_value is called, we get an optimistic callback right
         # away with the value, if we use Lower we have to set it
         # as one won't come unless Stop is called or something goes wrong.
-        self.devices[device_id]["current_state"] = 0
+        self.devices[device_id].current_state = 0
 
     async def set_fan(self, device_id: str, value: str):
         """
@@ -348,15 +756,13 @@ class Smartbridge:
         """
         zone_id = self._get_zone_id(device_id)
         if zone_id:
-            await self._request(
-                "CreateRequest",
-                f"/zone/{zone_id}/commandprocessor",
+            await self._send_zone_command(
+                zone_id,
                 {
-                    "Command": {
-                        "CommandType": "GoToFanSpeed",
-                        "FanSpeedParameters": {"FanSpeed": value},
-                    }
+                    "CommandType": "GoToFanSpeed",
+                    "FanSpeedParameters": {"FanSpeed": value},
                 },
+                coalesce=True,
             )
 
     async def turn_on(self, device_id: str, **kwargs):
@@ -377,6 +783,73 @@ class Smartbridge:
         """
         await self.set_value(device_id, 0, **kwargs)
 
+    async def execute_batch(
+        self,
+        commands: Iterable[BatchCommand],
+        max_concurrent_requests: Optional[int] = None,
+    ) -> List[Optional[Exception]]:
+        """
+        Send commands to many devices at once.
+
+        The commands are pipelined over the connection to the bridge instead of
+        waiting for each one to finish before sending the next, so a batch takes about
+        as long as a single command. A command that fails does not stop the others.
+
+        :param commands: the commands to send. Each command is a BatchCommand (or a
+        tuple of device id, value and optional fade time). An int value sets the level
+        of a device, COVER_RAISE, COVER_LOWER or COVER_STOP move a cover, and any
+        other str value sets the speed of a fan.
+        :param max_concurrent_requests: how many commands may be in flight at once,
+        defaulting to the value given when creating the Smartbridge
+        :returns one entry per command: None if the command succeeded, or the
+        exception it raised
+        :raises ValueError: if max_concurrent_requests is less than 1
+        :raises TypeError: if a value is not an int or a str. Nothing is sent.
+        """
+        if max_concurrent_requests is None:
+            max_concurrent_requests = self._max_concurrent_requests
+        elif max_concurrent_requests < 1:
+            raise ValueError("max_concurrent_requests must be at least 1")
+
+        batch = [BatchCommand(*command) for command in commands]
+        for command in batch:
+            if isinstance(command.value, bool) or not isinstance(
+                command.value, (int, str)
+            ):
+                raise TypeError(
+                    f"cannot send {command.value!r} to device {command.device_id}"
+                )
+
+        results = await _gather_limited(
+            max_concurrent_requests,
+            [partial(self._execute, command) for command in batch],
+        )
+
+        errors: List[Optional[Exception]] = []
+        for result in results:
+            if isinstance(result, Exception):
+                errors.append(result)
+            elif isinstance(result, BaseException):
+                # don't swallow cancellation
+                raise result
+            else:
+                errors.append(None)
+        return errors
+
+    async def _execute(self, command: BatchCommand):
+        """Send a single command from a batch."""
+        device_id, value, fade_time = command
+        if isinstance(value, int):
+            await self.set_value(device_id, value, fade_time=fade_time)
+        elif value == COVER_RAISE:
+            await self.raise_cover(device_id)
+        elif value == COVER_LOWER:
+            await self.lower_cover(device_id)
+        elif value == COVER_STOP:
+            await self.stop_cover(device_id)
+        else:
+            await self.set_fan(device_id, value)
+
     async def activate_scene(self, scene_id: str):
         """
         Will activate the scene with the given ID.
@@ -396,7 +869,7 @@ class Smartbridge:
 
         :param device_id: device id for which to retrieve a zone id
         """
-        return self.devices[device_id].get("zone")
+        return self.devices[device_id].zone
 
     async def _monitor(self):
         """Event monitoring loop."""
@@ -414,11 +887,13 @@ class Smartbridge:
             self._login_completed.cancel()
 
     async def _monitor_once(self):
-        """Monitor for events until an error occurs."""
+        """Monitor for events until an error occurs, then wait to reconnect."""
         try:
             _LOG.debug("Connecting to Smart Bridge via SSL")
+            self._set_connection_state(ConnectionState.CONNECTING)
             self._leap = await self._connect()
-            self._leap.subscribe_unsolicited(self._handle_unsolicited)
+            for subscriber in self._unsolicited_subscribers:
+                _subscribe_unsolicited(self._leap, subscriber)
             _LOG.debug("Successfully connected to Smart Bridge.")
 
             if self._login_task is not None:
@@ -427,12 +902,14 @@ class Smartbridge:
             if self._ping_task is not None:
                 self._ping_task.cancel()
 
+            self._ping_now.clear()
+            self._subscriptions_replayed = False
+            self._set_connection_state(ConnectionState.LOGGING_IN)
             self._login_task = asyncio.get_running_loop().create_task(self._login())
             self._ping_task = asyncio.get_running_loop().create_task(self._ping())
 
             await self._leap.run()
             _LOG.warning("LEAP session ended. Reconnecting...")
-            await asyncio.sleep(RECONNECT_DELAY)
         # ignore OSError too.
         # sometimes you get OSError instead of ConnectionError.
         except (
@@ -443,8 +920,8 @@ class Smartbridge:
             BridgeDisconnectedError,
         ):
             _LOG.warning("Reconnecting...", exc_info=1)
-            await asyncio.sleep(RECONNECT_DELAY)
         finally:
+            self._subscriptions_replayed = False
             if self._login_task is not None:
                 self._login_task.cancel()
                 self._login_task = None
@@ -457,24 +934,58 @@ class Smartbridge:
                 self._leap.close()
                 self._leap = None
 
+        delay = self._reconnect_policy.delay(self._reconnect_attempt)
+        _LOG.debug(
+            "Reconnecting in %.1fs after %d failures", delay, self._reconnect_attempt
+        )
+        self._set_connection_state(ConnectionState.BACKING_OFF, delay)
+        self._reconnect_attempt += 1
+        await asyncio.sleep(delay)
+
     def _handle_one_zone_status(self, response: Response):
         body = response.Body
         if body is None:
             return
 
-        status = body["ZoneStatus"]
+        self._apply_zone_status(self.get_device_by_zone_id, body["ZoneStatus"])
+
+    def _handle_multi_zone_status(self, response: Response):
+        """Handle a message from the /zone/status subscription."""
+        body = response.Body
+        if body is None:
+            return
+
+        if response.Header.MessageBodyType == "OneZoneStatus":
+            statuses = [body["ZoneStatus"]]
+        else:
+            statuses = body.get("ZoneStatuses", [])
+
+        # the bridge reports every zone, including ones without a known device
+        get_device = self._device_by_zone.get
+        for status in statuses:
+            self._apply_zone_status(get_device, status)
+
+    def _apply_zone_status(
+        self, get_device: Callable[[str], Optional[Device]], status: dict
+    ):
+        """Update the device for a single zone status and notify its subscriber."""
         zone = id_from_href(status["Zone"]["href"])
         level = status.get("Level", -1)
         fan_speed = status.get("FanSpeed", None)
-        _LOG.debug("zone=%s level=%s", zone, level)
-        device = self.get_device_by_zone_id(zone)
-        device["current_state"] = level
-        device["fan_speed"] = fan_speed
-        if device["device_id"] in self._subscribers:
-            self._subscribers[device["device_id"]]()
+        if _LOG.isEnabledFor(logging.DEBUG):
+            _LOG.debug("zone=%s level=%s", zone, level)
+        device = get_device(zone)
+        if device is None:
+            return
+        device.current_state = level
+        device.fan_speed = fan_speed
+        callback = self._subscribers.get(device.device_id, None)
+        if callback is not None:
+            self._notify(callback, "device:", device.device_id)
 
     def _handle_occupancy_group_status(self, response: Response):
-        _LOG.debug("Handling occupancy group status: %s", response)
+        if _LOG.isEnabledFor(logging.DEBUG):
+            _LOG.debug("Handling occupancy group status: %s", response)
 
         if response.Body is None:
             return
@@ -493,49 +1004,229 @@ class Smartbridge:
                 _LOG.warning(
                     "Occupancy group %s has sensors but no status", occgroup_id
                 )
-            self.occupancy_groups[occgroup_id]["status"] = ostat
+            self.occupancy_groups[occgroup_id].status = ostat
             # Notify any subscribers of the change to occupancy status
-            if occgroup_id in self._occupancy_subscribers:
-                self._occupancy_subscribers[occgroup_id]()
+            callback = self._occupancy_subscribers.get(occgroup_id, None)
+            if callback is not None:
+                self._notify(callback, "occupancy_group:", occgroup_id)
+
+    def _notify(self, callback: Callable[[], None], kind: str, id_: str):
+        """Call a subscriber, tracing the call if there is a tracer."""
+        if self._tracer is None:
+            callback()
+        else:
+            self._tracer.call(None, kind + id_, callback)
 
-    def _handle_unsolicited(self, response: Response):
-        if (
-            response.CommuniqueType == "ReadResponse"
-            and response.Header.MessageBodyType == "OneZoneStatus"
-        ):
-            self._handle_one_zone_status(response)
+    def _handle_unsolicited_zone_status(self, response: Response):
+        subscription = self._internal_subscriptions.get(ZONE_STATUS_URL)
+        if subscription is not None:
+            subscription.snapshot = None
+        self._handle_one_zone_status(response)
 
     async def _login(self):
         """Connect and login to the Smart Bridge LEAP server using SSL."""
         try:
-            await self._load_devices()
-            await self._load_scenes()
-            await self._load_areas()
-            await self._load_occupancy_groups()
-            await self._subscribe_to_occupancy_groups()
-
-            for device in self.devices.values():
-                if device.get("zone") is not None:
-                    _LOG.debug("Requesting zone information from %s", device)
-                    response = await self._request(
-                        "ReadRequest", f"/zone/{device['zone']}/status"
+            await self._load_topology()
+
+            errors = await self._replay_subscriptions()
+            zone_status_error = errors.pop(ZONE_STATUS_URL, None)
+            for url, error in errors.items():
+                _LOG.error("Failed to subscribe to %s: %s", url, error.response)
+            if zone_status_error is not None:
+                _LOG.debug(
+                    "Bridge does not support zone status subscription: %s",
+                    zone_status_error,
+                )
+                zone_errors = await self._load_zone_statuses()
+                if zone_errors:
+                    _LOG.warning(
+                        "Could not read the status of %d of %d zones: %s",
+                        len(zone_errors),
+                        len(self._device_by_zone),
+                        ", ".join(sorted(zone_errors)),
                     )
-                    self._handle_one_zone_status(response)
 
+            self._reconnect_attempt = 0
+            self._set_connection_state(ConnectionState.READY)
             if not self._login_completed.done():
                 self._login_completed.set_result(None)
         except asyncio.CancelledError:
             pass
         except Exception as ex:
-            self._login_completed.set_exception(ex)
+            if not self._login_completed.done():
+                self._login_completed.set_exception(ex)
             raise
 
+    async def _load_topology(self):
+        """
+        Load the devices, scenes, areas and occupancy groups.
+
+        If the project on the bridge has not been modified since they were last
+        loaded, they are not read again.
+        """
+        fingerprint = await self._read_topology_fingerprint()
+        if fingerprint is not None and fingerprint == self._topology_fingerprint:
+            _LOG.debug("Project has not been modified, reusing the loaded topology")
+            return
+
+        bodies = {}
+        for url in (DEVICE_URL, SCENE_URL, AREA_URL, OCCUPANCY_GROUP_URL):
+            _LOG.debug("Loading %s", url)
+            response = await self._request("ReadRequest", url, priority=PRIORITY_BULK)
+            bodies[url] = response.Body
+        self._apply_topology(bodies)
+        self._topology_fingerprint = fingerprint
+        # devices and occupancy groups that were added need their status, even if
+        # the status subscriptions answer the same as last time
+        for subscription in self._internal_subscriptions.values():
+            subscription.snapshot = None
+
+        if self._topology_cache is not None and fingerprint is not None:
+            await self._topology_cache.save(CachedTopology(fingerprint, bodies))
+
+    async def _load_cached_topology(self) -> bool:
+        """
+        Load the topology from the cache, if nothing has been loaded yet.
+
+        :returns True if a cached topology was loaded
+        """
+        if self._topology_cache is None or self._topology_fingerprint is not None:
+            return False
+
+        cached = await self._topology_cache.load()
+        if cached is None:
+            return False
+
+        try:
+            self._apply_topology(cached.bodies)
+        except (KeyError, TypeError, ValueError) as ex:
+            _LOG.warning("Ignoring unusable topology cache: %s", ex)
+            return False
+        self._topology_fingerprint = cached.fingerprint
+        return True
+
+    def _apply_topology(self, bodies: Dict[str, Any]):
+        """Update the devices, scenes, areas and occupancy groups from LEAP bodies."""
+        had_topology = bool(self.devices or self.scenes)
+        devices_before = {
+            device_id: _device_definition(device)
+            for device_id, device in self.devices.items()
+        }
+        scenes_before = {
+            scene_id: scene.name for scene_id, scene in self.scenes.items()
+        }
+
+        self._apply_devices(bodies[DEVICE_URL])
+        self._apply_scenes(bodies[SCENE_URL])
+        self._apply_areas(bodies[AREA_URL])
+        self._apply_occupancy_groups(bodies[OCCUPANCY_GROUP_URL])
+
+        if not had_topology:
+            return
+
+        devices_after = {
+            device_id: _device_definition(device)
+            for device_id, device in self.devices.items()
+        }
+        scenes_after = {scene_id: scene.name for scene_id, scene in self.scenes.items()}
+        changes = TopologyChanges(
+            *_diff(devices_before, devices_after), *_diff(scenes_before, scenes_after)
+        )
+        if not any(changes):
+            return
+
+        _LOG.info("The topology of the bridge has changed: %s", changes)
+        for callback in self._topology_subscribers:
+            try:
+                callback(changes)
+            except Exception:  # pylint: disable=broad-except
+                _LOG.exception("Got exception from topology subscriber")
+
+    async def _read_topology_fingerprint(self) -> Optional[Any]:
+        """
+        Read a value that changes whenever the topology on the bridge changes.
+
+        :returns the time the project was last modified, or None if the bridge does
+        not report it
+        """
+        try:
+            response = await self._request(
+                "ReadRequest", "/project", priority=PRIORITY_BULK
+            )
+        except BridgeResponseError as ex:
+            _LOG.debug("Could not read project: %s", ex)
+            return None
+        return (response.Body or {}).get("Project", {}).get("ProjectModifiedTimestamp")
+
+    async def _load_zone_statuses(self) -> Dict[str, Exception]:
+        """
+        Read the current status of every zone.
+
+        The reads are pipelined over the LEAP connection, with at most
+        `max_concurrent_requests` in flight at a time. A zone that cannot be read
+        does not prevent the others from being loaded.
+
+        :returns the errors for zones that could not be read, keyed by zone id
+        """
+
+        async def _load_zone_status(zone_id: str):
+            _LOG.debug("Requesting zone information from %s", zone_id)
+            response = await self._request(
+                "ReadRequest", f"/zone/{zone_id}/status", priority=PRIORITY_BULK
+            )
+            self._handle_one_zone_status(response)
+
+        zone_ids = list(self._device_by_zone)
+        results = await _gather_limited(
+            self._max_concurrent_requests,
+            [partial(_load_zone_status, zone_id) for zone_id in zone_ids],
+        )
+
+        errors: Dict[str, Exception] = {}
+        for zone_id, result in zip(zone_ids, results):
+            if isinstance(result, BridgeDisconnectedError):
+                # the whole session is gone, so there is nothing to salvage
+                raise result
+            if isinstance(result, Exception):
+                _LOG.debug("Failed to read status of zone %s: %s", zone_id, result)
+                errors[zone_id] = result
+        return errors
+
     async def _ping(self):
-        """Periodically ping the LEAP server to keep the connection open."""
+        """
+        Ping the LEAP server to detect a dead connection.
+
+        A ping is sent once nothing has been received for the ping interval, or right
+        away after a request times out. A ping that is not answered in time closes the
+        connection, unless other messages arrived while waiting for it.
+        """
+        loop = asyncio.get_running_loop()
         try:
             while True:
-                await asyncio.sleep(PING_INTERVAL)
-                await self._request("ReadRequest", "/server/1/status/ping")
+                idle = loop.time() - self._leap.last_received
+                if idle < self._ping_interval and not self._ping_now.is_set():
+                    try:
+                        await asyncio.wait_for(
+                            self._ping_now.wait(), self._ping_interval - idle
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                self._ping_now.clear()
+                sent = loop.time()
+                try:
+                    await self._request(
+                        "ReadRequest",
+                        "/server/1/status/ping",
+                        priority=PRIORITY_PING,
+                        timeout=self._ping_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    if self._leap.last_received <= sent:
+                        raise
+                    # the bridge is busy, but the connection is alive
+                    self._ping_now.clear()
         except asyncio.TimeoutError:
             _LOG.warning("ping was not answered. closing connection.")
             self._leap.close()
@@ -546,71 +1237,121 @@ class Smartbridge:
             self._leap.close()
             raise
 
-    async def _load_devices(self):
-        """Load the device list from the SSL LEAP server interface."""
-        _LOG.debug("Loading devices")
-        device_json = await self._request("ReadRequest", "/device")
-        for device in device_json.Body["Devices"]:
+    def _apply_devices(self, body: dict):
+        """
+        Update the devices from the body of a /device response.
+
+        Devices that are not in the body are removed. Their subscribers are kept, and
+        are notified again if the device comes back.
+        """
+        device_ids = set()
+        for device in body["Devices"]:
             _LOG.debug(device)
             device_id = id_from_href(device["href"])
             device_zone = None
             if "LocalZones" in device:
                 device_zone = id_from_href(device["LocalZones"][0]["href"])
             device_name = "_".join(device["FullyQualifiedName"])
-            self.devices.setdefault(
-                device_id,
-                {"device_id": device_id, "current_state": -1, "fan_speed": None},
-            ).update(
+            self.devices.setdefault(device_id, Device(device_id)).update(
                 zone=device_zone,
                 name=device_name,
                 type=device["DeviceType"],
                 model=device["ModelNumber"],
                 serial=device["SerialNumber"],
             )
-
-    async def _load_scenes(self):
+            device_ids.add(device_id)
+
+        for device_id in set(self.devices) - device_ids:
+            _LOG.debug("Device %s was removed from the bridge", device_id)
+            del self.devices[device_id]
+        self._index_devices()
+
+    def _index_devices(self):
+        """Rebuild the lookup tables derived from the device list."""
+        device_by_zone: Dict[str, Device] = {}
+        devices_by_type: Dict[str, List[Device]] = {}
+        devices_by_domain: Dict[str, List[Device]] = {}
+        for device in self.devices.values():
+            zone_id = device.zone
+            if zone_id is not None:
+                device_by_zone.setdefault(zone_id, device)
+            devices_by_type.setdefault(device.type, []).append(device)
+            domain = _LEAP_DEVICE_DOMAINS.get(device.type)
+            if domain is not None:
+                devices_by_domain.setdefault(domain, []).append(device)
+
+        self._device_by_zone = device_by_zone
+        self._devices_by_type = {
+            type_: tuple(devices) for type_, devices in devices_by_type.items()
+        }
+        self._devices_by_domain = {
+            domain: tuple(devices) for domain, devices in devices_by_domain.items()
+        }
+        self._devices_by_types = {}
+
+    def _apply_scenes(self, body: dict):
         """
-        Load the scenes from the Smart Bridge.
+        Update the scenes from the body of a /virtualbutton response.
 
         Scenes are known as virtual buttons in the SSL LEAP interface.
         """
-        _LOG.debug("Loading scenes from the Smart Bridge")
-        scene_json = await self._request("ReadRequest", "/virtualbutton")
-        for scene in scene_json.Body["VirtualButtons"]:
+        scene_ids = set()
+        for scene in body["VirtualButtons"]:
             _LOG.debug(scene)
             # If 'Name' is not a key in scene, then it is likely a scene pico
             # vbutton. For now, simply ignore these scenes.
             if scene["IsProgrammed"] and "Name" in scene:
                 scene_id = id_from_href(scene["href"])
                 scene_name = scene["Name"]
-                self.scenes[scene_id] = {"scene_id": scene_id, "name": scene_name}
+                self.scenes[scene_id] = Scene(scene_id=scene_id, name=scene_name)
+                scene_ids.add(scene_id)
+
+        for scene_id in set(self.scenes) - scene_ids:
+            del self.scenes[scene_id]
 
-    async def _load_areas(self):
-        """Load the areas from the Smart Bridge."""
-        _LOG.debug("Loading areas from the Smart Bridge")
-        area_json = await self._request("ReadRequest", "/area")
-        for area in area_json.Body["Areas"]:
+    def _apply_areas(self, body: dict):
+        """Update the areas from the body of an /area response."""
+        area_ids = set()
+        for area in body["Areas"]:
             area_id = id_from_href(area["href"])
             # We currently only need the name, so just load that
-            self.areas.setdefault(area_id, dict(name=area["Name"]))
+            self.areas.setdefault(area_id, Area(name=area["Name"]))
+            area_ids.add(area_id)
+
+        for area_id in set(self.areas) - area_ids:
+            del self.areas[area_id]
+
+    def _apply_occupancy_groups(self, body: Optional[dict]):
+        """
+        Update the occupancy groups from the body of an /occupancygroup response.
 
-    async def _load_occupancy_groups(self):
-        """Load the occupancy groups from the Smart Bridge."""
-        _LOG.debug("Loading occupancy groups from the Smart Bridge")
-        occgroup_json = await self._request("ReadRequest", "/occupancygroup")
-        if occgroup_json.Body is None:
+        Occupancy groups that are not in the body, or no longer have sensors, are
+        removed. Their subscribers are kept, and are notified again if the group
+        comes back.
+        """
+        if body is None:
             return
 
-        occgroups = occgroup_json.Body.get("OccupancyGroups", {})
+        occgroup_ids = set()
+        occgroups = body.get("OccupancyGroups", {})
         for occgroup in occgroups:
-            self._process_occupancy_group(occgroup)
+            occgroup_id = self._process_occupancy_group(occgroup)
+            if occgroup_id is not None:
+                occgroup_ids.add(occgroup_id)
+
+        for occgroup_id in set(self.occupancy_groups) - occgroup_ids:
+            del self.occupancy_groups[occgroup_id]
+
+    def _process_occupancy_group(self, occgroup) -> Optional[str]:
+        """
+        Process occupancy group.
 
-    def _process_occupancy_group(self, occgroup):
-        """Process occupancy group."""
+        :returns the id of the occupancy group, or None if it was skipped
+        """
         occgroup_id = id_from_href(occgroup["href"])
         if not occgroup.get("AssociatedSensors"):
             _LOG.debug("No sensors associated with %s", occgroup["href"])
-            return
+            return None
         _LOG.debug("Found occupancy group with sensors: %s", occgroup_id)
         associated_areas = occgroup.get("AssociatedAreas", [])
         if not associated_areas:
@@ -619,7 +1360,7 @@ class Smartbridge:
                 "containing sensors: %s -- skipping",
                 occgroup_id,
             )
-            return
+            return None
         if len(associated_areas) > 1:
             _LOG.warning(
                 "Occupancy group %s associated with multiple "
@@ -633,29 +1374,67 @@ class Smartbridge:
                 occgroup_id,
                 occgroup_area_id,
             )
-            return
+            return None
         self.occupancy_groups.setdefault(
             occgroup_id,
-            dict(
+            OccupancyGroup(
                 occupancy_group_id=occgroup_id,
                 status=OCCUPANCY_GROUP_UNKNOWN,
             ),
-        ).update(
-            name=f"{self.areas[occgroup_area_id]['name']} Occupancy",
-        )
+        ).name = f"{self.areas[occgroup_area_id].name} Occupancy"
+        return occgroup_id
 
-    async def _subscribe_to_occupancy_groups(self):
-        """Subscribe to occupancy group status updates."""
-        _LOG.debug("Subscribing to occupancy group status updates")
-        try:
-            response, _ = await self._subscribe(
-                "/occupancygroup/status", self._handle_occupancy_group_status
+    async def _replay_subscriptions(self) -> Dict[str, BridgeResponseError]:
+        """
+        Make every internal and added subscription on the current connection.
+
+        The subscriptions are made concurrently. Subscriptions added while this runs
+        are made as well, and any added after it returns are made right away by
+        `add_leap_subscription`.
+
+        :returns the errors for subscriptions the bridge rejected, keyed by url
+        """
+        errors: Dict[str, BridgeResponseError] = {}
+        attempted: Set[_LeapSubscription] = set()
+        while True:
+            subscriptions = [
+                subscription
+                for registry in (self._internal_subscriptions, self._leap_subscriptions)
+                for subscription in registry.values()
+                if subscription not in attempted
+            ]
+            if not subscriptions:
+                self._subscriptions_replayed = True
+                return errors
+            attempted.update(subscriptions)
+
+            results = await _gather_limited(
+                self._max_concurrent_requests,
+                [
+                    partial(self._open_subscription, subscription, PRIORITY_BULK)
+                    for subscription in subscriptions
+                ],
             )
-            _LOG.debug("Subscribed to occupancygroup status")
-        except BridgeResponseError as ex:
-            _LOG.error("Failed occupancy subscription: %s", ex.response)
-            return
-        self._handle_occupancy_group_status(response)
+            for subscription, result in zip(subscriptions, results):
+                if isinstance(result, BridgeResponseError):
+                    errors[subscription.url] = result
+                elif isinstance(result, BaseException):
+                    raise result
+
+    async def _open_subscription(
+        self, subscription: _LeapSubscription, priority: int
+    ) -> Response:
+        """Subscribe on the current connection and deliver the initial response."""
+        _LOG.debug("Subscribing to %s", subscription.url)
+        response, subscription.tag = await self._subscribe(
+            subscription.url,
+            subscription.handle_event,
+            body=subscription.body,
+            priority=priority,
+        )
+        _LOG.debug("Subscribed to %s", subscription.url)
+        subscription.handle_snapshot(response)
+        return response
 
     async def close(self):
         """Disconnect from the bridge."""
@@ -664,6 +1443,43 @@ class Smartbridge:
             self._monitor_task.cancel()
         if self._ping_task is not None and not self._ping_task.cancelled():
             self._ping_task.cancel()
+        if self._connection_state is not ConnectionState.DISCONNECTED:
+            self._set_connection_state(ConnectionState.DISCONNECTED)
+
+
+def _device_definition(device: Device) -> Tuple[Any, ...]:
+    """Get the parts of a device that come from the topology rather than state."""
+    return (device.zone, device.name, device.type, device.model, device.serial)
+
+
+def _diff(
+    before: Dict[str, Any], after: Dict[str, Any]
+) -> Tuple[FrozenSet[str], FrozenSet[str], FrozenSet[str]]:
+    """Get the keys that were added, removed and changed between two dicts."""
+    added = frozenset(after.keys() - before.keys())
+    removed = frozenset(before.keys() - after.keys())
+    changed = frozenset(
+        key for key in before.keys() & after.keys() if before[key] != after[key]
+    )
+    return added, removed, changed
+
+
+class _UnsolicitedSubscriber(NamedTuple):
+    """A listener for unsolicited messages, and the messages it is interested in."""
+
+    callback: Callable[[Response], None]
+    communique_type: Optional[str] = None
+    body_type: Optional[str] = None
+    url: Optional[str] = None
+
+
+def _subscribe_unsolicited(leap: LeapProtocol, subscriber: _UnsolicitedSubscriber):
+    leap.subscribe_unsolicited(
+        subscriber.callback,
+        communique_type=subscriber.communique_type,
+        body_type=subscriber.body_type,
+        url=subscriber.url,
+    )
 
 
 def _format_duration(duration: timedelta) -> str:
@@ -0,0 +1,156 @@
+"""Hooks for tracing the messages exchanged with the bridge."""
+
+import json
+import time
+from typing import Any, Callable, Optional, TextIO, TypeVar
+
+T = TypeVar("T")
+
+
+class Tracer:
+    """
+    Receive an event for every message sent, received and handled.
+
+    Every hook does nothing, so subclasses only override the events they want. Pass a
+    tracer to `LeapProtocol` or `Smartbridge`; without one, no events are made. Hooks
+    are called synchronously from the message path, so they should be quick.
+    """
+
+    def on_send(self, tag: str, communique_type: str, url: str, size: int):
+        """
+        Record a request written to the bridge.
+
+        :param size: the size of the encoded request in bytes
+        """
+
+    def on_receive(
+        self,
+        tag: Optional[str],
+        communique_type: Optional[str],
+        url: Optional[str],
+        size: int,
+        parse_time: float,
+    ):
+        """
+        Record a message read from the bridge.
+
+        :param tag: the ClientTag of the message, which matches the tag of the request
+        or subscription it answers. None for unsolicited messages.
+        :param size: the size of the encoded message in bytes
+        :param parse_time: seconds spent decoding the message
+        """
+
+    def on_dispatch(
+        self, tag: Optional[str], url: Optional[str], target: str, count: int
+    ):
+        """
+        Record where a received message was sent.
+
+        :param target: "response" for the answer to a request, "subscription",
+        "unsolicited", or "unexpected" for a tag that is not known
+        :param count: the number of handlers the message was given to
+        """
+
+    def on_callback(
+        self,
+        tag: Optional[str],
+        target: str,
+        duration: float,
+        error: Optional[BaseException],
+    ):
+        """
+        Record a call to a handler or subscriber.
+
+        :param target: what was called, e.g. "unsolicited" or "device:2"
+        :param duration: seconds spent in the callback
+        :param error: the exception raised by the callback, if any
+        """
+
+    def call(
+        self, tag: Optional[str], target: str, callback: Callable[..., T], *args: Any
+    ) -> T:
+        """Call a callback, and record the call with `on_callback`."""
+        started = time.perf_counter()
+        error: Optional[BaseException] = None
+        try:
+            return callback(*args)
+        except BaseException as ex:
+            error = ex
+            raise
+        finally:
+            self.on_callback(tag, target, time.perf_counter() - started, error)
+
+
+class JsonlRecorder(Tracer):
+    """
+    Write every event as a line of JSON, for analysis after a session.
+
+    Each line has the event name as "ev" and the seconds since the recorder was
+    created as "t", along with the fields of the event that are not None, e.g.
+
+    {"t":0.0012,"ev":"send","tag":"0-1","type":"ReadRequest","url":"/device",...}
+    """
+
+    def __init__(self, file: TextIO, clock: Callable[[], float] = time.perf_counter):
+        """
+        Create a recorder.
+
+        :param file: a text file to write the events to. The recorder does not close
+        it.
+        :param clock: the source of event times
+        """
+        self._file = file
+        self._clock = clock
+        self._start = clock()
+
+    def on_send(self, tag: str, communique_type: str, url: str, size: int):
+        """Write a send event."""
+        self._write("send", tag=tag, type=communique_type, url=url, size=size)
+
+    def on_receive(
+        self,
+        tag: Optional[str],
+        communique_type: Optional[str],
+        url: Optional[str],
+        size: int,
+        parse_time: float,
+    ):
+        """Write a receive event."""
+        self._write(
+            "receive",
+            tag=tag,
+            type=communique_type,
+            url=url,
+            size=size,
+            parse=round(parse_time, 9),
+        )
+
+    def on_dispatch(
+        self, tag: Optional[str], url: Optional[str], target: str, count: int
+    ):
+        """Write a dispatch event."""
+        self._write("dispatch", tag=tag, url=url, target=target, count=count)
+
+    def on_callback(
+        self,
+        tag: Optional[str],
+        target: str,
+        duration: float,
+        error: Optional[BaseException],
+    ):
+        """Write a callback event."""
+        self._write(
+            "callback",
+            tag=tag,
+            target=target,
+            duration=round(duration, 9),
+            error=type(error).__name__ if error is not None else None,
+        )
+
+    def _write(self, event: str, **fields: Any):
+        record = {"t": round(self._clock() - self._start, 6), "ev": event}
+        record.update(
+            (key, value) for key, value in fields.items() if value is not None
+        )
+        self._file.write(json.dumps(record, separators=(",", ":")))
+        self._file.write("\n")
@@ -0,0 +1,66 @@
+"""Tests to validate the topology cache."""
+import asyncio
+import json
+
+import pytest
+
+from pylutron_caseta.cache import CachedTopology, TopologyCache
+
+TOPOLOGY = CachedTopology(
+    fingerprint={"Year": 2020, "Month": 4, "Day": 12},
+    bodies={"/device": {"Devices": []}, "/area": {"Areas": []}},
+)
+
+
+@pytest.mark.asyncio
+async def test_round_trip(tmp_path):
+    """Test that a saved topology is loaded again."""
+    cache = TopologyCache(str(tmp_path / "topology.json"), "bridge-1")
+    assert await cache.load() is None
+
+    await cache.save(TOPOLOGY)
+    assert await cache.load() == TOPOLOGY
+    assert list(tmp_path.iterdir()) == [tmp_path / "topology.json"]
+
+
+@pytest.mark.asyncio
+async def test_shared_file(tmp_path):
+    """Test that bridges sharing a file keep separate topologies."""
+    path = str(tmp_path / "topology.json")
+    first = TopologyCache(path, "bridge-1")
+    second = TopologyCache(path, "bridge-2")
+
+    await first.save(TOPOLOGY)
+    assert await second.load() is None
+
+    other = TOPOLOGY._replace(fingerprint=None)
+    await second.save(other)
+    assert await first.load() == TOPOLOGY
+    assert await second.load() == other
+
+
+@pytest.mark.asyncio
+async def test_shared_file_concurrent(tmp_path):
+    """Test that bridges saving to a shared file at once all keep their entries."""
+    path = str(tmp_path / "topology.json")
+    caches = [TopologyCache(path, f"bridge-{i}") for i in range(20)]
+
+    await asyncio.gather(*(cache.save(TOPOLOGY) for cache in caches))
+    for cache in caches:
+        assert await cache.load() == TOPOLOGY
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "contents",
+    ["not json", "[]", json.dumps({"bridge-1": {"version": 0, "bodies": {}}})],
+)
+async def test_unusable_file(tmp_path, contents: str):
+    """Test that a corrupt or outdated cache is ignored and then replaced."""
+    path = tmp_path / "topology.json"
+    path.write_text(contents)
+    cache = TopologyCache(str(path), "bridge-1")
+
+    assert await cache.load() is None
+    await cache.save(TOPOLOGY)
+    assert await cache.load() == TOPOLOGY
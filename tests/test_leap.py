@@ -1,13 +1,35 @@
 """Tests to validate low-level network interactions."""
+# pylint: disable=too-many-lines
 import asyncio
+from functools import partial
+import io
 import json
-from typing import AsyncGenerator, Iterable, NamedTuple, Tuple
+import os
+import ssl
+from typing import Any, AsyncGenerator, Dict, Iterable, List, NamedTuple, Tuple, cast
 
 import pytest
 
-from pylutron_caseta import BridgeDisconnectedError
-from pylutron_caseta.leap import LeapProtocol
+from pylutron_caseta import (
+    BridgeDisconnectedError,
+    BridgeResponseError,
+    MessageTooLargeError,
+)
+from pylutron_caseta.codec import STDLIB_CODEC, JsonCodec, available_codecs
+from pylutron_caseta.leap import (
+    _DEFAULT_LIMIT,
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_PING,
+    Href,
+    LeapProtocol,
+    MessageRouter,
+    id_from_href,
+    parse_href,
+)
 from pylutron_caseta.messages import Response, ResponseHeader, ResponseStatus
+from pylutron_caseta.metrics import HistogramMetrics
+from pylutron_caseta.tracing import JsonlRecorder
 
 
 class Pipe(NamedTuple):
@@ -26,6 +48,7 @@ class _PipeTransport(asyncio.Transport):
         self._extra = {}
         self.other = None
         self._protocol = None
+        self.buffer_size = 0
 
     def close(self):
         self._closing = True
@@ -47,7 +70,7 @@ class _PipeTransport(asyncio.Transport):
         return False
 
     def get_write_buffer_size(self) -> int:
-        return 0
+        return self.buffer_size
 
     def get_write_buffer_limits(self) -> Tuple[int, int]:  # pylint: disable=no-self-use
         """Return (0, 0)."""
@@ -73,11 +96,8 @@ class _PipeTransport(asyncio.Transport):
         return self._protocol
 
 
-@pytest.fixture(name="pipe")
-async def fixture_pipe(
-    event_loop: asyncio.AbstractEventLoop,
-) -> AsyncGenerator[Pipe, None]:
-    """Create linked readers and writers for tests."""
+def make_pipe(event_loop: asyncio.AbstractEventLoop, **kwargs) -> Pipe:
+    """Create a LeapProtocol with linked readers and writers for tests."""
     test_reader = asyncio.StreamReader()
     impl_reader = asyncio.StreamReader()
     test_protocol = asyncio.StreamReaderProtocol(test_reader)
@@ -97,12 +117,29 @@ async def fixture_pipe(
         impl_pipe, impl_protocol, impl_reader, event_loop
     )
 
-    leap = LeapProtocol(impl_reader, impl_writer)
+    leap = LeapProtocol(impl_reader, impl_writer, **kwargs)
     leap_task = asyncio.create_task(leap.run())
 
-    yield Pipe(leap, leap_task, test_reader, test_writer)
+    return Pipe(leap, leap_task, test_reader, test_writer)
 
-    leap_task.cancel()
+
+def pipe_transport(pipe: Pipe) -> _PipeTransport:
+    """Get the transport that a LeapProtocol made by make_pipe writes to."""
+    return cast(
+        _PipeTransport, pipe.leap._writer.transport  # pylint: disable=protected-access
+    )
+
+
+@pytest.fixture(name="pipe")
+async def fixture_pipe(
+    event_loop: asyncio.AbstractEventLoop,
+) -> AsyncGenerator[Pipe, None]:
+    """Create linked readers and writers for tests."""
+    pipe = make_pipe(event_loop)
+
+    yield pipe
+
+    pipe.leap_loop.cancel()
 
 
 @pytest.mark.asyncio
@@ -308,3 +345,818 @@ async def test_subscribe_tagged_404(pipe: Pipe):
 
     # The subscription should not be registered.
     assert {} == pipe.leap._tagged_subscriptions  # pylint: disable=protected-access
+
+
+@pytest.mark.asyncio
+async def test_read_framing(pipe: Pipe):
+    """Test messages split across writes, batched together, or larger than a read."""
+    received = []
+    all_received = asyncio.Event()
+
+    def handler(response):
+        received.append(response.Body["Index"])
+        if len(received) == 4:
+            all_received.set()
+
+    pipe.leap.subscribe_unsolicited(handler)
+
+    def message(index: int, padding: int = 0) -> bytes:
+        response_dict = {
+            "CommuniqueType": "ReadResponse",
+            "Header": {"StatusCode": "200 OK", "Url": "/test"},
+            "Body": {"Index": index, "Padding": "x" * padding},
+        }
+        return f"{json.dumps(response_dict)}\r\n".encode("utf-8")
+
+    # one message split across two writes
+    first = message(0)
+    pipe.test_writer.write(first[:10])
+    await asyncio.sleep(0)
+    pipe.test_writer.write(first[10:])
+
+    # two messages in a single write
+    pipe.test_writer.write(message(1) + message(2))
+
+    # a message larger than the default stream limit
+    pipe.test_writer.write(message(3, padding=_DEFAULT_LIMIT * 2))
+
+    await asyncio.wait_for(all_received.wait(), 1.0)
+    assert received == [0, 1, 2, 3]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("terminated", [True, False])
+async def test_read_message_too_large(
+    event_loop: asyncio.AbstractEventLoop, terminated: bool
+):
+    """Test that a message over max_message_size ends the session with an error."""
+    pipe = make_pipe(event_loop, max_message_size=100)
+    pipe.test_writer.write(b"x" * 101 + (b"\r\n" if terminated else b""))
+
+    with pytest.raises(MessageTooLargeError):
+        await asyncio.wait_for(pipe.leap_loop, 1.0)
+
+    pipe.leap.close()
+
+
+def test_max_message_size_invalid(event_loop: asyncio.AbstractEventLoop):
+    """Test that max_message_size must be positive."""
+    with pytest.raises(ValueError):
+        make_pipe(event_loop, max_message_size=0)
+
+
+@pytest.mark.parametrize("codec", available_codecs(), ids=lambda codec: codec.name)
+def test_codec_round_trip(codec: JsonCodec):
+    """Test that every available codec reads the recorded responses like json."""
+    responsedir = os.path.join(os.path.split(__file__)[0], "responses")
+    for filename in os.listdir(responsedir):
+        with open(os.path.join(responsedir, filename), "rb") as ifh:
+            data = ifh.read()
+
+        decoded = codec.loads(data)
+        assert decoded == json.loads(data)
+
+        encoded = codec.dumps(decoded)
+        assert isinstance(encoded, bytes)
+        assert json.loads(encoded) == decoded
+
+
+@pytest.mark.asyncio
+async def test_custom_codec(event_loop: asyncio.AbstractEventLoop):
+    """Test that LeapProtocol uses the codec it is given."""
+    encoded = []
+    decoded = []
+
+    def dumps(obj) -> bytes:
+        encoded.append(obj)
+        return STDLIB_CODEC.dumps(obj)
+
+    def loads(data: bytes):
+        decoded.append(data)
+        return STDLIB_CODEC.loads(data)
+
+    pipe = make_pipe(event_loop, codec=JsonCodec(name="test", dumps=dumps, loads=loads))
+    try:
+        task = asyncio.create_task(pipe.leap.request("ReadRequest", "/test"))
+        received = json.loads(await pipe.test_reader.readline())
+        tag = received["Header"]["ClientTag"]
+        assert encoded == [received]
+
+        response_bytes = json.dumps(
+            {
+                "CommuniqueType": "ReadResponse",
+                "Header": {"ClientTag": tag, "StatusCode": "200 OK", "Url": "/test"},
+            }
+        ).encode("utf-8")
+        pipe.test_writer.write(response_bytes + b"\r\n")
+
+        result = await task
+        assert result.Header.StatusCode == ResponseStatus(200, "OK")
+        assert decoded == [response_bytes]
+    finally:
+        pipe.leap_loop.cancel()
+
+
+async def _respond(pipe: Pipe, status: str = "200 OK") -> str:
+    """Answer the next request sent to the test side of a pipe."""
+    received = json.loads(await pipe.test_reader.readline())
+    url = received["Header"]["Url"]
+    response_obj = {
+        "CommuniqueType": "ReadResponse",
+        "Header": {
+            "ClientTag": received["Header"]["ClientTag"],
+            "StatusCode": status,
+            "Url": url,
+        },
+    }
+    pipe.test_writer.write(f"{json.dumps(response_obj)}\r\n".encode("utf-8"))
+    return url
+
+
+@pytest.mark.asyncio
+async def test_write_backpressure(event_loop: asyncio.AbstractEventLoop):
+    """Test that requests are not written until the write buffer drains."""
+    pipe = make_pipe(event_loop, write_high_water=10)
+    transport = pipe_transport(pipe)
+    try:
+        # below the high-water mark, a paused transport does not block requests
+        transport.buffer_size = 10
+        transport.get_protocol().pause_writing()
+        task = asyncio.create_task(pipe.leap.request("ReadRequest", "/test/1"))
+        await _respond(pipe)
+        await asyncio.wait_for(task, 1.0)
+
+        transport.buffer_size = 11
+        first = asyncio.create_task(pipe.leap.request("ReadRequest", "/test/2"))
+        second = asyncio.create_task(pipe.leap.request("ReadRequest", "/test/3"))
+        assert await _respond(pipe) == "/test/2"
+        await asyncio.wait_for(first, 1.0)
+        await asyncio.sleep(0.01)
+        assert pipe.leap.write_buffer_size == 11
+        assert pipe.leap.write_queue_depth == 1
+
+        transport.buffer_size = 0
+        transport.get_protocol().resume_writing()
+        assert await _respond(pipe) == "/test/3"
+        await asyncio.wait_for(second, 1.0)
+        assert pipe.leap.write_queue_depth == 0
+    finally:
+        pipe.leap_loop.cancel()
+
+
+@pytest.mark.asyncio
+async def test_max_in_flight(event_loop: asyncio.AbstractEventLoop):
+    """Test that requests beyond max_in_flight wait for a response."""
+    pipe = make_pipe(event_loop, max_in_flight=2)
+    try:
+        tasks = [
+            asyncio.create_task(pipe.leap.request("ReadRequest", f"/test/{i}"))
+            for i in range(3)
+        ]
+        first = json.loads(await pipe.test_reader.readline())
+        second = json.loads(await pipe.test_reader.readline())
+        await asyncio.sleep(0)
+        assert pipe.leap.in_flight_requests == 2
+        assert pipe.leap.queued_requests == 1
+
+        response_obj: Dict[str, Any] = {
+            "CommuniqueType": "ReadResponse",
+            "Header": {
+                "ClientTag": first["Header"]["ClientTag"],
+                "StatusCode": "200 OK",
+                "Url": first["Header"]["Url"],
+            },
+        }
+        pipe.test_writer.write(f"{json.dumps(response_obj)}\r\n".encode("utf-8"))
+        await asyncio.wait_for(tasks[0], 1.0)
+
+        assert await _respond(pipe) == "/test/2"
+        assert pipe.leap.queued_requests == 0
+
+        response_obj["Header"]["ClientTag"] = second["Header"]["ClientTag"]
+        response_obj["Header"]["Url"] = second["Header"]["Url"]
+        pipe.test_writer.write(f"{json.dumps(response_obj)}\r\n".encode("utf-8"))
+        await asyncio.wait_for(asyncio.gather(*tasks), 1.0)
+        assert pipe.leap.in_flight_requests == 0
+    finally:
+        pipe.leap_loop.cancel()
+
+
+@pytest.mark.asyncio
+async def test_max_in_flight_priority(event_loop: asyncio.AbstractEventLoop):
+    """Test that requests held back by max_in_flight are sent most urgent first."""
+    pipe = make_pipe(event_loop, max_in_flight=2, bulk_queue_size=100)
+    try:
+        bulk = [
+            asyncio.create_task(
+                pipe.leap.request("ReadRequest", f"/bulk/{i}", priority=PRIORITY_BULK)
+            )
+            for i in range(20)
+        ]
+        await asyncio.sleep(0.01)
+        assert pipe.leap.queued_requests == 18
+
+        # a waiting request that is cancelled does not hold on to a slot
+        bulk[2].cancel()
+        ping = asyncio.create_task(
+            pipe.leap.request("ReadRequest", "/ping", priority=PRIORITY_PING)
+        )
+        interactive = asyncio.create_task(
+            pipe.leap.request("ReadRequest", "/interactive")
+        )
+        await asyncio.sleep(0.01)
+        assert pipe.leap.queued_requests == 19
+
+        assert await _respond(pipe) == "/bulk/0"
+        assert await _respond(pipe) == "/bulk/1"
+        assert await _respond(pipe) == "/interactive"
+        assert await _respond(pipe) == "/ping"
+        await asyncio.wait_for(asyncio.gather(interactive, ping), 1.0)
+
+        for i in range(3, 20):
+            assert await _respond(pipe) == f"/bulk/{i}"
+        await asyncio.wait_for(asyncio.gather(*bulk[3:]), 1.0)
+        assert pipe.leap.queued_requests == 0
+        assert pipe.leap.in_flight_requests == 0
+    finally:
+        pipe.leap_loop.cancel()
+
+
+def test_create_without_loop():
+    """Test that a LeapProtocol can be created outside of a running event loop."""
+    leap = LeapProtocol(None, None)  # type: ignore
+    assert leap.in_flight_requests == 0
+
+
+def test_max_in_flight_invalid():
+    """Test that max_in_flight must allow at least one request."""
+    with pytest.raises(ValueError):
+        LeapProtocol(None, None, max_in_flight=0)  # type: ignore
+
+
+@pytest.mark.asyncio
+async def test_write_priority(event_loop: asyncio.AbstractEventLoop):
+    """Test that interactive requests are written ahead of a bulk load."""
+    pipe = make_pipe(event_loop, write_high_water=0, bulk_queue_size=100)
+    transport = pipe_transport(pipe)
+    try:
+        # simulate a slow link that accepts one request before it must drain
+        transport.buffer_size = 1
+        transport.get_protocol().pause_writing()
+
+        bulk = [
+            asyncio.create_task(
+                pipe.leap.request("ReadRequest", f"/bulk/{i}", priority=PRIORITY_BULK)
+            )
+            for i in range(500)
+        ]
+        await asyncio.sleep(0.01)
+        # one bulk request was written, and the requests beyond bulk_queue_size
+        # wait for room in the queue
+        assert pipe.leap.write_queue_depth == 100
+
+        ping = asyncio.create_task(
+            pipe.leap.request("ReadRequest", "/ping", priority=PRIORITY_PING)
+        )
+        interactive = asyncio.create_task(
+            pipe.leap.request("ReadRequest", "/interactive")
+        )
+        await asyncio.sleep(0.01)
+        assert pipe.leap.write_queue_depth == 102
+
+        transport.buffer_size = 0
+        transport.get_protocol().resume_writing()
+
+        assert await _respond(pipe) == "/bulk/0"
+        assert await _respond(pipe) == "/interactive"
+        assert await _respond(pipe) == "/ping"
+        await asyncio.wait_for(asyncio.gather(interactive, ping), 1.0)
+        assert not any(task.done() for task in bulk[1:])
+
+        for i in range(1, 500):
+            assert await _respond(pipe) == f"/bulk/{i}"
+        await asyncio.wait_for(asyncio.gather(*bulk), 1.0)
+
+        waits = pipe.leap.write_waits
+        assert waits[PRIORITY_INTERACTIVE].writes == 1
+        assert waits[PRIORITY_PING].writes == 1
+        assert waits[PRIORITY_BULK].writes == 500
+        assert waits[PRIORITY_INTERACTIVE].longest < waits[PRIORITY_BULK].longest
+        assert pipe.leap.write_queue_depth == 0
+    finally:
+        pipe.leap_loop.cancel()
+
+
+@pytest.mark.asyncio
+async def test_write_queue_close(event_loop: asyncio.AbstractEventLoop):
+    """Test that requests still waiting for the writer fail when closed."""
+    pipe = make_pipe(event_loop, write_high_water=0, bulk_queue_size=1)
+    transport = pipe_transport(pipe)
+    transport.buffer_size = 1
+    transport.get_protocol().pause_writing()
+
+    tasks = [
+        asyncio.create_task(
+            pipe.leap.request("ReadRequest", f"/bulk/{i}", priority=PRIORITY_BULK)
+        )
+        for i in range(3)
+    ]
+    await asyncio.sleep(0.01)
+    pipe.leap_loop.cancel()
+    pipe.leap.close()
+
+    for task in tasks:
+        with pytest.raises(BridgeDisconnectedError):
+            await asyncio.wait_for(task, 1.0)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "error", [ssl.SSLError("bad record mac"), RuntimeError(), ConnectionResetError()]
+)
+async def test_write_failure(
+    event_loop: asyncio.AbstractEventLoop, monkeypatch, error: Exception
+):
+    """Test that a failed write fails every request and ends the connection."""
+    pipe = make_pipe(event_loop, bulk_queue_size=1)
+    close_errors: List[Exception] = []
+
+    def close():
+        try:
+            pipe.leap.close()
+        except Exception as ex:  # pylint: disable=broad-except
+            close_errors.append(ex)
+
+    def write(_: bytes):
+        # close before the requests that failed have seen their errors
+        event_loop.call_soon(close)
+        raise error
+
+    monkeypatch.setattr(pipe_transport(pipe), "write", write)
+
+    tasks = [
+        asyncio.create_task(pipe.leap.request("ReadRequest", "/test/1")),
+        asyncio.create_task(
+            pipe.leap.request("ReadRequest", "/bulk/1", priority=PRIORITY_BULK)
+        ),
+        asyncio.create_task(
+            pipe.leap.request("ReadRequest", "/bulk/2", priority=PRIORITY_BULK)
+        ),
+    ]
+    for task in tasks:
+        with pytest.raises(BridgeDisconnectedError):
+            await asyncio.wait_for(task, 1.0)
+    with pytest.raises(BridgeDisconnectedError):
+        await asyncio.wait_for(pipe.leap_loop, 1.0)
+
+    assert not close_errors
+    assert pipe.leap.in_flight_requests == 0
+    with pytest.raises(BridgeDisconnectedError):
+        await asyncio.wait_for(pipe.leap.request("ReadRequest", "/test/2"), 1.0)
+
+
+async def _request_tag(pipe: Pipe) -> str:
+    """Send a request and return the ClientTag it was sent with."""
+    task = asyncio.create_task(pipe.leap.request("ReadRequest", "/test"))
+    received = json.loads(await pipe.test_reader.readline())
+    tag = received["Header"]["ClientTag"]
+    response_obj = {
+        "CommuniqueType": "ReadResponse",
+        "Header": {"ClientTag": tag, "StatusCode": "200 OK", "Url": "/test"},
+    }
+    pipe.test_writer.write(f"{json.dumps(response_obj)}\r\n".encode("utf-8"))
+    await asyncio.wait_for(task, 1.0)
+    return tag
+
+
+@pytest.mark.asyncio
+async def test_tags_after_reconnect(event_loop: asyncio.AbstractEventLoop):
+    """Test that tags are short and are not repeated by a new connection."""
+    first = make_pipe(event_loop)
+    first_tags = [await _request_tag(first) for _ in range(3)]
+    first.leap_loop.cancel()
+    first.leap.close()
+
+    second = make_pipe(event_loop)
+    try:
+        second_tags = [await _request_tag(second) for _ in range(3)]
+    finally:
+        second.leap_loop.cancel()
+
+    tags = first_tags + second_tags
+    assert len(set(tags)) == len(tags)
+    assert all(len(tag) < 36 for tag in tags)
+
+
+@pytest.mark.asyncio
+async def test_subscription_tag_reused_after_reconnect(
+    event_loop: asyncio.AbstractEventLoop,
+):
+    """Test that a caller's tag can be subscribed again on a new connection."""
+    for _ in range(2):
+        pipe = make_pipe(event_loop)
+        try:
+            received_events: List[Any] = []
+            event_received = asyncio.Event()
+
+            def handler(events: List[Any], event: asyncio.Event, response: Response):
+                events.append(response.Body)
+                event.set()
+
+            task = asyncio.create_task(
+                pipe.leap.subscribe(
+                    "/test",
+                    partial(handler, received_events, event_received),
+                    tag="subscription",
+                )
+            )
+            received = json.loads(await pipe.test_reader.readline())
+            assert received["Header"]["ClientTag"] == "subscription"
+            response_obj = {
+                "CommuniqueType": "SubscribeResponse",
+                "Header": {
+                    "ClientTag": "subscription",
+                    "StatusCode": "200 OK",
+                    "Url": "/test",
+                },
+            }
+            pipe.test_writer.write(f"{json.dumps(response_obj)}\r\n".encode("utf-8"))
+            _, tag = await asyncio.wait_for(task, 1.0)
+            assert tag == "subscription"
+
+            response_obj["CommuniqueType"] = "ReadResponse"
+            response_obj["Body"] = {"ok": True}
+            pipe.test_writer.write(f"{json.dumps(response_obj)}\r\n".encode("utf-8"))
+            await asyncio.wait_for(event_received.wait(), 1.0)
+            assert received_events == [{"ok": True}]
+        finally:
+            pipe.leap_loop.cancel()
+            pipe.leap.close()
+
+
+async def _answer(pipe: Pipe, communique_type: str, status: str = "200 OK") -> dict:
+    """Answer the next request with an empty response, and return the request."""
+    received = json.loads(await pipe.test_reader.readline())
+    response_obj = {
+        "CommuniqueType": communique_type,
+        "Header": {
+            "ClientTag": received["Header"]["ClientTag"],
+            "StatusCode": status,
+            "Url": received["Header"]["Url"],
+        },
+    }
+    pipe.test_writer.write(f"{json.dumps(response_obj)}\r\n".encode("utf-8"))
+    return received
+
+
+def _event(tag: str, index: int) -> bytes:
+    response_obj = {
+        "CommuniqueType": "ReadResponse",
+        "Header": {"ClientTag": tag, "StatusCode": "200 OK", "Url": "/test"},
+        "Body": {"Index": index},
+    }
+    return f"{json.dumps(response_obj)}\r\n".encode("utf-8")
+
+
+async def _subscribe_indexes(pipe: Pipe) -> Tuple[str, List[int]]:
+    """Subscribe to /test, and return the tag and a list of the event indexes."""
+    events: List[int] = []
+
+    def handler(response: Response):
+        assert response.Body is not None
+        events.append(response.Body["Index"])
+
+    task = asyncio.create_task(pipe.leap.subscribe("/test", handler))
+    await _answer(pipe, "SubscribeResponse")
+    _, tag = await asyncio.wait_for(task, 1.0)
+    assert pipe.leap.is_subscribed(tag)
+    return tag, events
+
+
+async def _wait_for_event(pipe: Pipe, tag: str, index: int):
+    """Send an event with a response to a request, so it is known to be handled."""
+    pipe.test_writer.write(_event(tag, index))
+    await _request_tag(pipe)
+
+
+@pytest.mark.asyncio
+async def test_unsubscribe(pipe: Pipe):
+    """Test that unsubscribing tells the bridge and stops the callback."""
+    tag, events = await _subscribe_indexes(pipe)
+    await _wait_for_event(pipe, tag, 0)
+
+    task = asyncio.create_task(pipe.leap.unsubscribe(tag))
+    received = json.loads(await pipe.test_reader.readline())
+    assert received["CommuniqueType"] == "UnsubscribeRequest"
+    assert received["Header"]["Url"] == "/test"
+    # until the bridge answers, the subscription is still open
+    assert pipe.leap.is_subscribed(tag)
+    pipe.test_writer.write(_event(tag, 1))
+
+    response_obj = {
+        "CommuniqueType": "UnsubscribeResponse",
+        "Header": {
+            "ClientTag": received["Header"]["ClientTag"],
+            "StatusCode": "200 OK",
+            "Url": "/test",
+        },
+    }
+    pipe.test_writer.write(f"{json.dumps(response_obj)}\r\n".encode("utf-8"))
+    response = await asyncio.wait_for(task, 1.0)
+
+    assert response is not None
+    assert response.CommuniqueType == "UnsubscribeResponse"
+    assert events == [0, 1]
+    assert not pipe.leap.is_subscribed(tag)
+    assert pipe.leap._tagged_subscriptions == {}  # pylint: disable=protected-access
+
+    with pytest.raises(KeyError):
+        await pipe.leap.unsubscribe(tag)
+
+
+@pytest.mark.asyncio
+async def test_unsubscribe_rejected(pipe: Pipe):
+    """Test that a subscription the bridge would not end stays open."""
+    tag, events = await _subscribe_indexes(pipe)
+
+    task = asyncio.create_task(pipe.leap.unsubscribe(tag))
+    await _answer(pipe, "ExceptionResponse", status="500 Internal Server Error")
+    with pytest.raises(BridgeResponseError):
+        await asyncio.wait_for(task, 1.0)
+
+    assert pipe.leap.is_subscribed(tag)
+    await _wait_for_event(pipe, tag, 0)
+    assert events == [0]
+
+
+@pytest.mark.asyncio
+async def test_unsubscribe_shared_url(pipe: Pipe):
+    """Test that only the last subscription to a URL is ended on the bridge."""
+    first, first_events = await _subscribe_indexes(pipe)
+    second, second_events = await _subscribe_indexes(pipe)
+
+    # the bridge cannot end one of two subscriptions to the same URL
+    assert await asyncio.wait_for(pipe.leap.unsubscribe(first), 1.0) is None
+    assert not pipe.leap.is_subscribed(first)
+    assert pipe.leap.is_subscribed(second)
+    await _wait_for_event(pipe, first, 0)
+    await _wait_for_event(pipe, second, 1)
+    assert first_events == []
+    assert second_events == [1]
+
+    task = asyncio.create_task(pipe.leap.unsubscribe(second))
+    received = await _answer(pipe, "UnsubscribeResponse")
+    assert received["CommuniqueType"] == "UnsubscribeRequest"
+    assert received["Header"]["Url"] == "/test"
+    assert await asyncio.wait_for(task, 1.0) is not None
+    assert pipe.leap._tagged_subscriptions == {}  # pylint: disable=protected-access
+
+
+@pytest.mark.asyncio
+async def test_subscription_context_manager(pipe: Pipe):
+    """Test that a subscription handle unsubscribes when it is left."""
+    events: List[Response] = []
+
+    async def use_subscription():
+        async with pipe.leap.subscription("/test", events.append) as subscription:
+            assert subscription.active
+            assert subscription.response.CommuniqueType == "SubscribeResponse"
+            return subscription
+
+    task = asyncio.create_task(use_subscription())
+    subscribe = await _answer(pipe, "SubscribeResponse")
+    unsubscribe = await _answer(pipe, "UnsubscribeResponse")
+    subscription = await asyncio.wait_for(task, 1.0)
+
+    assert subscribe["CommuniqueType"] == "SubscribeRequest"
+    assert subscribe["Header"]["ClientTag"] == subscription.tag
+    assert unsubscribe["CommuniqueType"] == "UnsubscribeRequest"
+    assert not subscription.active
+    assert await subscription.unsubscribe() is None
+
+
+@pytest.mark.asyncio
+async def test_subscription_rejected(pipe: Pipe):
+    """Test that leaving a subscription the bridge rejected sends nothing."""
+
+    async def use_subscription():
+        async with pipe.leap.subscription("/test", lambda _: None) as subscription:
+            assert not subscription.active
+            return subscription
+
+    task = asyncio.create_task(use_subscription())
+    await _answer(pipe, "SubscribeResponse", status="404 Not Found")
+    subscription = await asyncio.wait_for(task, 1.0)
+    assert subscription.response.Header.StatusCode.code == 404
+    assert pipe.leap.in_flight_requests == 0
+
+
+@pytest.mark.parametrize(
+    "href,expected",
+    [
+        ("/zone/12", Href("zone", "12")),
+        ("/zone/12/status", Href("zone", "12", "status")),
+        ("/occupancygroup/3/status", Href("occupancygroup", "3", "status")),
+        ("/device/2/buttongroup/3", Href("device", "2", "buttongroup/3")),
+        ("/virtualbutton/1/", Href("virtualbutton", "1")),
+        ("/area/summary/4/status", Href("area/summary", "4", "status")),
+    ],
+)
+def test_parse_href(href: str, expected: Href):
+    """Test splitting hrefs into their parts."""
+    assert parse_href(href) == expected
+    assert parse_href(href) is parse_href(href)
+    assert id_from_href(href) == expected.id
+
+
+@pytest.mark.parametrize(
+    "href", ["", "/", "zone/1", "/12", "//1", "/zone", "/zone/", "/zone/status"]
+)
+def test_parse_href_invalid(href: str):
+    """Test that hrefs without an id are rejected."""
+    with pytest.raises(ValueError):
+        parse_href(href)
+    with pytest.raises(ValueError):
+        id_from_href(href)
+
+
+def _message(communique_type: str, body_type: str, url: str) -> Response:
+    return Response(
+        CommuniqueType=communique_type,
+        Header=ResponseHeader(MessageBodyType=body_type, Url=url),
+    )
+
+
+def test_message_router():
+    """Test routing messages by communique type, body type and URL pattern."""
+    router = MessageRouter()
+    calls = []
+
+    def handler(name: str):
+        return lambda response: calls.append((name, response.Header.Url))
+
+    everything = handler("everything")
+    zone_status = handler("zone status")
+    zone_1 = handler("zone 1")
+    reads = handler("reads")
+    router.add(everything)
+    router.add(zone_status, body_type="OneZoneStatus", url="/zone/*/status")
+    router.add(zone_1, url="/zone/1/status")
+    router.add(reads, communique_type="ReadResponse", body_type="OneZoneStatus")
+
+    router.dispatch(_message("ReadResponse", "OneZoneStatus", "/zone/1/status"))
+    assert calls == [
+        ("everything", "/zone/1/status"),
+        ("zone status", "/zone/1/status"),
+        ("zone 1", "/zone/1/status"),
+        ("reads", "/zone/1/status"),
+    ]
+
+    calls.clear()
+    router.dispatch(_message("UpdateResponse", "OneZoneStatus", "/zone/2/status"))
+    assert calls == [
+        ("everything", "/zone/2/status"),
+        ("zone status", "/zone/2/status"),
+    ]
+
+    calls.clear()
+    router.dispatch(_message("ReadResponse", "OneDeviceStatus", "/device/2/status"))
+    assert calls == [("everything", "/device/2/status")]
+
+    router.remove(everything)
+    router.remove(zone_status)
+    calls.clear()
+    router.dispatch(_message("ReadResponse", "OneZoneStatus", "/zone/1/status"))
+    assert calls == [("zone 1", "/zone/1/status"), ("reads", "/zone/1/status")]
+
+    with pytest.raises(ValueError):
+        router.remove(everything)
+    with pytest.raises(TypeError):
+        router.add(None)  # type: ignore
+
+
+@pytest.mark.asyncio
+async def test_unsolicited_filtered(pipe: Pipe):
+    """Test that unsolicited messages only reach handlers that match them."""
+    received = []
+    device_received = asyncio.Event()
+
+    def zone_handler(response):
+        received.append(("zone", response.Header.Url))
+
+    def device_handler(response):
+        received.append(("device", response.Header.Url))
+        device_received.set()
+
+    pipe.leap.subscribe_unsolicited(zone_handler, url="/zone/*/status")
+    pipe.leap.subscribe_unsolicited(
+        device_handler, communique_type="ReadResponse", body_type="OneDeviceStatus"
+    )
+
+    for url, body_type in (
+        ("/zone/3/status", "OneZoneStatus"),
+        ("/area/1/status", "OneAreaStatus"),
+        ("/device/5/status", "OneDeviceStatus"),
+    ):
+        response_dict = {
+            "CommuniqueType": "ReadResponse",
+            "Header": {"MessageBodyType": body_type, "Url": url},
+        }
+        pipe.test_writer.write(f"{json.dumps(response_dict)}\r\n".encode("utf-8"))
+
+    await asyncio.wait_for(device_received.wait(), 1.0)
+    assert received == [("zone", "/zone/3/status"), ("device", "/device/5/status")]
+
+
+@pytest.mark.asyncio
+async def test_last_received(pipe: Pipe, event_loop: asyncio.AbstractEventLoop):
+    """Test that the time of the last received message is tracked."""
+    time = event_loop.time() + 10.0
+    event_loop.time = lambda: time  # type: ignore
+    assert pipe.leap.last_received < time
+
+    received = asyncio.Event()
+    pipe.leap.subscribe_unsolicited(lambda _: received.set())
+    pipe.test_writer.write(b'{"CommuniqueType": "ReadResponse", "Header": {}}\r\n')
+    await asyncio.wait_for(received.wait(), 1.0)
+
+    assert pipe.leap.last_received == time
+
+
+@pytest.mark.asyncio
+async def test_metrics(event_loop: asyncio.AbstractEventLoop):
+    """Test that requests and messages are reported to the metrics sink."""
+    metrics = HistogramMetrics()
+    pipe = make_pipe(event_loop, metrics=metrics)
+    try:
+        time = event_loop.time()
+        event_loop.time = lambda: time  # type: ignore
+
+        task = event_loop.create_task(
+            pipe.leap.request("ReadRequest", "/zone/3/status")
+        )
+        received = json.loads(await pipe.test_reader.readline())
+        tag = received["Header"]["ClientTag"]
+        assert metrics.snapshot().in_flight == 1
+
+        time += 0.2
+        response = {
+            "CommuniqueType": "ReadResponse",
+            "Header": {"ClientTag": tag, "StatusCode": "200 OK"},
+        }
+        response_bytes = f"{json.dumps(response)}\r\n".encode("utf-8")
+        pipe.test_writer.write(response_bytes)
+        await task
+
+        snapshot = metrics.snapshot()
+        latency = snapshot.latency[("ReadRequest", "/zone/*/status")]
+        assert latency.samples == 1
+        assert latency.sum == pytest.approx(0.2)
+        assert snapshot.in_flight == 0
+        assert snapshot.max_in_flight == 1
+        assert snapshot.messages_sent == 1
+        assert snapshot.bytes_sent > 0
+        assert snapshot.messages_received == 1
+        assert snapshot.parse_time.samples == 1
+    finally:
+        pipe.leap_loop.cancel()
+
+
+@pytest.mark.asyncio
+async def test_tracing(event_loop: asyncio.AbstractEventLoop):
+    """Test that the tracer sees every message and callback."""
+    output = io.StringIO()
+    pipe = make_pipe(event_loop, tracer=JsonlRecorder(output))
+    try:
+        unsolicited = asyncio.Event()
+        pipe.leap.subscribe_unsolicited(lambda _: unsolicited.set())
+
+        task = event_loop.create_task(
+            pipe.leap.subscribe("/zone/1/status", lambda _: None)
+        )
+        received = await _answer(pipe, "SubscribeResponse")
+        _, tag = await task
+        assert tag == received["Header"]["ClientTag"]
+
+        pipe.test_writer.write(_event(tag, 1))
+        pipe.test_writer.write(b'{"CommuniqueType": "ReadResponse", "Header": {}}\r\n')
+        await asyncio.wait_for(unsolicited.wait(), 1.0)
+
+        events = [json.loads(line) for line in output.getvalue().splitlines()]
+        assert [
+            (event["ev"], event.get("tag"), event.get("target")) for event in events
+        ] == [
+            ("send", tag, None),
+            ("receive", tag, None),
+            ("dispatch", tag, "response"),
+            ("receive", tag, None),
+            ("dispatch", tag, "subscription"),
+            ("callback", tag, "subscription"),
+            ("receive", None, None),
+            ("dispatch", None, "unsolicited"),
+            ("callback", None, "unsolicited"),
+        ]
+        assert events[0]["url"] == "/zone/1/status"
+        assert events[0]["type"] == "SubscribeRequest"
+    finally:
+        pipe.leap_loop.cancel()
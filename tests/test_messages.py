@@ -0,0 +1,157 @@
+"""Tests to validate the message models."""
+import gc
+import pickle
+import tracemalloc
+from typing import Callable, List, Optional
+
+import pytest
+
+from pylutron_caseta.messages import Response, ResponseHeader, ResponseStatus
+
+RESPONSE_JSON = {
+    "CommuniqueType": "ReadResponse",
+    "Header": {
+        "MessageBodyType": "OneZoneStatus",
+        "StatusCode": "200 OK",
+        "Url": "/zone/1/status",
+    },
+    "Body": {"ZoneStatus": {"Level": 100, "Zone": {"href": "/zone/1"}}},
+}
+
+EXPECTED_RESPONSE = Response(
+    Header=ResponseHeader(
+        StatusCode=ResponseStatus(200, "OK"),
+        Url="/zone/1/status",
+        MessageBodyType="OneZoneStatus",
+    ),
+    CommuniqueType="ReadResponse",
+    Body={"ZoneStatus": {"Level": 100, "Zone": {"href": "/zone/1"}}},
+)
+
+
+def test_response_from_json():
+    """Test that decoded responses look like constructed responses."""
+    response = Response.from_json(RESPONSE_JSON)
+
+    assert response == EXPECTED_RESPONSE
+    assert response.Header.StatusCode == ResponseStatus(200, "OK")
+    assert response.Header.Url == "/zone/1/status"
+    assert response.Header.MessageBodyType == "OneZoneStatus"
+    assert response.CommuniqueType == "ReadResponse"
+    assert response.Body == RESPONSE_JSON["Body"]
+    assert repr(response) == repr(EXPECTED_RESPONSE)
+
+
+def test_response_header_is_lazy():
+    """Test that the header is only parsed when it is accessed."""
+    response = Response.from_json(RESPONSE_JSON)
+    assert response.Body is RESPONSE_JSON["Body"]
+    assert response._header is None  # pylint: disable=protected-access
+
+    header = response.Header
+    assert header is response.Header
+
+
+def test_response_defaults():
+    """Test that optional fields have the same defaults as before."""
+    response = Response(Header=ResponseHeader())
+    assert response.CommuniqueType is None
+    assert response.Body == {}
+
+    response = Response.from_json({})
+    assert response.Header == ResponseHeader()
+    assert response.CommuniqueType is None
+    assert response.Body is None
+
+
+def test_response_tuple_interface():
+    """Test that Response still behaves like the NamedTuple it replaced."""
+    response = Response.from_json(RESPONSE_JSON)
+
+    header, communique_type, body = response
+    assert header == EXPECTED_RESPONSE.Header
+    assert communique_type == "ReadResponse"
+    assert body is response.Body
+    assert len(response) == 3
+    assert response[1] == "ReadResponse"
+    assert response == tuple(EXPECTED_RESPONSE)
+    assert response._asdict() == {  # pylint: disable=protected-access
+        "Header": EXPECTED_RESPONSE.Header,
+        "CommuniqueType": "ReadResponse",
+        "Body": RESPONSE_JSON["Body"],
+    }
+
+    replaced = response._replace(Body=None)  # pylint: disable=protected-access
+    assert replaced.Body is None
+    assert replaced.Header == response.Header
+
+    with pytest.raises(AttributeError):
+        response.Body = {}  # type: ignore
+
+
+@pytest.mark.parametrize(
+    "data,code,message",
+    [
+        ("200 OK", 200, "OK"),
+        ("201 Created", 201, "Created"),
+        ("404 Not Found", 404, "Not Found"),
+        ("OK", None, "OK"),
+        ("abc def", None, "abc def"),
+    ],
+)
+def test_response_status_from_str(data: str, code: int, message: str):
+    """Test parsing response statuses."""
+    status = ResponseStatus.from_str(data)
+    assert status == ResponseStatus(code, message)
+    assert status.code == code
+    assert status.message == message
+
+
+def test_response_status_shared():
+    """Test that parsing the same status twice gives the same instance."""
+    first = ResponseStatus.from_str("200 OK")
+    second = ResponseStatus.from_str("".join(["200", " ", "OK"]))
+    assert first is second
+    assert first.is_successful()
+    assert not ResponseStatus.from_str("404 Not Found").is_successful()
+
+
+def test_response_status_immutable():
+    """Test that shared statuses cannot be modified."""
+    status = ResponseStatus.from_str("200 OK")
+    with pytest.raises(AttributeError):
+        status.code = 404  # type: ignore
+    with pytest.raises(AttributeError):
+        del status.message
+    with pytest.raises(AttributeError):
+        status.other = True  # type: ignore
+
+    assert hash(status) == hash(ResponseStatus(200, "OK"))
+    assert pickle.loads(pickle.dumps(status)) == status
+
+
+def _retained_bytes(parse: Callable[[], ResponseStatus], count: int) -> int:
+    """Get the memory still allocated after parsing count statuses."""
+    # allocate the list up front so that only the statuses are measured
+    statuses: List[Optional[ResponseStatus]] = [None] * count
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for i in range(count):
+            statuses[i] = parse()
+        allocated, _ = tracemalloc.get_traced_memory()
+        return allocated
+    finally:
+        tracemalloc.stop()
+
+
+def test_response_status_allocations():
+    """Test that parsing common statuses does not allocate new objects."""
+    count = 1000
+    ResponseStatus.from_str("200 OK")
+
+    cached = _retained_bytes(lambda: ResponseStatus.from_str("200 OK"), count)
+    uncached = _retained_bytes(lambda: ResponseStatus(200, "OK"), count)
+
+    assert uncached >= count * 32
+    assert cached < uncached / 10
@@ -0,0 +1,47 @@
+"""Tests to validate the metrics sinks."""
+from pylutron_caseta.metrics import Histogram, HistogramMetrics, HistogramSnapshot
+
+
+def test_histogram():
+    """Test that values are counted in cumulative buckets."""
+    histogram = Histogram([1.0, 2.0])
+    for value in (0.5, 1.0, 1.5, 3.0):
+        histogram.observe(value)
+
+    assert histogram.snapshot() == HistogramSnapshot(
+        samples=4, sum=6.0, buckets=((1.0, 2), (2.0, 3), (float("inf"), 4))
+    )
+
+
+def test_histogram_metrics():
+    """Test that measurements are grouped and exported by snapshot."""
+    metrics = HistogramMetrics(latency_buckets=[0.1], parse_buckets=[0.001])
+    metrics.request_completed("ReadRequest", "/zone/*/status", 0.05)
+    metrics.request_completed("ReadRequest", "/zone/*/status", 0.2)
+    metrics.request_completed("CreateRequest", "/zone/*/commandprocessor", 0.05)
+    metrics.request_timed_out("ReadRequest", "/zone/*/status")
+    metrics.in_flight_changed(2)
+    metrics.in_flight_changed(1)
+    metrics.message_sent(100)
+    metrics.message_received(200, 0.0005)
+    metrics.message_received(300, 0.002)
+
+    snapshot = metrics.snapshot()
+    assert snapshot.latency == {
+        ("ReadRequest", "/zone/*/status"): HistogramSnapshot(
+            2, 0.25, ((0.1, 1), (float("inf"), 2))
+        ),
+        ("CreateRequest", "/zone/*/commandprocessor"): HistogramSnapshot(
+            1, 0.05, ((0.1, 1), (float("inf"), 1))
+        ),
+    }
+    assert snapshot.timeouts == {("ReadRequest", "/zone/*/status"): 1}
+    assert snapshot.in_flight == 1
+    assert snapshot.max_in_flight == 2
+    assert (snapshot.messages_sent, snapshot.bytes_sent) == (1, 100)
+    assert (snapshot.messages_received, snapshot.bytes_received) == (2, 500)
+    assert snapshot.parse_time.buckets == ((0.001, 1), (float("inf"), 2))
+
+    # the snapshot is a copy
+    metrics.request_timed_out("ReadRequest", "/zone/*/status")
+    assert snapshot.timeouts == {("ReadRequest", "/zone/*/status"): 1}
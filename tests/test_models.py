@@ -0,0 +1,93 @@
+"""Tests to validate the device models."""
+import pytest
+
+from pylutron_caseta.codec import JsonCodec, available_codecs
+from pylutron_caseta.models import Area, Device, OccupancyGroup, Scene
+
+
+def test_device_dict_interface():
+    """Test that devices can be used like the dicts they replaced."""
+    device = Device("2", zone="1", name="Hallway_Lights", type="WallDimmer")
+
+    assert device["device_id"] == "2"
+    assert device["zone"] == "1"
+    assert device.get("model") == ""
+    assert device.get("missing") is None
+    assert "fan_speed" in device
+    assert "missing" not in device
+    assert set(device.keys()) == {
+        "device_id",
+        "current_state",
+        "fan_speed",
+        "zone",
+        "name",
+        "type",
+        "model",
+        "serial",
+    }
+
+    device["current_state"] = 100
+    assert device.current_state == 100
+    device.update(fan_speed="Medium", serial=1234)
+    assert device["fan_speed"] == "Medium"
+    assert device.serial == 1234
+
+    assert device == {
+        "device_id": "2",
+        "current_state": 100,
+        "fan_speed": "Medium",
+        "zone": "1",
+        "name": "Hallway_Lights",
+        "type": "WallDimmer",
+        "model": "",
+        "serial": 1234,
+    }
+    assert dict(device)["name"] == "Hallway_Lights"
+
+
+def test_device_unknown_fields():
+    """Test that misspelled fields are rejected."""
+    device = Device("2")
+
+    with pytest.raises(KeyError):
+        device["current_sate"] = 100
+    with pytest.raises(KeyError):
+        _ = device["current_sate"]
+    with pytest.raises(AttributeError):
+        device.current_sate = 100  # type: ignore # pylint: disable=assigning-non-slot
+    with pytest.raises(TypeError):
+        del device["zone"]
+
+
+def test_other_models():
+    """Test scenes, areas and occupancy groups."""
+    assert Scene("1", "scene 1") == {"scene_id": "1", "name": "scene 1"}
+    assert Area("root") == {"name": "root"}
+    assert OccupancyGroup("2", "Occupied", "Living Room Occupancy") == {
+        "occupancy_group_id": "2",
+        "name": "Living Room Occupancy",
+        "status": "Occupied",
+    }
+    assert repr(Area("root")) == "Area(name='root')"
+
+
+@pytest.mark.parametrize("codec", available_codecs(), ids=lambda codec: codec.name)
+def test_as_dict(codec: JsonCodec):
+    """Test that as_dict returns a plain dict that every codec can encode."""
+    device = Device("2", zone="1", name="Hallway_Lights", type="WallDimmer")
+    records = [
+        device,
+        Scene("1", "scene 1"),
+        Area("root"),
+        OccupancyGroup("2", "Occupied", "Living Room Occupancy"),
+    ]
+
+    for record in records:
+        data = record.as_dict()
+        assert type(data) is dict  # pylint: disable=unidiomatic-typecheck
+        assert data == record
+        assert codec.loads(codec.dumps(data)) == data
+
+    # the dict is a copy
+    device.as_dict()["name"] = "changed"
+    assert device.name == "Hallway_Lights"
@@ -1,4 +1,5 @@
 """Tests to validate ssl interactions."""
+# pylint: disable=too-many-lines
 import asyncio
 from collections import defaultdict
 from datetime import timedelta
@@ -6,6 +7,7 @@ import json
 import logging
 import os
 from typing import (
+    Any,
     AsyncGenerator,
     Awaitable,
     Callable,
@@ -19,13 +21,20 @@ from typing import (
 
 import pytest
 
+from pylutron_caseta.cache import TopologyCache
+from pylutron_caseta.leap import PRIORITY_BULK, PRIORITY_INTERACTIVE, MessageRouter
 from pylutron_caseta.messages import Response, ResponseHeader, ResponseStatus
+from pylutron_caseta.metrics import HistogramMetrics
+from pylutron_caseta.models import Device
+from pylutron_caseta.tracing import Tracer
 import pylutron_caseta.smartbridge as smartbridge
 from pylutron_caseta import (
+    COVER_LOWER,
     FAN_MEDIUM,
     OCCUPANCY_GROUP_OCCUPIED,
     OCCUPANCY_GROUP_UNOCCUPIED,
     BridgeDisconnectedError,
+    BridgeResponseError,
 )
 
 logging.getLogger().setLevel(logging.DEBUG)
@@ -53,21 +62,31 @@ class _FakeLeap:
             asyncio.Queue()
         )
         self.running = None
+        self.last_received = asyncio.get_running_loop().time()
+        self.priorities: Dict[str, int] = {}
+        self._tags: Dict[str, Tuple[str, Callable[[Response], None]]] = {}
         self._subscriptions: Dict[str, List[Callable[[Response], None]]] = defaultdict(
             list
         )
-        self._unsolicited: List[Callable[[Response], None]] = []
+        self._unsolicited = MessageRouter()
 
     async def request(
-        self, communique_type: str, url: str, body: Optional[dict] = None
+        self,
+        communique_type: str,
+        url: str,
+        body: Optional[dict] = None,
+        priority: int = PRIORITY_INTERACTIVE,
     ) -> Response:
         """Make a request to the bridge and return the response."""
+        self.priorities[url] = priority
         future: asyncio.Future = asyncio.get_running_loop().create_future()
         obj = Request(communique_type=communique_type, url=url, body=body)
 
         await self.requests.put((obj, future))
 
-        return await future
+        response = await future
+        self.last_received = asyncio.get_running_loop().time()
+        return response
 
     async def subscribe(
         self,
@@ -75,22 +94,38 @@ class _FakeLeap:
         callback: Callable[[Response], None],
         body: Optional[dict] = None,
         communique_type: str = "SubscribeRequest",
+        priority: int = PRIORITY_INTERACTIVE,
     ) -> Tuple[Response, str]:
         """Subscribe to events from the bridge."""
-        response = await self.request(communique_type, url, body)
+        response = await self.request(communique_type, url, body, priority=priority)
         self._subscriptions[url].append(callback)
-        return (response, "not-implemented")
+        tag = f"{url}#{len(self._tags)}"
+        self._tags[tag] = (url, callback)
+        return (response, tag)
+
+    def is_subscribed(self, tag: str) -> bool:
+        """Check if there is an open subscription with the tag."""
+        return tag in self._tags
+
+    async def unsubscribe(self, tag: str) -> Optional[Response]:
+        """Stop a subscription made with subscribe."""
+        url, callback = self._tags[tag]
+        response = await self.request("UnsubscribeRequest", url)
+        status = response.Header.StatusCode
+        if status is None or not status.is_successful():
+            raise BridgeResponseError(response)
+        del self._tags[tag]
+        self._subscriptions[url].remove(callback)
+        return response
 
     async def run(self):
         """Event monitoring loop."""
         self.running = asyncio.get_running_loop().create_future()
         await self.running
 
-    def subscribe_unsolicited(self, callback: Callable[[Response], None]):
+    def subscribe_unsolicited(self, callback: Callable[[Response], None], **kwargs):
         """Subscribe to unsolicited responses."""
-        if not callable(callback):
-            raise TypeError("callback must be callable")
-        self._unsolicited.append(callback)
+        self._unsolicited.add(callback, **kwargs)
 
     def unsubscribe_unsolicited(self, callback: Callable[[Response], None]):
         """Unsubscribe from unsolicited responses."""
@@ -98,14 +133,15 @@ class _FakeLeap:
 
     def send_unsolicited(self, response: Response):
         """Send an unsolicited response message to SmartBridge."""
-        for handler in self._unsolicited:
-            handler(response)
+        self.last_received = asyncio.get_running_loop().time()
+        self._unsolicited.dispatch(response)
 
     def send_to_subscribers(self, response: Response):
         """Send an response message to topic subscribers."""
         url = response.Header.Url
         if url is None:
             raise TypeError("url must not be None")
+        self.last_received = asyncio.get_running_loop().time()
         for handler in self._subscriptions[url]:
             handler(response)
 
@@ -124,21 +160,38 @@ class _FakeLeap:
 
 T = TypeVar("T")
 
+ZONE_STATUS_NOT_SUPPORTED = Response(
+    CommuniqueType="SubscribeResponse",
+    Header=ResponseHeader(
+        StatusCode=ResponseStatus(405, "Method Not Allowed"), Url="/zone/status"
+    ),
+)
+
 
 class Bridge:
     """A test harness around SmartBridge."""
 
-    def __init__(self):
-        """Create a new Bridge in a disconnected state."""
+    def __init__(self, **kwargs):
+        """
+        Create a new Bridge in a disconnected state.
+
+        Keyword arguments are passed to the Smartbridge constructor.
+        """
         self.connections = asyncio.Queue()
         self.leap: _FakeLeap = None
 
+        self.project_result = response_from_json_file("project.json")
+        self.device_list_result = response_from_json_file("devices.json")
+        self.area_list_result = response_from_json_file("areas.json")
         self.occupancy_group_list_result = response_from_json_file(
             "occupancygroups.json"
         )
         self.occupancy_group_subscription_data_result = response_from_json_file(
             "occupancygroupsubscribe.json"
         )
+        self.zone_status_subscription_result: Optional[Response] = None
+        self.zone_status_results: Dict[str, Response] = {}
+        self._loaded_project: Optional[dict] = None
 
         async def fake_connect():
             """Open a fake LEAP connection for the test."""
@@ -146,7 +199,7 @@ class Bridge:
             await self.connections.put(leap)
             return leap
 
-        self.target = smartbridge.Smartbridge(fake_connect)
+        self.target = smartbridge.Smartbridge(fake_connect, **kwargs)
 
     async def initialize(self):
         """Perform the initial connection with SmartBridge."""
@@ -172,33 +225,60 @@ class Bridge:
         self.leap = fake_leap
         self.connections.task_done()
 
+    def modify_project(self):
+        """Change the project modification time, as editing the topology does."""
+        body = json.loads(json.dumps(self.project_result.Body))
+        body["Project"]["ProjectModifiedTimestamp"]["Second"] += 1
+        self.project_result = self.project_result._replace(Body=body)
+
     async def _accept_connection(self, leap, wait):
         """Accept a connection from SmartBridge (implementation)."""
-        # First message should be read request on /device
+        # First message should be read request on /project
+        request, response = await wait(leap.requests.get())
+        assert request == Request(communique_type="ReadRequest", url="/project")
+        response.set_result(self.project_result)
+        leap.requests.task_done()
+
+        # The topology is only read again if the project was modified
+        project = self.project_result.Body
+        status = self.project_result.Header.StatusCode
+        if project is None or status is None or not status.is_successful():
+            self._loaded_project = None
+        elif project == self._loaded_project:
+            await self._accept_subscriptions(leap, wait)
+            return
+        else:
+            self._loaded_project = project
+
+        # Second message should be read request on /device
         request, response = await wait(leap.requests.get())
         assert request == Request(communique_type="ReadRequest", url="/device")
-        response.set_result(response_from_json_file("devices.json"))
+        response.set_result(self.device_list_result)
         leap.requests.task_done()
 
-        # Second message should be read request on /virtualbutton
+        # Third message should be read request on /virtualbutton
         request, response = await wait(leap.requests.get())
         assert request == Request(communique_type="ReadRequest", url="/virtualbutton")
         response.set_result(response_from_json_file("scenes.json"))
         leap.requests.task_done()
 
-        # Third message should be read request on /areas
+        # Fourth message should be read request on /areas
         request, response = await wait(leap.requests.get())
         assert request == Request(communique_type="ReadRequest", url="/area")
-        response.set_result(response_from_json_file("areas.json"))
+        response.set_result(self.area_list_result)
         leap.requests.task_done()
 
-        # Fourth message should be read request on /occupancygroup
+        # Fifth message should be read request on /occupancygroup
         request, response = await wait(leap.requests.get())
         assert request == Request(communique_type="ReadRequest", url="/occupancygroup")
         response.set_result(self.occupancy_group_list_result)
         leap.requests.task_done()
 
-        # Fifth message should be subscribe request on /occupancygroup/status
+        await self._accept_subscriptions(leap, wait)
+
+    async def _accept_subscriptions(self, leap, wait):
+        """Accept the subscriptions SmartBridge makes after loading the topology."""
+        # First message should be subscribe request on /occupancygroup/status
         request, response = await wait(leap.requests.get())
         assert request == Request(
             communique_type="SubscribeRequest", url="/occupancygroup/status"
@@ -206,34 +286,81 @@ class Bridge:
         response.set_result(self.occupancy_group_subscription_data_result)
         leap.requests.task_done()
 
-        # Finally, we should check the zone status on each zone
-        requested_zones = []
-        for _ in range(0, 3):
+        zone_hrefs = [
+            device["LocalZones"][0]["href"]
+            for device in self.device_list_result.Body["Devices"]
+            if "LocalZones" in device
+        ]
+
+        # Second message should be subscribe request on /zone/status
+        request, response = await wait(leap.requests.get())
+        assert request == Request(
+            communique_type="SubscribeRequest", url="/zone/status"
+        )
+        zone_status_subscription_result = self.zone_status_subscription_result
+        if zone_status_subscription_result is None:
+            zone_status_subscription_result = Response(
+                CommuniqueType="SubscribeResponse",
+                Header=ResponseHeader(
+                    MessageBodyType="MultipleZoneStatus",
+                    StatusCode=ResponseStatus(200, "OK"),
+                    Url="/zone/status",
+                ),
+                Body={
+                    "ZoneStatuses": [
+                        {
+                            "href": f"{href}/status",
+                            "Level": 0,
+                            "Zone": {"href": href},
+                            "StatusAccuracy": "Good",
+                        }
+                        for href in zone_hrefs
+                    ]
+                },
+            )
+        response.set_result(zone_status_subscription_result)
+        leap.requests.task_done()
+
+        status = zone_status_subscription_result.Header.StatusCode
+        if status is not None and status.is_successful():
+            return
+
+        # If the bridge cannot subscribe, we should check the status on each zone
+        expected_zones = sorted(f"{href}/status" for href in zone_hrefs)
+        # The zone reads are pipelined, so all of them should be in flight before
+        # any of them is answered.
+        zone_requests = []
+        for _ in range(0, len(expected_zones)):
             request, response = await wait(leap.requests.get())
             logging.info("Read %s", request)
             assert request.communique_type == "ReadRequest"
-            requested_zones.append(request.url)
+            zone_requests.append((request, response))
+        requested_zones = sorted(request.url for request, _ in zone_requests)
+        assert requested_zones == expected_zones
+
+        for request, response in zone_requests:
             response.set_result(
-                Response(
-                    CommuniqueType="ReadResponse",
-                    Header=ResponseHeader(
-                        MessageBodyType="OneZoneStatus",
-                        StatusCode=ResponseStatus(200, "OK"),
-                        Url=request.url,
+                self.zone_status_results.get(
+                    request.url,
+                    Response(
+                        CommuniqueType="ReadResponse",
+                        Header=ResponseHeader(
+                            MessageBodyType="OneZoneStatus",
+                            StatusCode=ResponseStatus(200, "OK"),
+                            Url=request.url,
+                        ),
+                        Body={
+                            "ZoneStatus": {
+                                "href": request.url,
+                                "Level": 0,
+                                "Zone": {"href": request.url.replace("/status", "")},
+                                "StatusAccuracy": "Good",
+                            }
+                        },
                     ),
-                    Body={
-                        "ZoneStatus": {
-                            "href": request.url,
-                            "Level": 0,
-                            "Zone": {"href": request.url.replace("/status", "")},
-                            "StatusAccuracy": "Good",
-                        }
-                    },
                 )
             )
             leap.requests.task_done()
-        requested_zones.sort()
-        assert requested_zones == ["/zone/1/status", "/zone/2/status", "/zone/6/status"]
 
     def disconnect(self, exception=None):
         """Disconnect SmartBridge."""
@@ -435,6 +562,201 @@ async def test_device_list(bridge: Bridge):
     assert devices[0]["device_id"] == "3"
 
 
+@pytest.mark.asyncio
+async def test_device_by_zone_id(bridge: Bridge, event_loop):
+    """Test looking up devices by zone, including after a reload."""
+    assert bridge.target.get_device_by_zone_id("1")["device_id"] == "2"
+    assert bridge.target.get_device_by_zone_id("6")["device_id"] == "7"
+    with pytest.raises(KeyError):
+        bridge.target.get_device_by_zone_id("5")
+
+    # move the hallway lights to a different zone and reconnect
+    devices = response_from_json_file("devices.json")
+    assert devices.Body is not None
+    for device in devices.Body["Devices"]:
+        if device["href"] == "/device/2":
+            device["LocalZones"] = [{"href": "/zone/5"}]
+    bridge.device_list_result = devices
+    bridge.modify_project()
+
+    time = 0.0
+    event_loop.time = lambda: time
+    bridge.disconnect()
+    await asyncio.sleep(0.0)
+    time += smartbridge.RECONNECT_DELAY
+    await bridge.accept_connection()
+
+    assert bridge.target.get_device_by_zone_id("5")["device_id"] == "2"
+    with pytest.raises(KeyError):
+        bridge.target.get_device_by_zone_id("1")
+
+
+@pytest.mark.asyncio
+async def test_zone_status_partial_failure(bridge_uninit: Bridge, caplog):
+    """Test that login completes when some zones cannot be read."""
+    bridge = bridge_uninit
+    bridge.zone_status_subscription_result = ZONE_STATUS_NOT_SUPPORTED
+    bridge.zone_status_results["/zone/2/status"] = Response(
+        CommuniqueType="ReadResponse",
+        Header=ResponseHeader(
+            StatusCode=ResponseStatus(404, "Not Found"), Url="/zone/2/status"
+        ),
+    )
+
+    await bridge.initialize()
+
+    assert bridge.target.is_connected()
+    devices = bridge.target.get_devices()
+    assert devices["2"]["current_state"] == 0
+    assert devices["3"]["current_state"] == -1
+    assert devices["7"]["current_state"] == 0
+    assert "Could not read the status of 1 of 3 zones: 2" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_zone_status_concurrency_limit():
+    """Test that the number of zone reads in flight is limited."""
+    # pylint: disable=protected-access
+
+    def connect():
+        raise NotImplementedError()
+
+    target = smartbridge.Smartbridge(connect, max_concurrent_requests=2)
+    for zone_id in range(1, 6):
+        device_id = str(zone_id + 1)
+        target.devices[device_id] = Device(device_id, zone=str(zone_id))
+    target._index_devices()
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def fake_request(
+        communique_type: str, url: str, *_args, **_kwargs
+    ) -> Response:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+        return Response(
+            CommuniqueType=communique_type,
+            Header=ResponseHeader(StatusCode=ResponseStatus(200, "OK"), Url=url),
+            Body={
+                "ZoneStatus": {
+                    "Level": 25,
+                    "Zone": {"href": url.replace("/status", "")},
+                }
+            },
+        )
+
+    target._request = fake_request  # type: ignore
+    errors = await target._load_zone_statuses()
+
+    assert errors == {}
+    assert max_in_flight == 2
+    assert all(device["current_state"] == 25 for device in target.devices.values())
+
+
+@pytest.mark.asyncio
+async def test_zone_status_fallback(bridge_uninit: Bridge):
+    """Test that zones are read one by one if the subscription is not supported."""
+    bridge = bridge_uninit
+    bridge.zone_status_subscription_result = ZONE_STATUS_NOT_SUPPORTED
+
+    await bridge.initialize()
+
+    devices = bridge.target.get_devices()
+    assert devices["2"]["current_state"] == 0
+    assert devices["3"]["current_state"] == 0
+    assert devices["7"]["current_state"] == 0
+
+
+@pytest.mark.asyncio
+async def test_multi_zone_status(bridge: Bridge):
+    """Test that zone status subscription messages update many zones at once."""
+    notified = set()
+    bridge.target.add_subscriber("2", lambda: notified.add("2"))
+    bridge.target.add_subscriber("7", lambda: notified.add("7"))
+
+    bridge.leap.send_to_subscribers(
+        Response(
+            CommuniqueType="ReadResponse",
+            Header=ResponseHeader(
+                MessageBodyType="MultipleZoneStatus",
+                StatusCode=ResponseStatus(200, "OK"),
+                Url="/zone/status",
+            ),
+            Body={
+                "ZoneStatuses": [
+                    {"Level": 75, "Zone": {"href": "/zone/1"}},
+                    {"Level": 30, "Zone": {"href": "/zone/6"}},
+                    # zones without a device are ignored
+                    {"Level": 10, "Zone": {"href": "/zone/99"}},
+                ]
+            },
+        )
+    )
+    bridge.leap.send_to_subscribers(
+        Response(
+            CommuniqueType="ReadResponse",
+            Header=ResponseHeader(
+                MessageBodyType="OneZoneStatus",
+                StatusCode=ResponseStatus(200, "OK"),
+                Url="/zone/status",
+            ),
+            Body={"ZoneStatus": {"FanSpeed": "Medium", "Zone": {"href": "/zone/2"}}},
+        )
+    )
+
+    devices = bridge.target.get_devices()
+    assert devices["2"]["current_state"] == 75
+    assert devices["7"]["current_state"] == 30
+    assert devices["3"]["fan_speed"] == FAN_MEDIUM
+    assert notified == {"2", "7"}
+
+
+@pytest.mark.asyncio
+async def test_device_indexes(bridge: Bridge, event_loop):
+    """Test that device lookups by type and domain are cached and reloaded."""
+    lights = bridge.target.get_devices_by_domain("light")
+    assert [device["device_id"] for device in lights] == ["2"]
+    assert bridge.target.get_devices_by_domain("light") is lights
+    assert bridge.target.get_devices_by_domain("not a domain") == ()
+    assert bridge.target.get_devices_by_type("not a type") == ()
+    with pytest.raises(TypeError):
+        lights[0] = lights[0]  # type: ignore
+
+    sensors = bridge.target.get_devices_by_types(["RPSOccupancySensor", "WallDimmer"])
+    assert [device["device_id"] for device in sensors] == ["2", "4", "5", "6"]
+    assert (
+        bridge.target.get_devices_by_types(("WallDimmer", "RPSOccupancySensor"))
+        is sensors
+    )
+
+    # replace the hallway lights with a switch and reconnect
+    devices = response_from_json_file("devices.json")
+    assert devices.Body is not None
+    for device in devices.Body["Devices"]:
+        if device["href"] == "/device/2":
+            device["DeviceType"] = "WallSwitch"
+    bridge.device_list_result = devices
+    bridge.modify_project()
+
+    time = 0.0
+    event_loop.time = lambda: time
+    bridge.disconnect()
+    await asyncio.sleep(0.0)
+    time += smartbridge.RECONNECT_DELAY
+    await bridge.accept_connection()
+
+    assert bridge.target.get_devices_by_domain("light") == ()
+    switches = bridge.target.get_devices_by_domain("switch")
+    assert [device["device_id"] for device in switches] == ["2"]
+    assert bridge.target.get_devices_by_type("WallSwitch") == switches
+    sensors = bridge.target.get_devices_by_types(["RPSOccupancySensor", "WallDimmer"])
+    assert [device["device_id"] for device in sensors] == ["4", "5", "6"]
+
+
 def test_scene_list(bridge: Bridge):
     """Test methods getting scenes."""
     scenes = bridge.target.get_scenes()
@@ -609,6 +931,44 @@ async def test_is_on(bridge: Bridge):
     assert bridge.target.is_on("2") is False
 
 
+@pytest.mark.asyncio
+async def test_unsolicited_subscriber(bridge: Bridge):
+    """Test that unsolicited subscribers only get the messages they asked for."""
+    received = []
+
+    def callback(response: Response):
+        received.append(response.Header.Url)
+
+    bridge.target.add_unsolicited_subscriber(
+        callback, body_type="OneZoneStatus", url="/zone/*/status"
+    )
+
+    def zone_status(url: str, body_type: str = "OneZoneStatus") -> Response:
+        return Response(
+            CommuniqueType="ReadResponse",
+            Header=ResponseHeader(
+                MessageBodyType=body_type,
+                StatusCode=ResponseStatus(200, "OK"),
+                Url=url,
+            ),
+            Body={"ZoneStatus": {"Level": 50, "Zone": {"href": "/zone/1"}}},
+        )
+
+    bridge.leap.send_unsolicited(zone_status("/zone/1/status"))
+    bridge.leap.send_unsolicited(zone_status("/zone/1/status", "OneZoneDefinition"))
+    bridge.leap.send_unsolicited(zone_status("/device/1/status"))
+    assert received == ["/zone/1/status"]
+    # the bridge's own handler still runs
+    assert bridge.target.is_on("2") is True
+
+    bridge.target.remove_unsolicited_subscriber(callback)
+    bridge.leap.send_unsolicited(zone_status("/zone/1/status"))
+    assert received == ["/zone/1/status"]
+
+    with pytest.raises(ValueError):
+        bridge.target.remove_unsolicited_subscriber(callback)
+
+
 @pytest.mark.asyncio
 async def test_is_on_fan(bridge: Bridge):
     """Test the is_on method returns device state for fans."""
@@ -739,135 +1099,913 @@ async def test_set_value(bridge: Bridge, event_loop):
     await task
 
 
-@pytest.mark.asyncio
-async def test_set_value_with_fade(bridge: Bridge, event_loop):
-    """Test that setting values with fade_time produces the right commands."""
-    task = event_loop.create_task(
-        bridge.target.set_value("2", 50, fade_time=timedelta(seconds=4))
-    )
-    command, _ = await bridge.leap.requests.get()
-    assert command == Request(
-        communique_type="CreateRequest",
-        url="/zone/1/commandprocessor",
-        body={
-            "Command": {
-                "CommandType": "GoToDimmedLevel",
-                "DimmedLevelParameters": {"Level": 50, "FadeTime": "00:00:04"},
+def _level_command_response(zone_id: str, level: int) -> Response:
+    return Response(
+        CommuniqueType="CreateResponse",
+        Header=ResponseHeader(
+            MessageBodyType="OneZoneStatus",
+            StatusCode=ResponseStatus(201, "Created"),
+            Url=f"/zone/{zone_id}/commandprocessor",
+        ),
+        Body={
+            "ZoneStatus": {
+                "href": f"/zone/{zone_id}/status",
+                "Level": level,
+                "Zone": {"href": f"/zone/{zone_id}"},
             }
         },
     )
-    bridge.leap.requests.task_done()
-    task.cancel()
 
 
 @pytest.mark.asyncio
-async def test_set_fan(bridge: Bridge, event_loop):
-    """Test that setting fan speed produces the right commands."""
-    task = event_loop.create_task(bridge.target.set_fan("2", FAN_MEDIUM))
-    command, _ = await bridge.leap.requests.get()
-    assert command == Request(
-        communique_type="CreateRequest",
-        url="/zone/1/commandprocessor",
-        body={
-            "Command": {
-                "CommandType": "GoToFanSpeed",
-                "FanSpeedParameters": {"FanSpeed": "Medium"},
-            }
-        },
-    )
-    bridge.leap.requests.task_done()
-    task.cancel()
+async def test_set_value_coalesced(event_loop):
+    """Test that rapid commands for one zone are coalesced when enabled."""
+    bridge = Bridge(coalesce_commands=True)
+    await bridge.initialize()
+
+    try:
+        first = event_loop.create_task(bridge.target.set_value("2", 10))
+        command, response = await bridge.leap.requests.get()
+        assert command.body["Command"]["Parameter"][0]["Value"] == 10
+
+        # these arrive while the first command is in flight
+        superseded = [
+            event_loop.create_task(bridge.target.set_value("2", level))
+            for level in (20, 30, 40, 50)
+        ]
+        # a different zone is not held up
+        other = event_loop.create_task(bridge.target.set_fan("3", FAN_MEDIUM))
+        other_command, other_response = await bridge.leap.requests.get()
+        assert other_command.url == "/zone/2/commandprocessor"
+        other_response.set_result(_level_command_response("2", 0))
+        bridge.leap.requests.task_done()
+        await other
+
+        response.set_result(_level_command_response("1", 10))
+        bridge.leap.requests.task_done()
+        await first
+
+        # only the newest queued command is sent
+        command, response = await bridge.leap.requests.get()
+        assert command.body["Command"]["Parameter"][0]["Value"] == 50
+        response.set_result(_level_command_response("1", 50))
+        bridge.leap.requests.task_done()
+
+        await asyncio.gather(*superseded)
+        assert bridge.leap.requests.empty()
+
+        # once the zone is idle, commands are sent right away again
+        task = event_loop.create_task(bridge.target.set_value("2", 60))
+        command, response = await bridge.leap.requests.get()
+        assert command.body["Command"]["Parameter"][0]["Value"] == 60
+        response.set_result(_level_command_response("1", 60))
+        bridge.leap.requests.task_done()
+        await task
+    finally:
+        await bridge.target.close()
 
 
 @pytest.mark.asyncio
-async def test_lower_cover(bridge: Bridge, event_loop):
-    """Test that lowering a cover produces the right commands."""
-    devices = bridge.target.get_devices()
-    task = event_loop.create_task(bridge.target.lower_cover("7"))
-    command, response = await bridge.leap.requests.get()
-    assert command == Request(
-        communique_type="CreateRequest",
-        url="/zone/6/commandprocessor",
-        body={"Command": {"CommandType": "Lower"}},
-    )
-    # the real response probably contains more data
-    response.set_result(
-        Response(
-            CommuniqueType="CreateResponse",
-            Header=ResponseHeader(
-                StatusCode=ResponseStatus(201, "Created"),
-                Url="/zone/6/commandprocessor",
-            ),
-        ),
-    )
-    bridge.leap.requests.task_done()
-    await task
-    assert devices["7"]["current_state"] == 0
+async def test_set_value_coalesced_error(event_loop):
+    """Test that superseded callers see the error of the command that replaced them."""
+    bridge = Bridge(coalesce_commands=True)
+    await bridge.initialize()
 
+    try:
+        first = event_loop.create_task(bridge.target.set_value("2", 10))
+        _, response = await bridge.leap.requests.get()
+        superseded = [
+            event_loop.create_task(bridge.target.set_value("2", level))
+            for level in (20, 30)
+        ]
+        await asyncio.sleep(0)
+        response.set_result(_level_command_response("1", 10))
+        bridge.leap.requests.task_done()
+        await first
+
+        _, response = await bridge.leap.requests.get()
+        response.set_result(
+            Response(
+                CommuniqueType="CreateResponse",
+                Header=ResponseHeader(
+                    StatusCode=ResponseStatus(400, "Bad Request"),
+                    Url="/zone/1/commandprocessor",
+                ),
+            )
+        )
+        bridge.leap.requests.task_done()
 
-@pytest.mark.asyncio
-async def test_raise_cover(bridge: Bridge, event_loop):
-    """Test that raising a cover produces the right commands."""
-    devices = bridge.target.get_devices()
-    task = event_loop.create_task(bridge.target.raise_cover("7"))
-    command, response = await bridge.leap.requests.get()
-    assert command == Request(
-        communique_type="CreateRequest",
-        url="/zone/6/commandprocessor",
-        body={"Command": {"CommandType": "Raise"}},
-    )
-    # the real response probably contains more data
-    response.set_result(
-        Response(
-            CommuniqueType="CreateResponse",
-            Header=ResponseHeader(
-                StatusCode=ResponseStatus(201, "Created"),
-                Url="/zone/6/commandprocessor",
-            ),
-        ),
-    )
-    bridge.leap.requests.task_done()
-    await task
-    assert devices["7"]["current_state"] == 100
+        for task in superseded:
+            with pytest.raises(BridgeResponseError):
+                await task
+    finally:
+        await bridge.target.close()
 
 
 @pytest.mark.asyncio
-async def test_stop_cover(bridge: Bridge, event_loop):
-    """Test that stopping a cover produces the right commands."""
-    task = event_loop.create_task(bridge.target.stop_cover("7"))
-    command, _ = await bridge.leap.requests.get()
-    assert command == Request(
-        communique_type="CreateRequest",
-        url="/zone/6/commandprocessor",
-        body={"Command": {"CommandType": "Stop"}},
-    )
-    bridge.leap.requests.task_done()
-    task.cancel()
+async def test_cover_commands_coalesced_in_order(event_loop):
+    """Test that cover commands wait their turn and are never replaced."""
+    bridge = Bridge(coalesce_commands=True)
+    await bridge.initialize()
+
+    def _command_type(command: Request) -> Any:
+        assert command.body is not None
+        body = command.body["Command"]
+        if body["CommandType"] == "GoToLevel":
+            return body["Parameter"][0]["Value"]
+        return body["CommandType"]
+
+    try:
+        tasks = [event_loop.create_task(bridge.target.set_value("7", 50))]
+        command, response = await bridge.leap.requests.get()
+        assert _command_type(command) == 50
+
+        # these arrive while the first command is in flight
+        tasks.append(event_loop.create_task(bridge.target.stop_cover("7")))
+        await asyncio.sleep(0)
+        tasks.append(event_loop.create_task(bridge.target.set_value("7", 60)))
+        await asyncio.sleep(0)
+        tasks.append(event_loop.create_task(bridge.target.set_value("7", 70)))
+        await asyncio.sleep(0)
+        tasks.append(event_loop.create_task(bridge.target.raise_cover("7")))
+        await asyncio.sleep(0)
+        assert bridge.leap.requests.empty()
+
+        sent = [_command_type(command)]
+        while len(sent) < 4:
+            response.set_result(_level_command_response("6", 0))
+            bridge.leap.requests.task_done()
+            command, response = await bridge.leap.requests.get()
+            sent.append(_command_type(command))
+        response.set_result(_level_command_response("6", 100))
+        bridge.leap.requests.task_done()
+
+        await asyncio.gather(*tasks)
+        assert bridge.leap.requests.empty()
+        assert sent == [50, "Stop", 70, "Raise"]
+    finally:
+        await bridge.target.close()
 
 
 @pytest.mark.asyncio
-async def test_activate_scene(bridge: Bridge, event_loop):
-    """Test that activating scenes produces the right commands."""
-    task = event_loop.create_task(bridge.target.activate_scene("1"))
-    command, _ = await bridge.leap.requests.get()
-    assert command == Request(
-        communique_type="CreateRequest",
-        url="/virtualbutton/1/commandprocessor",
-        body={"Command": {"CommandType": "PressAndRelease"}},
-    )
+async def test_request_priorities(bridge: Bridge, event_loop):
+    """Test that login reads are bulk requests and commands are interactive."""
+    for url in (
+        "/project",
+        "/device",
+        "/virtualbutton",
+        "/area",
+        "/occupancygroup",
+        "/occupancygroup/status",
+        "/zone/status",
+    ):
+        assert bridge.leap.priorities[url] == PRIORITY_BULK
+
+    task = event_loop.create_task(bridge.target.set_value("2", 50))
+    _, response = await bridge.leap.requests.get()
+    response.set_result(_level_command_response("1", 50))
     bridge.leap.requests.task_done()
-    task.cancel()
+    await task
+
+    assert bridge.leap.priorities["/zone/1/commandprocessor"] == PRIORITY_INTERACTIVE
 
 
 @pytest.mark.asyncio
-async def test_reconnect_eof(bridge: Bridge, event_loop):
-    """Test that SmartBridge can reconnect on disconnect."""
+async def test_reconnect_reuses_topology(bridge: Bridge, event_loop):
+    """Test that the topology is only read again if the project was modified."""
     time = 0.0
     event_loop.time = lambda: time
 
-    bridge.disconnect()
+    async def reconnect():
+        nonlocal time
+        bridge.disconnect()
+        await asyncio.sleep(0.0)
+        time += smartbridge.RECONNECT_DELAY
+        await bridge.accept_connection()
+        await bridge.target._login_task  # pylint: disable=protected-access
 
-    await asyncio.sleep(0.0)
+    # the harness fails if the topology is read when it is not expected
+    bridge.device_list_result = Response(
+        CommuniqueType="ReadResponse",
+        Header=ResponseHeader(StatusCode=ResponseStatus(200, "OK"), Url="/device"),
+        Body={"Devices": []},
+    )
+    await reconnect()
+    assert len(bridge.target.get_devices()) == 7
+    assert bridge.target.get_device_by_zone_id("1")["device_id"] == "2"
+
+    bridge.modify_project()
+    bridge.device_list_result = response_from_json_file("devices.json")
+    await reconnect()
+    assert len(bridge.target.get_devices()) == 7
+
+
+@pytest.mark.asyncio
+async def test_reconnect_without_project(bridge_uninit: Bridge, event_loop):
+    """Test that the topology is always read if the project cannot be read."""
+    bridge = bridge_uninit
+    bridge.project_result = Response(
+        CommuniqueType="ReadResponse",
+        Header=ResponseHeader(
+            StatusCode=ResponseStatus(404, "Not Found"), Url="/project"
+        ),
+    )
+    await bridge.initialize()
+
+    time = 0.0
+    event_loop.time = lambda: time
+    bridge.disconnect()
+    await asyncio.sleep(0.0)
+    time += smartbridge.RECONNECT_DELAY
+    await bridge.accept_connection()
+    await bridge.target._login_task  # pylint: disable=protected-access
+
+    assert bridge.target.get_device_by_zone_id("1")["device_id"] == "2"
+
+
+@pytest.mark.asyncio
+async def test_topology_cache_cold_start(tmp_path):
+    """Test that connecting with a cached topology does not wait for the bridge."""
+    path = str(tmp_path / "topology.json")
+    first = Bridge(topology_cache=TopologyCache(path, "bridge"))
+    await first.initialize()
+    await first.target.close()
+
+    second = Bridge(topology_cache=TopologyCache(path, "bridge"))
+    try:
+        await asyncio.wait_for(second.target.connect(), 1.0)
+        assert not second.target.logged_in
+        assert len(second.target.get_devices()) == 7
+        assert second.target.get_device_by_zone_id("1")["device_id"] == "2"
+        assert second.target.get_scenes() == first.target.get_scenes()
+
+        # the project is unchanged, so only the state is read from the bridge
+        second._loaded_project = (  # pylint: disable=protected-access
+            second.project_result.Body
+        )
+        await second.accept_connection()
+        await second.target._login_completed  # pylint: disable=protected-access
+        assert second.target.logged_in
+    finally:
+        await second.target.close()
+
+
+@pytest.mark.asyncio
+async def test_topology_cache_reconciled(tmp_path):
+    """Test that subscribers are told how the bridge differs from the cache."""
+    path = str(tmp_path / "topology.json")
+    first = Bridge(topology_cache=TopologyCache(path, "bridge"))
+    await first.initialize()
+    await first.target.close()
+
+    second = Bridge(topology_cache=TopologyCache(path, "bridge"))
+    second.modify_project()
+    devices = response_from_json_file("devices.json")
+    devices.Body["Devices"] = [
+        device for device in devices.Body["Devices"] if device["href"] != "/device/7"
+    ]
+    for device in devices.Body["Devices"]:
+        if device["href"] == "/device/2":
+            device["FullyQualifiedName"] = ["Hallway", "Ceiling"]
+    second.device_list_result = devices
+
+    changes = []
+    second.target.add_topology_subscriber(changes.append)
+    try:
+        await second.target.connect()
+        assert "7" in second.target.get_devices()
+
+        await second.accept_connection()
+        await second.target._login_completed  # pylint: disable=protected-access
+        assert changes == [
+            smartbridge.TopologyChanges(
+                devices_removed=frozenset({"7"}), devices_changed=frozenset({"2"})
+            )
+        ]
+        assert "7" not in second.target.get_devices()
+        assert second.target.get_device_by_id("2")["name"] == "Hallway_Ceiling"
+    finally:
+        await second.target.close()
+
+    # the cache now holds the new topology
+    third = Bridge(topology_cache=TopologyCache(path, "bridge"))
+    try:
+        await third.target.connect()
+        assert "7" not in third.target.get_devices()
+    finally:
+        await third.target.close()
+
+
+@pytest.mark.asyncio
+async def test_reload_prunes_topology(bridge: Bridge, event_loop):
+    """Test that removed records are pruned, but their subscribers are kept."""
+    time = 0.0
+    event_loop.time = lambda: time
+
+    async def reconnect():
+        nonlocal time
+        bridge.disconnect()
+        await asyncio.sleep(0.0)
+        time += smartbridge.RECONNECT_DELAY
+        bridge.modify_project()
+        await bridge.accept_connection()
+        await bridge.target._login_task  # pylint: disable=protected-access
+
+    device_notified = []
+    bridge.target.add_subscriber("2", lambda: device_notified.append(True))
+    occupancy_notified = []
+    bridge.target.add_occupancy_subscriber("3", lambda: occupancy_notified.append(True))
+
+    devices = response_from_json_file("devices.json")
+    assert devices.Body is not None
+    devices.Body["Devices"] = [
+        device for device in devices.Body["Devices"] if device["href"] != "/device/2"
+    ]
+    bridge.device_list_result = devices
+    areas = response_from_json_file("areas.json")
+    assert areas.Body is not None
+    areas.Body["Areas"] = [
+        area for area in areas.Body["Areas"] if area["href"] != "/area/4"
+    ]
+    bridge.area_list_result = areas
+    await reconnect()
+
+    assert "2" not in bridge.target.devices
+    assert "4" not in bridge.target.areas
+    # the occupancy group of the removed area is skipped, and so is removed too
+    assert "3" not in bridge.target.occupancy_groups
+    assert "2" in bridge.target.occupancy_groups
+
+    bridge.device_list_result = response_from_json_file("devices.json")
+    bridge.area_list_result = response_from_json_file("areas.json")
+    await reconnect()
+    assert "4" in bridge.target.areas
+    assert occupancy_notified
+
+    device_notified.clear()
+    bridge.leap.send_to_subscribers(_zone_status_event("1", 50))
+    assert bridge.target.get_device_by_id("2")["current_state"] == 50
+    assert device_notified
+
+
+def _zone_status_event(zone_id: str, level: int) -> Response:
+    return Response(
+        CommuniqueType="ReadResponse",
+        Header=ResponseHeader(
+            MessageBodyType="OneZoneStatus",
+            StatusCode=ResponseStatus(200, "OK"),
+            Url="/zone/status",
+        ),
+        Body={
+            "ZoneStatus": {
+                "href": f"/zone/{zone_id}/status",
+                "Level": level,
+                "Zone": {"href": f"/zone/{zone_id}"},
+                "StatusAccuracy": "Good",
+            }
+        },
+    )
+
+
+@pytest.mark.asyncio
+async def test_reconnect_skips_unchanged_zone_status(bridge: Bridge, event_loop):
+    """Test that reconnecting only notifies subscribers when zones changed."""
+    notifications = 0
+
+    def callback():
+        nonlocal notifications
+        notifications += 1
+
+    bridge.target.add_subscriber("2", callback)
+
+    time = 0.0
+    event_loop.time = lambda: time
+
+    bridge.disconnect()
+    await asyncio.sleep(0.0)
+    time += smartbridge.RECONNECT_DELAY
+    await bridge.accept_connection()
+    await bridge.target._login_task  # pylint: disable=protected-access
+    assert notifications == 0
+
+    bridge.leap.send_to_subscribers(_zone_status_event("1", 50))
+    assert notifications == 1
+    assert bridge.target.get_device_by_id("2")["current_state"] == 50
+
+    # the snapshot is the same as the first one, but an event came in between
+    bridge.disconnect()
+    await asyncio.sleep(0.0)
+    time += smartbridge.RECONNECT_DELAY
+    await bridge.accept_connection()
+    await bridge.target._login_task  # pylint: disable=protected-access
+    assert notifications == 2
+    assert bridge.target.get_device_by_id("2")["current_state"] == 0
+
+
+@pytest.mark.asyncio
+async def test_leap_subscription_replayed(bridge: Bridge, event_loop):
+    """Test that added subscriptions are made again after a reconnect."""
+    received: List[Response] = []
+    snapshot = Response(
+        CommuniqueType="SubscribeResponse",
+        Header=ResponseHeader(
+            StatusCode=ResponseStatus(200, "OK"), Url="/button/101/status/event"
+        ),
+        Body={"ButtonStatus": {"ButtonEvent": {"EventType": "Release"}}},
+    )
+
+    task = event_loop.create_task(
+        bridge.target.add_leap_subscription("/button/101/status/event", received.append)
+    )
+    request, response = await bridge.leap.requests.get()
+    assert request == Request(
+        communique_type="SubscribeRequest", url="/button/101/status/event"
+    )
+    response.set_result(snapshot)
+    bridge.leap.requests.task_done()
+    assert await task == snapshot
+    assert received == [snapshot]
+
+    time = 0.0
+    event_loop.time = lambda: time
+
+    async def reconnect():
+        nonlocal time
+        bridge.disconnect()
+        await asyncio.sleep(0.0)
+        time += smartbridge.RECONNECT_DELAY
+        await bridge.accept_connection()
+        request, response = await bridge.leap.requests.get()
+        assert request == Request(
+            communique_type="SubscribeRequest", url="/button/101/status/event"
+        )
+        assert bridge.leap.priorities[request.url] == PRIORITY_BULK
+        response.set_result(snapshot)
+        bridge.leap.requests.task_done()
+        await bridge.target._login_task  # pylint: disable=protected-access
+
+    # an unchanged snapshot is not delivered again
+    await reconnect()
+    assert received == [snapshot]
+
+    event = snapshot._replace(CommuniqueType="ReadResponse")
+    bridge.leap.send_to_subscribers(event)
+    assert received == [snapshot, event]
+
+    await reconnect()
+    assert received == [snapshot, event, snapshot]
+
+    task = event_loop.create_task(
+        bridge.target.remove_leap_subscription("/button/101/status/event")
+    )
+    request, response = await bridge.leap.requests.get()
+    assert request == Request(
+        communique_type="UnsubscribeRequest", url="/button/101/status/event"
+    )
+    response.set_result(snapshot._replace(CommuniqueType="UnsubscribeResponse"))
+    bridge.leap.requests.task_done()
+    await task
+
+    bridge.leap.send_to_subscribers(event)
+    assert len(received) == 3
+    with pytest.raises(ValueError):
+        await bridge.target.add_leap_subscription("/zone/status", received.append)
+
+
+@pytest.mark.asyncio
+async def test_remove_leap_subscription_rejected(bridge: Bridge, event_loop):
+    """Test that a subscription the bridge would not end is kept."""
+    received: List[Response] = []
+    snapshot = Response(
+        CommuniqueType="SubscribeResponse",
+        Header=ResponseHeader(
+            StatusCode=ResponseStatus(200, "OK"), Url="/button/101/status/event"
+        ),
+    )
+    task = event_loop.create_task(
+        bridge.target.add_leap_subscription("/button/101/status/event", received.append)
+    )
+    _, response = await bridge.leap.requests.get()
+    response.set_result(snapshot)
+    bridge.leap.requests.task_done()
+    await task
+
+    task = event_loop.create_task(
+        bridge.target.remove_leap_subscription("/button/101/status/event")
+    )
+    _, response = await bridge.leap.requests.get()
+    response.set_result(
+        Response(
+            CommuniqueType="ExceptionResponse",
+            Header=ResponseHeader(
+                StatusCode=ResponseStatus(500, "Internal Server Error"),
+                Url="/button/101/status/event",
+            ),
+        )
+    )
+    bridge.leap.requests.task_done()
+    with pytest.raises(BridgeResponseError):
+        await task
+
+    event = snapshot._replace(CommuniqueType="ReadResponse")
+    bridge.leap.send_to_subscribers(event)
+    assert received == [snapshot, event]
+    # the subscription is still registered, so it cannot be added twice
+    with pytest.raises(ValueError):
+        await bridge.target.add_leap_subscription(
+            "/button/101/status/event", received.append
+        )
+
+
+@pytest.mark.asyncio
+async def test_leap_subscription_before_connect(bridge_uninit: Bridge):
+    """Test that subscriptions added before connecting are made during login."""
+    received: List[Response] = []
+    assert (
+        await bridge_uninit.target.add_leap_subscription(
+            "/button/101/status/event", received.append
+        )
+        is None
+    )
+
+    connect_task = asyncio.get_running_loop().create_task(
+        bridge_uninit.target.connect()
+    )
+    leap = await bridge_uninit.connections.get()
+    await bridge_uninit._accept_connection(  # pylint: disable=protected-access
+        leap, lambda coro: coro
+    )
+    request, response = await leap.requests.get()
+    assert request.url == "/button/101/status/event"
+    assert not connect_task.done()
+    response.set_result(
+        Response(
+            CommuniqueType="SubscribeResponse",
+            Header=ResponseHeader(
+                StatusCode=ResponseStatus(200, "OK"), Url=request.url
+            ),
+        )
+    )
+    leap.requests.task_done()
+    await connect_task
+    assert len(received) == 1
+
+
+@pytest.mark.asyncio
+async def test_leap_subscription_during_login(bridge_uninit: Bridge):
+    """Test that a subscription added after login has subscribed is made at once."""
+    bridge = bridge_uninit
+    bridge.zone_status_subscription_result = ZONE_STATUS_NOT_SUPPORTED
+    loop = asyncio.get_running_loop()
+    received: List[Response] = []
+    add_task: Optional[asyncio.Task] = None
+    zone_reads = 0
+
+    async def wait(coro):
+        nonlocal add_task, zone_reads
+        request, response = await coro
+        if (
+            request.url.startswith("/zone/")
+            and request.communique_type == "ReadRequest"
+        ):
+            zone_reads += 1
+        if zone_reads == 3 and add_task is None:
+            # the subscriptions were made, and the zones are being read
+            assert not bridge.target.logged_in
+            add_task = loop.create_task(
+                bridge.target.add_leap_subscription(
+                    "/button/101/status/event", received.append
+                )
+            )
+        return request, response
+
+    connect_task = loop.create_task(bridge.target.connect())
+    leap = await bridge.connections.get()
+    await bridge._accept_connection(leap, wait)  # pylint: disable=protected-access
+
+    request, response = await asyncio.wait_for(leap.requests.get(), 1.0)
+    assert request == Request(
+        communique_type="SubscribeRequest", url="/button/101/status/event"
+    )
+    snapshot = Response(
+        CommuniqueType="SubscribeResponse",
+        Header=ResponseHeader(StatusCode=ResponseStatus(200, "OK"), Url=request.url),
+    )
+    response.set_result(snapshot)
+    leap.requests.task_done()
+    assert add_task is not None
+    assert await add_task == snapshot
+    await connect_task
+    assert received == [snapshot]
+
+
+@pytest.mark.asyncio
+async def test_internal_subscriptions_not_removable(bridge: Bridge):
+    """Test that the subscriptions Smartbridge makes itself cannot be removed."""
+    for url in ("/zone/status", "/occupancygroup/status"):
+        with pytest.raises(KeyError):
+            await bridge.target.remove_leap_subscription(url)
+    assert bridge.leap.requests.empty()
+
+    bridge.leap.send_unsolicited(
+        Response(
+            CommuniqueType="ReadResponse",
+            Header=ResponseHeader(
+                MessageBodyType="OneZoneStatus",
+                StatusCode=ResponseStatus(200, "OK"),
+                Url="/zone/1/status",
+            ),
+            Body={"ZoneStatus": {"Level": 100, "Zone": {"href": "/zone/1"}}},
+        )
+    )
+    assert bridge.target.get_device_by_zone_id("1")["current_state"] == 100
+
+
+@pytest.mark.asyncio
+async def test_leap_subscription_handler_error(bridge_uninit: Bridge):
+    """Test that a subscriber that raises does not stop the login."""
+    received: List[Response] = []
+
+    def fail(response: Response):
+        received.append(response)
+        raise RuntimeError("subscriber failed")
+
+    await bridge_uninit.target.add_leap_subscription("/button/101/status/event", fail)
+    await bridge_uninit.target.add_leap_subscription(
+        "/button/102/status/event", received.append
+    )
+
+    connect_task = asyncio.get_running_loop().create_task(
+        bridge_uninit.target.connect()
+    )
+    leap = await bridge_uninit.connections.get()
+    await bridge_uninit._accept_connection(  # pylint: disable=protected-access
+        leap, lambda coro: coro
+    )
+    for _ in range(2):
+        request, response = await leap.requests.get()
+        response.set_result(
+            Response(
+                CommuniqueType="SubscribeResponse",
+                Header=ResponseHeader(
+                    StatusCode=ResponseStatus(200, "OK"), Url=request.url
+                ),
+            )
+        )
+        leap.requests.task_done()
+    await connect_task
+
+    assert bridge_uninit.target.logged_in
+    assert {response.Header.Url for response in received} == {
+        "/button/101/status/event",
+        "/button/102/status/event",
+    }
+
+
+@pytest.mark.asyncio
+async def test_execute_batch(bridge: Bridge, event_loop):
+    """Test that batched commands are pipelined and report results per command."""
+    task = event_loop.create_task(
+        bridge.target.execute_batch(
+            [
+                smartbridge.BatchCommand("2", 30, fade_time=timedelta(seconds=2)),
+                ("3", FAN_MEDIUM),
+                ("7", COVER_LOWER),
+                ("999", 100),
+            ]
+        )
+    )
+
+    # every command is sent before any of them is answered
+    requests = {}
+    for _ in range(3):
+        command, response = await bridge.leap.requests.get()
+        requests[command.url] = (command, response)
+        bridge.leap.requests.task_done()
+
+    command, response = requests["/zone/1/commandprocessor"]
+    assert command.body == {
+        "Command": {
+            "CommandType": "GoToDimmedLevel",
+            "DimmedLevelParameters": {"Level": 30, "FadeTime": "00:00:02"},
+        }
+    }
+    response.set_result(_level_command_response("1", 30))
+
+    command, response = requests["/zone/2/commandprocessor"]
+    assert command.body == {
+        "Command": {
+            "CommandType": "GoToFanSpeed",
+            "FanSpeedParameters": {"FanSpeed": "Medium"},
+        }
+    }
+    response.set_result(
+        Response(
+            CommuniqueType="CreateResponse",
+            Header=ResponseHeader(
+                StatusCode=ResponseStatus(400, "Bad Request"),
+                Url="/zone/2/commandprocessor",
+            ),
+        )
+    )
+
+    command, response = requests["/zone/6/commandprocessor"]
+    assert command.body == {"Command": {"CommandType": "Lower"}}
+    response.set_result(
+        Response(
+            CommuniqueType="CreateResponse",
+            Header=ResponseHeader(
+                StatusCode=ResponseStatus(201, "Created"),
+                Url="/zone/6/commandprocessor",
+            ),
+        )
+    )
+
+    results = await task
+    assert results[0] is None
+    assert isinstance(results[1], BridgeResponseError)
+    assert results[2] is None
+    assert isinstance(results[3], KeyError)
+    assert bridge.target.get_device_by_id("7")["current_state"] == 0
+
+
+@pytest.mark.asyncio
+async def test_execute_batch_concurrency_limit(bridge: Bridge, event_loop):
+    """Test that a batch keeps no more commands in flight than allowed."""
+    task = event_loop.create_task(
+        bridge.target.execute_batch(
+            [("2", 10), ("3", 20), ("7", 30)], max_concurrent_requests=2
+        )
+    )
+
+    first, first_response = await bridge.leap.requests.get()
+    bridge.leap.requests.task_done()
+    second, second_response = await bridge.leap.requests.get()
+    bridge.leap.requests.task_done()
+    await asyncio.sleep(0)
+    # the third command waits until one of the first two is answered
+    assert bridge.leap.requests.empty()
+
+    first_response.set_result(_level_command_response("1", 0))
+    third, third_response = await bridge.leap.requests.get()
+    bridge.leap.requests.task_done()
+    second_response.set_result(_level_command_response("1", 0))
+    third_response.set_result(_level_command_response("1", 0))
+
+    sent = [first.url, second.url, third.url]
+    assert await task == [None, None, None]
+    assert sorted(sent) == [
+        "/zone/1/commandprocessor",
+        "/zone/2/commandprocessor",
+        "/zone/6/commandprocessor",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_execute_batch_invalid(bridge: Bridge):
+    """Test that an invalid batch is rejected before anything is sent."""
+    for limit in (0, -1):
+        with pytest.raises(ValueError):
+            await bridge.target.execute_batch(
+                [("2", 10)], max_concurrent_requests=limit
+            )
+
+    for value in (50.0, None, True):
+        with pytest.raises(TypeError):
+            await bridge.target.execute_batch([("2", 10), ("3", value)])
+
+    assert bridge.leap.requests.empty()
+
+
+@pytest.mark.asyncio
+async def test_set_value_with_fade(bridge: Bridge, event_loop):
+    """Test that setting values with fade_time produces the right commands."""
+    task = event_loop.create_task(
+        bridge.target.set_value("2", 50, fade_time=timedelta(seconds=4))
+    )
+    command, _ = await bridge.leap.requests.get()
+    assert command == Request(
+        communique_type="CreateRequest",
+        url="/zone/1/commandprocessor",
+        body={
+            "Command": {
+                "CommandType": "GoToDimmedLevel",
+                "DimmedLevelParameters": {"Level": 50, "FadeTime": "00:00:04"},
+            }
+        },
+    )
+    bridge.leap.requests.task_done()
+    task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_set_fan(bridge: Bridge, event_loop):
+    """Test that setting fan speed produces the right commands."""
+    task = event_loop.create_task(bridge.target.set_fan("2", FAN_MEDIUM))
+    command, _ = await bridge.leap.requests.get()
+    assert command == Request(
+        communique_type="CreateRequest",
+        url="/zone/1/commandprocessor",
+        body={
+            "Command": {
+                "CommandType": "GoToFanSpeed",
+                "FanSpeedParameters": {"FanSpeed": "Medium"},
+            }
+        },
+    )
+    bridge.leap.requests.task_done()
+    task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_lower_cover(bridge: Bridge, event_loop):
+    """Test that lowering a cover produces the right commands."""
+    devices = bridge.target.get_devices()
+    task = event_loop.create_task(bridge.target.lower_cover("7"))
+    command, response = await bridge.leap.requests.get()
+    assert command == Request(
+        communique_type="CreateRequest",
+        url="/zone/6/commandprocessor",
+        body={"Command": {"CommandType": "Lower"}},
+    )
+    # the real response probably contains more data
+    response.set_result(
+        Response(
+            CommuniqueType="CreateResponse",
+            Header=ResponseHeader(
+                StatusCode=ResponseStatus(201, "Created"),
+                Url="/zone/6/commandprocessor",
+            ),
+        ),
+    )
+    bridge.leap.requests.task_done()
+    await task
+    assert devices["7"]["current_state"] == 0
+
+
+@pytest.mark.asyncio
+async def test_raise_cover(bridge: Bridge, event_loop):
+    """Test that raising a cover produces the right commands."""
+    devices = bridge.target.get_devices()
+    task = event_loop.create_task(bridge.target.raise_cover("7"))
+    command, response = await bridge.leap.requests.get()
+    assert command == Request(
+        communique_type="CreateRequest",
+        url="/zone/6/commandprocessor",
+        body={"Command": {"CommandType": "Raise"}},
+    )
+    # the real response probably contains more data
+    response.set_result(
+        Response(
+            CommuniqueType="CreateResponse",
+            Header=ResponseHeader(
+                StatusCode=ResponseStatus(201, "Created"),
+                Url="/zone/6/commandprocessor",
+            ),
+        ),
+    )
+    bridge.leap.requests.task_done()
+    await task
+    assert devices["7"]["current_state"] == 100
+
+
+@pytest.mark.asyncio
+async def test_stop_cover(bridge: Bridge, event_loop):
+    """Test that stopping a cover produces the right commands."""
+    task = event_loop.create_task(bridge.target.stop_cover("7"))
+    command, _ = await bridge.leap.requests.get()
+    assert command == Request(
+        communique_type="CreateRequest",
+        url="/zone/6/commandprocessor",
+        body={"Command": {"CommandType": "Stop"}},
+    )
+    bridge.leap.requests.task_done()
+    task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_activate_scene(bridge: Bridge, event_loop):
+    """Test that activating scenes produces the right commands."""
+    task = event_loop.create_task(bridge.target.activate_scene("1"))
+    command, _ = await bridge.leap.requests.get()
+    assert command == Request(
+        communique_type="CreateRequest",
+        url="/virtualbutton/1/commandprocessor",
+        body={"Command": {"CommandType": "PressAndRelease"}},
+    )
+    bridge.leap.requests.task_done()
+    task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_eof(bridge: Bridge, event_loop):
+    """Test that SmartBridge can reconnect on disconnect."""
+    time = 0.0
+    event_loop.time = lambda: time
+
+    bridge.disconnect()
+
+    await asyncio.sleep(0.0)
     time += smartbridge.RECONNECT_DELAY
 
     await bridge.accept_connection()
@@ -950,3 +2088,323 @@ async def test_reconnect_timeout(event_loop):
     task.cancel()
 
     await bridge.target.close()
+
+
+async def _settle():
+    """Let the event loop run everything that is ready."""
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_ping_skipped_while_active(event_loop):
+    """Test that no ping is sent while messages are arriving."""
+    bridge = Bridge()
+
+    time = 0.0
+    event_loop.time = lambda: time
+
+    await bridge.initialize()
+
+    time = smartbridge.PING_INTERVAL - 10
+    bridge.leap.send_unsolicited(
+        Response(
+            CommuniqueType="ReadResponse",
+            Header=ResponseHeader(
+                MessageBodyType="OneZoneStatus", Url="/zone/1/status"
+            ),
+            Body={"ZoneStatus": {"Level": 50, "Zone": {"href": "/zone/1"}}},
+        )
+    )
+    time = smartbridge.PING_INTERVAL
+    await _settle()
+    assert bridge.leap.requests.empty()
+
+    time = 2 * smartbridge.PING_INTERVAL - 10
+    ping, response = await bridge.leap.requests.get()
+    assert ping == Request(communique_type="ReadRequest", url="/server/1/status/ping")
+    response.set_result(
+        Response(Header=ResponseHeader(StatusCode=ResponseStatus(200, "OK")))
+    )
+    bridge.leap.requests.task_done()
+
+    await _settle()
+    assert bridge.leap.requests.empty()
+
+    await bridge.target.close()
+
+
+@pytest.mark.asyncio
+async def test_ping_after_request_timeout(event_loop):
+    """Test that a request that times out makes the bridge ping right away."""
+    bridge = Bridge(ping_timeout=1.0)
+
+    time = 0.0
+    event_loop.time = lambda: time
+
+    await bridge.initialize()
+
+    task = event_loop.create_task(bridge.target.set_value("2", 50))
+    command, _ = await bridge.leap.requests.get()
+    assert command.url == "/zone/1/commandprocessor"
+    bridge.leap.requests.task_done()
+
+    time += smartbridge.REQUEST_TIMEOUT
+    with pytest.raises(asyncio.TimeoutError):
+        await task
+
+    ping, _ = await bridge.leap.requests.get()
+    assert ping == Request(communique_type="ReadRequest", url="/server/1/status/ping")
+    bridge.leap.requests.task_done()
+
+    time += 1.0
+    await bridge.leap.running
+    time += smartbridge.RECONNECT_DELAY
+    await bridge.accept_connection()
+
+    await bridge.target.close()
+
+
+@pytest.mark.asyncio
+async def test_ping_interval(event_loop):
+    """Test that the ping interval and timeout can be configured."""
+    bridge = Bridge(ping_interval=10.0, ping_timeout=1.0)
+
+    time = 0.0
+    event_loop.time = lambda: time
+
+    await bridge.initialize()
+
+    time = 10.0
+    ping, _ = await bridge.leap.requests.get()
+    assert ping == Request(communique_type="ReadRequest", url="/server/1/status/ping")
+    bridge.leap.requests.task_done()
+
+    time += 1.0
+    await bridge.leap.running
+
+    await bridge.target.close()
+
+
+@pytest.mark.asyncio
+async def test_ping_late_while_active(event_loop):
+    """Test that a late ping does not close a connection that is still active."""
+    bridge = Bridge()
+
+    time = 0.0
+    event_loop.time = lambda: time
+
+    await bridge.initialize()
+
+    time = smartbridge.PING_INTERVAL
+    ping, _ = await bridge.leap.requests.get()
+    assert ping == Request(communique_type="ReadRequest", url="/server/1/status/ping")
+    bridge.leap.requests.task_done()
+
+    time += 1.0
+    bridge.leap.send_unsolicited(
+        Response(
+            CommuniqueType="ReadResponse",
+            Header=ResponseHeader(
+                MessageBodyType="OneZoneStatus", Url="/zone/1/status"
+            ),
+            Body={"ZoneStatus": {"Level": 50, "Zone": {"href": "/zone/1"}}},
+        )
+    )
+    time += smartbridge.PING_TIMEOUT
+    await _settle()
+    assert not bridge.leap.running.done()
+
+    await bridge.target.close()
+
+
+def test_ping_settings_invalid():
+    """Test that the ping interval and timeout must be positive."""
+    with pytest.raises(ValueError):
+        smartbridge.Smartbridge(None, ping_interval=0)
+    with pytest.raises(ValueError):
+        smartbridge.Smartbridge(None, ping_timeout=-1)
+
+
+def test_reconnect_policy():
+    """Test the reconnect delays grow exponentially up to a limit."""
+    policy = smartbridge.ReconnectPolicy(
+        initial_delay=1.0, max_delay=10.0, multiplier=2.0, jitter=0.0
+    )
+    assert [policy.delay(attempt) for attempt in range(7)] == [
+        0.0,
+        1.0,
+        2.0,
+        4.0,
+        8.0,
+        10.0,
+        10.0,
+    ]
+    assert policy.delay(1000) == 10.0
+
+    policy = policy._replace(jitter=0.5, immediate_first_retry=False)
+    assert policy.delay(0, lambda: 0.0) == 1.0
+    assert policy.delay(0, lambda: 0.5) == 0.75
+    assert policy.delay(2, lambda: 1.0) == 2.0
+
+
+@pytest.mark.asyncio
+async def test_reconnect_backoff(event_loop):
+    """Test that failing connections back off until a login succeeds."""
+    bridge = Bridge(
+        reconnect_policy=smartbridge.ReconnectPolicy(
+            initial_delay=1.0, max_delay=3.0, jitter=0.0
+        )
+    )
+    changes: List[smartbridge.ConnectionStateChange] = []
+    bridge.target.add_connection_state_subscriber(changes.append)
+
+    time = 0.0
+    event_loop.time = lambda: time
+
+    await bridge.initialize()
+    assert bridge.target.connection_state == smartbridge.ConnectionState.READY
+
+    async def fail_connection(delay: float):
+        nonlocal time
+        leap = await bridge.connections.get()
+        bridge.connections.task_done()
+        leap.running.set_exception(ConnectionError())
+        await _settle()
+        assert bridge.target.connection_state == (
+            smartbridge.ConnectionState.BACKING_OFF
+        )
+        assert changes[-1].delay == delay
+        time += delay
+
+    bridge.disconnect(ConnectionError())
+    for delay in (1.0, 2.0, 3.0, 3.0):
+        await fail_connection(delay)
+
+    await bridge.accept_connection()
+    await bridge.target._login_task  # pylint: disable=protected-access
+    assert bridge.target.connection_state == smartbridge.ConnectionState.READY
+
+    # the first retry after a successful login is immediate again
+    bridge.disconnect()
+    await bridge.accept_connection()
+    await bridge.target._login_task  # pylint: disable=protected-access
+    assert [change.state for change in changes[-4:]] == [
+        smartbridge.ConnectionState.BACKING_OFF,
+        smartbridge.ConnectionState.CONNECTING,
+        smartbridge.ConnectionState.LOGGING_IN,
+        smartbridge.ConnectionState.READY,
+    ]
+    assert changes[-4].delay == 0.0
+
+    assert [change.state for change in changes[:5]] == [
+        smartbridge.ConnectionState.CONNECTING,
+        smartbridge.ConnectionState.LOGGING_IN,
+        smartbridge.ConnectionState.READY,
+        smartbridge.ConnectionState.BACKING_OFF,
+        smartbridge.ConnectionState.CONNECTING,
+    ]
+    backoffs = [
+        change
+        for change in changes
+        if change.state == smartbridge.ConnectionState.BACKING_OFF
+    ]
+    assert [(change.attempt, change.delay) for change in backoffs] == [
+        (0, 0.0),
+        (1, 1.0),
+        (2, 2.0),
+        (3, 3.0),
+        (4, 3.0),
+        (0, 0.0),
+    ]
+    assert list(bridge.target.connection_history) == changes
+    assert all(
+        earlier.timestamp <= later.timestamp
+        for earlier, later in zip(changes, changes[1:])
+    )
+
+    await bridge.target.close()
+    assert bridge.target.connection_state == smartbridge.ConnectionState.DISCONNECTED
+
+
+@pytest.mark.asyncio
+async def test_connection_state_subscriber_error():
+    """Test that a connection state subscriber that raises does not stop reconnects."""
+    bridge = Bridge()
+    changes: List[smartbridge.ConnectionStateChange] = []
+
+    def fail(change: smartbridge.ConnectionStateChange):
+        changes.append(change)
+        raise RuntimeError("subscriber failed")
+
+    bridge.target.add_connection_state_subscriber(fail)
+    await bridge.initialize()
+    assert bridge.target.connection_state == smartbridge.ConnectionState.READY
+
+    bridge.disconnect()
+    await bridge.accept_connection()
+    await bridge.target._login_task  # pylint: disable=protected-access
+    assert bridge.target.connection_state == smartbridge.ConnectionState.READY
+    assert [change.state for change in changes] == [
+        smartbridge.ConnectionState.CONNECTING,
+        smartbridge.ConnectionState.LOGGING_IN,
+        smartbridge.ConnectionState.READY,
+        smartbridge.ConnectionState.BACKING_OFF,
+        smartbridge.ConnectionState.CONNECTING,
+        smartbridge.ConnectionState.LOGGING_IN,
+        smartbridge.ConnectionState.READY,
+    ]
+    await bridge.target.close()
+
+
+@pytest.mark.asyncio
+async def test_request_timeout_metrics(event_loop):
+    """Test that requests that time out are reported to the metrics sink."""
+    metrics = HistogramMetrics()
+    bridge = Bridge(metrics=metrics)
+
+    time = 0.0
+    event_loop.time = lambda: time
+
+    await bridge.initialize()
+
+    task = event_loop.create_task(bridge.target.set_value("2", 50))
+    await bridge.leap.requests.get()
+    bridge.leap.requests.task_done()
+
+    time += smartbridge.REQUEST_TIMEOUT
+    with pytest.raises(asyncio.TimeoutError):
+        await task
+
+    assert metrics.snapshot().timeouts == {
+        ("CreateRequest", "/zone/*/commandprocessor"): 1
+    }
+
+    await bridge.target.close()
+
+
+@pytest.mark.asyncio
+async def test_subscriber_tracing():
+    """Test that calls to device subscribers are traced."""
+    calls = []
+
+    class _Tracer(Tracer):
+        def on_callback(self, tag, target, duration, error):
+            calls.append((tag, target, error))
+
+    bridge = Bridge(tracer=_Tracer())
+    await bridge.initialize()
+
+    bridge.target.add_subscriber("2", lambda: None)
+    bridge.leap.send_unsolicited(
+        Response(
+            CommuniqueType="ReadResponse",
+            Header=ResponseHeader(
+                MessageBodyType="OneZoneStatus", Url="/zone/1/status"
+            ),
+            Body={"ZoneStatus": {"Level": 50, "Zone": {"href": "/zone/1"}}},
+        )
+    )
+    assert calls == [(None, "device:2", None)]
+
+    await bridge.target.close()
@@ -0,0 +1,76 @@
+"""Tests to validate the tracing hooks."""
+import io
+import json
+
+import pytest
+
+from pylutron_caseta.tracing import JsonlRecorder
+
+
+def test_jsonl_recorder():
+    """Test that events are written as compact lines of JSON."""
+    times = iter([10.0, 10.5, 11.0, 11.25, 12.0])
+    output = io.StringIO()
+    recorder = JsonlRecorder(output, clock=lambda: next(times))
+
+    recorder.on_send("0-1", "ReadRequest", "/device", 60)
+    recorder.on_receive("0-1", "ReadResponse", "/device", 500, 0.0001)
+    recorder.on_dispatch("0-1", "/device", "response", 1)
+    recorder.on_callback(None, "device:2", 0.002, ValueError())
+
+    assert output.getvalue().endswith("\n")
+    assert '"ev":"send"' in output.getvalue()
+    assert [json.loads(line) for line in output.getvalue().splitlines()] == [
+        {
+            "t": 0.5,
+            "ev": "send",
+            "tag": "0-1",
+            "type": "ReadRequest",
+            "url": "/device",
+            "size": 60,
+        },
+        {
+            "t": 1.0,
+            "ev": "receive",
+            "tag": "0-1",
+            "type": "ReadResponse",
+            "url": "/device",
+            "size": 500,
+            "parse": 0.0001,
+        },
+        {
+            "t": 1.25,
+            "ev": "dispatch",
+            "tag": "0-1",
+            "url": "/device",
+            "target": "response",
+            "count": 1,
+        },
+        {
+            "t": 2.0,
+            "ev": "callback",
+            "target": "device:2",
+            "duration": 0.002,
+            "error": "ValueError",
+        },
+    ]
+
+
+def test_call():
+    """Test that calls are timed and their errors are recorded."""
+    output = io.StringIO()
+    recorder = JsonlRecorder(output)
+
+    assert recorder.call("0-1", "subscription", lambda value: value * 2, 21) == 42
+
+    def fail():
+        raise KeyError()
+
+    with pytest.raises(KeyError):
+        recorder.call(None, "unsolicited", fail)
+
+    first, second = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert first["tag"] == "0-1"
+    assert "error" not in first
+    assert second["target"] == "unsolicited"
+    assert second["error"] == "KeyError"